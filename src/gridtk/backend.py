@@ -0,0 +1,1177 @@
+# Copyright © 2022 Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Defines the parts of the job managers that are common to all grid
+schedulers (see :py:mod:`gridtk.sge` and :py:mod:`gridtk.slurm`)."""
+
+from __future__ import annotations
+
+import abc
+import json
+import logging
+import math
+import os
+import socket
+import sys
+import time
+
+from datetime import datetime, timedelta
+
+from .manager import JobManager
+from .models import Job, add_job
+from .runner import set_array_task, unset_array_task
+from .tools import pe_slots
+
+logger = logging.getLogger(__name__)
+
+# The time limits of the queues known to jman, in seconds
+QUEUE_TIME_LIMITS = {
+    "q1d": 86400,
+    "q1dm": 86400,
+    "q_1day": 86400,
+    "q_1day_mth": 86400,
+    "q1w": 604800,
+    "q1wm": 604800,
+    "q_1week": 604800,
+    "q_1week_mth": 604800,
+    "q1m": 2592000,
+}
+
+# The queues that jobs submitted to the queue ``auto`` are sent to, shortest
+# first, for single- and for multi-threaded jobs
+AUTO_QUEUES = ("q1d", "q1w", "q1m")
+AUTO_QUEUES_PARALLEL = ("q1dm", "q1wm")
+
+# The queues that provide a GPU
+GPU_QUEUES = ("gpu", "lgpu", "sgpu", "gpum", "vsgpu")
+
+
+class GridJobManager(JobManager, abc.ABC):
+    """The base class of job managers that submit jobs to a grid scheduler.
+
+    Derived classes only need to implement the primitives that talk to the
+    scheduler: :py:meth:`_grid_submit`, :py:meth:`_grid_status`,
+    :py:meth:`_grid_delete` and :py:meth:`_grid_resources`.  All other
+    operations are implemented here on top of them, so that all jobs are
+    submitted in parallel, and the status of all jobs is queried at once.
+    """
+
+    #: The name of the scheduler, as used in log messages
+    scheduler = "grid"
+
+    #: The maximum number of jobs packed into a single array job
+    max_pack_size = 1000
+
+    #: The shortest and longest interval between two status checks of a job
+    #: in the grid, in seconds
+    poll_intervals = (10.0, 600.0)
+
+    #: The fraction of the age of a job after which it is checked again
+    poll_backoff = 0.5
+
+    #: The time given to the grid to kill a job that exceeds the time limit of
+    #: its queue, in seconds
+    poll_grace = 60.0
+
+    #: The maximum number of jobs whose status is checked in one call of
+    #: :py:meth:`communicate`
+    poll_budget = 1000
+
+    #: The percentile of the run times of earlier runs of a job that the queue
+    #: chosen for the queue ``auto`` needs to cover
+    auto_queue_percentile = 95.0
+
+    @abc.abstractmethod
+    def _grid_submit(self, **kwargs) -> int:
+        """Submits a single job to the scheduler.
+
+        This method may be called from several threads at once.
+
+
+        Parameters:
+
+            kwargs: The keyword arguments returned by
+                :py:meth:`_prepare_submission`
+
+
+        Returns:
+
+            The id assigned to the job by the scheduler
+        """
+
+    @abc.abstractmethod
+    def _grid_status(self) -> dict:
+        """Returns a snapshot of all our jobs currently known to the scheduler,
+        i.e., a dictionary mapping their ids to the status of their tasks."""
+
+    @abc.abstractmethod
+    def _grid_delete(self, ids: list[int]) -> dict[int, str]:
+        """Deletes the jobs with the given ids from the scheduler, and returns
+        the error messages of those that could not be deleted."""
+
+    def _grid_accounting(self, ids: list[int]) -> dict[int, str]:
+        """Returns the reasons why the jobs with the given ids, which
+        disappeared from the scheduler, ended (if the scheduler knows)."""
+        return {}
+
+    @abc.abstractmethod
+    def _grid_resources(
+        self, ids: list[int], accounting_file: str | None = None
+    ) -> dict:
+        """Returns the resources used by the finished jobs with the given ids,
+        in the format of :py:func:`gridtk.tools.parse_accounting`, optionally
+        reading them from the given accounting file."""
+
+    def _task_id(self, job_id: int, task: int) -> str:
+        """Returns the identifier of a single task of an array job, as
+        understood by :py:meth:`_grid_delete`."""
+        return "%d.%d" % (job_id, task)
+
+    def _grid_job_id(self, job):
+        """Returns the identifier of the given job for the scheduler, which
+        for packed jobs is the one of their task of the array job."""
+        if job.pack_index is None:
+            return job.id
+        return self._task_id(job.id, job.pack_index)
+
+    def _in_grid(self, job, snapshot):
+        """Tells if the given job is still known to the scheduler, according
+        to the given snapshot (see :py:meth:`_grid_status`)."""
+        if job.id not in snapshot:
+            return False
+        return job.pack_index is None or job.pack_index in snapshot[job.id]
+
+    def _wrap_command(self, python, command):
+        """Returns the command to submit, which runs the given wrapper script
+        command with the given python interpreter."""
+        return (python,) + tuple(command)
+
+    def _queue(self, kwargs):
+        """Returns the name of the queue a job is submitted to, given its
+        submission keyword arguments."""
+        queue = kwargs.get("queue")
+        if queue in (None, "all.q", "default"):
+            return "all.q"
+        return queue
+
+    def _run_time_limit(self, job):
+        """Returns the run time, in seconds, after which the given job is
+        killed by the grid: the run time it requested, if any, or otherwise the
+        time limit of its queue; ``None`` if unknown."""
+        return QUEUE_TIME_LIMITS.get(job.queue_name)
+
+    def _check_submission(self, kwargs):
+        """Warns about submission keyword arguments that the scheduler cannot
+        satisfy."""
+        pass
+
+    def _resubmission_arguments(self, arguments):
+        """Returns the submission keyword arguments to re-submit a job with."""
+        return arguments
+
+    def _run_times(self, command_line, name):
+        """Returns the run times, in seconds, of the earlier successful runs of
+        the given command line with the given name (of each task, for array
+        jobs)."""
+        query = self.session.query(Job).filter(Job.status == "success")
+        if name is None:
+            query = query.filter(Job.name.is_(None))
+        else:
+            query = query.filter(Job.name == name)
+        run_times = []
+        for job in query:
+            if job.get_command_line() != list(command_line):
+                continue
+            for run in job.array or [job]:
+                if run.start_time is not None and run.finish_time is not None:
+                    run_times.append(
+                        (run.finish_time - run.start_time).total_seconds()
+                    )
+        return run_times
+
+    def _auto_queue(self, command_line, name, kwargs):
+        """Returns the queue to submit a job to the queue ``auto`` to.
+
+        This is the shortest queue whose time limit covers
+        :py:attr:`auto_queue_percentile` of the run times of the earlier runs
+        of the same job, i.e., the same command line with the same name.  A job
+        that never ran before is sent to the queue of a week.
+        """
+        queues = AUTO_QUEUES_PARALLEL if kwargs.get("pe_opt") else AUTO_QUEUES
+        run_times = sorted(self._run_times(command_line, name))
+        if not run_times:
+            logger.info(
+                "Submitting job '%s' to the queue '%s', since it never ran before."
+                % (name, queues[1])
+            )
+            return queues[1]
+
+        rank = math.ceil(len(run_times) * self.auto_queue_percentile / 100)
+        run_time = run_times[max(rank, 1) - 1]
+        for queue in queues:
+            if QUEUE_TIME_LIMITS[queue] >= run_time:
+                break
+        else:
+            logger.warn(
+                "The earlier runs of job '%s' take longer than the queue '%s' allows."
+                % (name, queue)
+            )
+        logger.info(
+            "Submitting job '%s' to the queue '%s', since %g%% of its %d earlier runs took at most %s."
+            % (
+                name,
+                queue,
+                self.auto_queue_percentile,
+                len(run_times),
+                timedelta(seconds=round(run_time)),
+            )
+        )
+        return queue
+
+    def _memory_limit(self, kwargs):
+        """Returns the largest memory, in GB per slot, that the queue of the
+        given submission keyword arguments provides, or ``None`` if
+        unknown."""
+        return None
+
+    def _auto_memory(self, job, arguments, headroom):
+        """Sets the memory requirements in the given submission keyword
+        arguments to the peak memory used by the last run of the given job,
+        times the given headroom.
+
+        The requirements are set like ``jman submit --memory`` does, i.e., per
+        slot of the parallel environment, and are limited to what the queue
+        provides (see :py:meth:`_memory_limit`).
+        """
+        if not job.max_memory:
+            logger.warn(
+                "Keeping the memory requirements of job '%s', since its peak memory is not known."
+                % job
+            )
+            return arguments
+        slots = pe_slots(arguments.get("pe_opt"))
+        memory = max(1, math.ceil(job.max_memory * headroom / slots / 2**30))
+        limit = self._memory_limit(arguments)
+        if limit is not None and memory > limit:
+            logger.warn(
+                "Limiting the memory of job '%s' to the %dGB provided by the queue '%s'."
+                % (job, limit, self._queue(arguments))
+            )
+            memory = limit
+
+        queue = self._queue(arguments)
+        for key in ("memfree", "hvmem", "gpumem"):
+            arguments.pop(key, None)
+        if queue in GPU_QUEUES:
+            arguments["gpumem"] = "%d" % memory
+        else:
+            arguments["memfree"] = "%dG" % (memory * slots)
+            if queue != "all.q":
+                arguments["hvmem"] = "%dG" % memory
+        logger.info(
+            "Requesting %dGB of memory per slot for job '%s', which used at most %.1fGB."
+            % (memory, job, job.max_memory / 2**30)
+        )
+        return arguments
+
+    def _prepare_submission(
+        self, job, name, array, dependencies, log_dir, verbosity, kwargs
+    ):
+        """Returns the keyword arguments for :py:meth:`_grid_submit` that will
+        submit the given job to the grid."""
+        # ... what we will actually submit to the grid is a wrapper script that will call the desired command...
+        # get the name of the file that was called originally
+        jman = self.wrapper_script
+        python = sys.executable
+
+        # get the grid id's for the dependencies and remove duplicates
+        dependent_jobs = self.get_jobs(dependencies)
+        deps = sorted(list({j.id for j in dependent_jobs}))
+
+        # make sure log directory is created and is a directory
+        os.makedirs(job.log_dir, exist_ok=True)
+        assert os.path.isdir(
+            job.log_dir
+        ), "Please make sure --log-dir `{}' either does not exist or is a directory.".format(
+            job.log_dir
+        )
+
+        # generate call to the wrapper script
+        command = self._wrap_command(
+            python,
+            [jman, "-%sd" % ("v" * verbosity), self._database, "run-job"]
+            + (["--lean"] if self.lean else []),
+        )
+        q_array = "%d-%d:%d" % array if array else None
+        return dict(
+            command=command,
+            context=self.context,
+            name=name,
+            deps=deps,
+            array=q_array,
+            stdout=log_dir,
+            stderr=log_dir,
+            **kwargs,
+        )
+
+    def _finish_submission(self, job, grid_id, submit_kwargs, pack_index=None):
+        """Updates the job after it was submitted to the grid with the given
+        id, possibly as the given task of a packed array job."""
+        # without a name, the job is named after the submitted script
+        name = submit_kwargs["name"] or os.path.basename(self.wrapper_script)
+
+        # set the grid id of the job
+        job.pack_index = pack_index
+        job.queue(
+            new_job_id=grid_id,
+            new_job_name=name,
+            queue_name=self._queue(submit_kwargs),
+        )
+
+        logger.info(
+            "Submitted job '%s' with dependencies '%s' to the %s."
+            % (job, str(submit_kwargs["deps"]), self.scheduler)
+        )
+
+        self._check_submission(submit_kwargs)
+
+    def _submit_to_grid(
+        self, job, name, array, dependencies, log_dir, verbosity, **kwargs
+    ):
+        submit_kwargs = self._prepare_submission(
+            job, name, array, dependencies, log_dir, verbosity, kwargs
+        )
+        grid_id = self._grid_submit(**submit_kwargs)
+        self._finish_submission(job, grid_id, submit_kwargs)
+        return job.unique
+
+    def _submit_many_to_grid(self, submissions, workers=8):
+        """Submits several jobs to the grid, with concurrent submissions.
+
+        Jobs are submitted as soon as all jobs of the batch they depend on
+        have been assigned a grid id, so that their dependencies can be passed
+        on to the scheduler.  The database is committed after each round of
+        finished submissions, so that running jobs can always find their grid
+        id.
+
+
+        Parameters:
+
+            submissions: A list of tuples ``(job, name, array, dependencies,
+                log_dir, verbosity, kwargs)``, one for each job, with the same
+                meaning as the parameters of :py:meth:`_submit_to_grid`.  A
+                pack of jobs (see :py:meth:`_pack`) is given as a list of jobs
+                in place of ``job``, and submitted as a single array job.
+
+            workers: The maximum number of concurrent submissions
+        """
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        def _jobs(submission):
+            job = submission[0]
+            return job if isinstance(job, list) else [job]
+
+        batch = {_jobs(s)[0].unique: s for s in submissions}
+        waiting_for = {
+            unique: {d for d in s[3] if d in batch and d != unique}
+            for unique, s in batch.items()
+        }
+        # changing the working directory is not thread safe
+        if any(not s[6].get("cwd", True) for s in submissions):
+            workers = 1
+
+        start = time.time()
+        submitted = 0
+        errors = []
+        pending = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            while True:
+                ready = [u for u, w in waiting_for.items() if not w]
+                for unique in ready:
+                    del waiting_for[unique]
+                    job, name, array, deps, log_dir, verbosity, kwargs = batch[
+                        unique
+                    ]
+                    if isinstance(job, list):
+                        job, array = job[0], (1, len(job), 1)
+                    submit_kwargs = self._prepare_submission(
+                        job, name, array, deps, log_dir, verbosity, kwargs
+                    )
+                    future = executor.submit(self._grid_submit, **submit_kwargs)
+                    pending[future] = (unique, submit_kwargs)
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    unique, submit_kwargs = pending.pop(future)
+                    try:
+                        grid_id = future.result()
+                    except Exception as e:
+                        logger.error(
+                            "Could not submit job '%d' to the %s: %s",
+                            unique,
+                            self.scheduler,
+                            e,
+                        )
+                        errors.append(e)
+                        # do not submit the jobs that depend on this one
+                        continue
+                    jobs = _jobs(batch[unique])
+                    if isinstance(batch[unique][0], list):
+                        for task, job in enumerate(jobs, 1):
+                            self._finish_submission(
+                                job, grid_id, submit_kwargs, pack_index=task
+                            )
+                    else:
+                        self._finish_submission(jobs[0], grid_id, submit_kwargs)
+                    submitted += len(jobs)
+                    for w in waiting_for.values():
+                        w.discard(unique)
+
+                # make grid ids visible to the jobs that start running
+                self.session.commit()
+
+        elapsed = time.time() - start
+        logger.info(
+            "Submitted %d jobs to the %s in %.2f seconds (%.1f jobs/s)",
+            submitted,
+            self.scheduler,
+            elapsed,
+            submitted / elapsed if elapsed else 0.0,
+        )
+        if waiting_for:
+            logger.error(
+                "Did not submit jobs %s, since jobs they depend on could not be submitted",
+                sorted(waiting_for),
+            )
+        if errors:
+            raise errors[0]
+
+    def submit(
+        self,
+        command_line,
+        name=None,
+        array=None,
+        dependencies=[],
+        exec_dir=None,
+        log_dir="logs",
+        dry_run=False,
+        verbosity=0,
+        stop_on_failure=False,
+        array_file=None,
+        **kwargs,
+    ):
+        """Submits a job that will be executed in the grid.
+
+        If the queue is ``auto``, the queue is chosen from the run times of
+        the earlier runs of the same job (see :py:meth:`_auto_queue`).
+        """
+        # add job to database
+        self.lock()
+        if kwargs.get("queue") == "auto":
+            kwargs["queue"] = self._auto_queue(command_line, name, kwargs)
+        job = add_job(
+            self.session,
+            command_line,
+            name,
+            dependencies,
+            array,
+            exec_dir=exec_dir,
+            log_dir=log_dir,
+            stop_on_failure=stop_on_failure,
+            array_file=array_file,
+            context=self.context,
+            **kwargs,
+        )
+        logger.info("Added job '%s' to the database." % job)
+        if dry_run:
+            print("Would have added the Job")
+            print(job)
+            print(
+                "to the database to be executed in the grid with options:",
+                str(kwargs),
+            )
+            self.session.delete(job)
+            logger.info(
+                "Deleted job '%s' from the database due to dry-run option" % job
+            )
+            job_id = None
+
+        else:
+            job_id = self._submit_to_grid(
+                job, name, array, dependencies, log_dir, verbosity, **kwargs
+            )
+
+        self.session.commit()
+        self.unlock()
+
+        return job_id
+
+    def _pack(self, batch):
+        """Groups the independent jobs of a batch of submissions into packs.
+
+        Jobs that are no array jobs, that have no dependencies and that no
+        other job of the batch depends on are packed together when they share
+        their name, log directory and submission options (queue, memory,
+        ...), up to :py:attr:`max_pack_size` jobs per pack.  Each pack is
+        then submitted as a single array job, whose tasks run one job each.
+
+
+        Parameters:
+
+            batch: The submissions, as given to
+                :py:meth:`_submit_many_to_grid`
+
+
+        Returns:
+
+            The submissions, where each pack of more than one job is given as
+            a single submission with a list of jobs
+        """
+        needed = {d for s in batch for d in s[3]}
+        packs = {}
+        retval = []
+        for submission in batch:
+            job, name, array, deps, log_dir, verbosity, kwargs = submission
+            if array or deps or job.unique in needed:
+                retval.append(submission)
+                continue
+            key = (name, log_dir, verbosity, repr(sorted(kwargs.items())))
+            if key not in packs or len(packs[key]) == self.max_pack_size:
+                packs[key] = []
+                retval.append(
+                    (packs[key], name, None, [], log_dir, verbosity, kwargs)
+                )
+            packs[key].append(job)
+
+        # a pack of a single job is submitted as usual
+        retval = [
+            (s[0][0],) + s[1:]
+            if isinstance(s[0], list) and len(s[0]) == 1
+            else s
+            for s in retval
+        ]
+        logger.info(
+            "Packed %d jobs into %d array jobs",
+            sum(len(s[0]) for s in retval if isinstance(s[0], list)),
+            sum(1 for s in retval if isinstance(s[0], list)),
+        )
+        return retval
+
+    def submit_many(self, submissions, workers=8, pack=False, **kwargs):
+        """Submits several jobs to the grid at once.
+
+        The jobs are added to the database in a single transaction, and
+        submitted to the grid by up to ``workers`` concurrent submissions
+        (see :py:meth:`gridtk.manager.JobManager.submit_many`).
+
+        If ``pack`` is set, independent jobs with the same submission options
+        are packed into array jobs (see :py:meth:`_pack`), which are much
+        cheaper for the scheduler than many single jobs.  The packed jobs are
+        still listed, and can be handled, one by one.
+        """
+        submissions = [{**kwargs, **s} for s in submissions]
+        if any(s.get("dry_run") for s in submissions):
+            return JobManager.submit_many(self, submissions)
+
+        self.lock()
+        jobs = []
+        batch = []
+        for s in submissions:
+            s = dict(s)
+            dependencies = list(s.pop("dependencies", [])) + [
+                jobs[k].unique for k in self._batch_dependencies(s, len(jobs))
+            ]
+            command_line = s.pop("command_line")
+            name = s.pop("name", None)
+            array = s.pop("array", None)
+            exec_dir = s.pop("exec_dir", None)
+            log_dir = s.pop("log_dir", "logs")
+            verbosity = s.pop("verbosity", 0)
+            stop_on_failure = s.pop("stop_on_failure", False)
+            array_file = s.pop("array_file", None)
+            s.pop("dry_run", None)
+            if s.get("queue") == "auto":
+                s["queue"] = self._auto_queue(command_line, name, s)
+            job = add_job(
+                self.session,
+                command_line,
+                name,
+                dependencies,
+                array,
+                exec_dir=exec_dir,
+                log_dir=log_dir,
+                stop_on_failure=stop_on_failure,
+                commit=False,
+                array_file=array_file,
+                context=self.context,
+                **s,
+            )
+            logger.info("Added job '%s' to the database." % job)
+            jobs.append(job)
+            batch.append(
+                (job, name, array, dependencies, log_dir, verbosity, s)
+            )
+        self.session.commit()
+
+        if pack:
+            batch = self._pack(batch)
+
+        try:
+            self._submit_many_to_grid(batch, workers)
+        finally:
+            self.session.commit()
+            job_ids = [job.unique for job in jobs]
+            self.unlock()
+
+        return job_ids
+
+    def _next_check(self, job, now):
+        """Returns when to check the status of the given job in the grid again.
+
+        The interval between two checks grows with the age of the job (i.e.,
+        the time since it started executing, or since it was submitted), so
+        that jobs that wait or run for a long time are checked less and less
+        often.  Running jobs are checked right after their run time limit (see
+        :py:meth:`_run_time_limit`), when they should have been killed by the
+        grid.
+        """
+        started = job.submit_time or now
+        if job.status == "executing" and job.start_time is not None:
+            started = job.start_time
+        age = max((now - started).total_seconds(), 0.0)
+        shortest, longest = self.poll_intervals
+        interval = min(max(age * self.poll_backoff, shortest), longest)
+
+        limit = self._run_time_limit(job) if job.status == "executing" else None
+        if limit is not None:
+            remaining = limit + self.poll_grace - age
+            if 0 < remaining < interval:
+                interval = remaining
+        return now + timedelta(seconds=interval)
+
+    def communicate(self, job_ids=None, force=False):
+        """Communicates with the grid to see if jobs are still running.
+
+        Only the jobs that are due (see :py:meth:`_next_check`) are checked,
+        at most :py:attr:`poll_budget` of them, starting with the most overdue
+        ones; the grid is not queried at all if no job is due.  If ``force``
+        is set, all jobs are checked.
+        """
+        # the status changes of the jobs might not be in the database, yet
+        self.merge_spool()
+        self.lock()
+        # iterate over all jobs
+        jobs = self.get_jobs(job_ids)
+        now = datetime.now()
+        active = []
+        for job in jobs:
+            job.refresh()
+            if (
+                job.status in ("queued", "executing", "waiting")
+                and job.queue_name != "local"
+                and (force or job.next_check is None or job.next_check <= now)
+            ):
+                active.append(job)
+
+        if not force and len(active) > self.poll_budget:
+            active.sort(key=lambda job: job.next_check or datetime.min)
+            logger.debug(
+                "Checking %d of %d jobs due in the %s",
+                self.poll_budget,
+                len(active),
+                self.scheduler,
+            )
+            active = active[: self.poll_budget]
+
+        # a single query is enough to know about all jobs
+        snapshot = self._grid_status() if active else {}
+
+        lost = []
+        for job in active:
+            if self._in_grid(job, snapshot):
+                job.next_check = self._next_check(job, now)
+                continue
+            # the job might have finished since we have read it
+            self.session.refresh(job)
+            job.refresh()
+            if job.status in ("queued", "executing", "waiting"):
+                lost.append(job)
+
+        reasons = (
+            self._grid_accounting([job.id for job in lost]) if lost else {}
+        )
+        for job in lost:
+            job.status = "failure"
+            job.result = 70  # ASCII: 'F'
+            if job.id in reasons:
+                logger.warn(
+                    "The job '%s' was not executed successfully (%s). Please check the log files."
+                    % (job, reasons[job.id])
+                )
+            else:
+                logger.warn(
+                    "The job '%s' was not executed successfully (maybe a time-out happened). Please check the log files."
+                    % job
+                )
+            for array_job in job.array:
+                if array_job.status in ("queued", "executing"):
+                    array_job.status = "failure"
+                    array_job.result = 70  # ASCII: 'F'
+
+        self.session.commit()
+        self.unlock()
+
+    def _watch_file(self):
+        """Returns the name of the heartbeat file of the watcher of the
+        database (see :py:meth:`watch`)."""
+        return self._database + ".watch"
+
+    def watcher(self):
+        """Returns the description of the process watching the database (see
+        :py:meth:`watch`), if any.
+
+        Returns:
+
+            A dictionary with the ``host`` and ``pid`` of the watcher, its
+            polling ``interval`` and the ``time`` of its last heartbeat, or
+            ``None`` if no watcher is alive
+        """
+        try:
+            with open(self._watch_file()) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # a watcher that missed several heartbeats is considered dead
+        if time.time() - info["time"] > 3 * info["interval"] + 10:
+            return None
+        if info["host"] == socket.gethostname():
+            try:
+                os.kill(info["pid"], 0)
+            except ProcessLookupError:
+                return None
+            except PermissionError:
+                pass
+        return info
+
+    def _heartbeat(self, interval):
+        """Writes the heartbeat file of the watcher atomically."""
+        info = dict(
+            host=socket.gethostname(),
+            pid=os.getpid(),
+            interval=interval,
+            time=time.time(),
+        )
+        temp = self._watch_file() + ".%d" % os.getpid()
+        with open(temp, "w") as f:
+            json.dump(info, f)
+        os.replace(temp, self._watch_file())
+
+    def watch(self, interval=30.0, until_done=False):
+        """Keeps the database in sync with the grid, until interrupted.
+
+        The status of the jobs is checked (see :py:meth:`communicate`) every
+        ``interval`` seconds, so that failures and time-outs are detected
+        without anybody running ``jman list``.  While the watcher is alive,
+        other calls of ``jman list`` do not query the grid themselves.
+
+
+        Parameters:
+
+            interval: The time between two checks, in seconds
+
+            until_done: If set, stops watching once all jobs in the grid have
+                finished
+
+
+        Returns:
+
+            ``False`` if the database is already watched by another process,
+            ``True`` otherwise
+        """
+        other = self.watcher()
+        if other is not None and other["pid"] != os.getpid():
+            logger.error(
+                "The database '%s' is already watched by process %d on host '%s'."
+                % (self._database, other["pid"], other["host"])
+            )
+            return False
+
+        logger.info(
+            "Watching the jobs of '%s' every %g seconds"
+            % (self._database, interval)
+        )
+        try:
+            while True:
+                self._heartbeat(interval)
+                self.communicate()
+                if until_done:
+                    self.lock()
+                    unfinished = [
+                        job
+                        for job in self.get_jobs()
+                        if job.status in ("queued", "executing", "waiting")
+                        and job.queue_name != "local"
+                    ]
+                    self.unlock()
+                    if not unfinished:
+                        logger.info(
+                            "All jobs in the %s have finished" % self.scheduler
+                        )
+                        break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching the jobs of '%s'" % self._database)
+        finally:
+            try:
+                os.remove(self._watch_file())
+            except OSError:
+                pass
+        return True
+
+    def resubmit(
+        self,
+        job_ids=None,
+        also_success=False,
+        running_jobs=False,
+        new_command=None,
+        verbosity=0,
+        keep_logs=False,
+        array_ids=None,
+        failed_only=False,
+        auto_memory=None,
+        **kwargs,
+    ):
+        """Re-submit jobs automatically.
+
+        Of array jobs, only the tasks with the given ``array_ids``, or only
+        the failed tasks (if ``failed_only`` is set) can be re-submitted,
+        leaving the results and log files of all other tasks untouched (see
+        :py:meth:`_array_for_tasks`).
+
+        If ``auto_memory`` is given, the memory requirements of the jobs are
+        set to their observed peak memory times this headroom (see
+        :py:meth:`_auto_memory`).
+        """
+        # the status changes of the jobs might not be in the database, yet
+        self.merge_spool()
+        if auto_memory is not None:
+            # make sure the peak memory of the last run is known
+            self.accounting(job_ids)
+        self.lock()
+        # iterate over all jobs
+        jobs = self.get_jobs(job_ids)
+        if new_command is not None:
+            if len(jobs) == 1:
+                jobs[0].set_command_line(new_command)
+            else:
+                logger.warn(
+                    "Ignoring new command since no single job id was specified"
+                )
+        accepted_old_status = (
+            ("submitted", "success", "failure")
+            if also_success
+            else (
+                "submitted",
+                "failure",
+            )
+        )
+        jobs = [
+            job
+            for job in jobs
+            if running_jobs or job.status in accepted_old_status
+        ]
+        tasks = {
+            job.unique: self._resubmitted_array_ids(
+                job,
+                array_ids,
+                failed_only,
+                None if running_jobs else accepted_old_status,
+            )
+            for job in jobs
+        }
+        jobs = [job for job in jobs if tasks[job.unique] != set()]
+
+        # delete the jobs that are still running in the grid, all at once
+        if jobs:
+            snapshot = self._grid_status()
+            running = [
+                job
+                for job in jobs
+                if tasks[job.unique] is None and self._in_grid(job, snapshot)
+            ]
+            for job in running:
+                logger.warn(
+                    "Deleting job '%d' since it was still running in the %s."
+                    % (job.unique, self.scheduler)
+                )
+            self._stop_in_grid(running)
+            self._stop_tasks_in_grid(
+                [
+                    array_job
+                    for job in jobs
+                    if tasks[job.unique]
+                    for array_job in job.array
+                    if array_job.id in tasks[job.unique]
+                ],
+                snapshot,
+            )
+
+        batch = []
+        for job in jobs:
+            # re-submit job to the grid
+            arguments = job.get_arguments()
+            arguments.update(**kwargs)
+            if arguments.get("queue") == "auto":
+                arguments["queue"] = self._auto_queue(
+                    job.get_command_line(), job.name, arguments
+                )
+            if auto_memory is not None:
+                arguments = self._auto_memory(job, arguments, auto_memory)
+            arguments = self._resubmission_arguments(arguments)
+            job.set_arguments(kwargs=arguments)
+            # delete old status and result of the job
+            selected = tasks[job.unique]
+            if not keep_logs:
+                self.delete_logs(job)
+                for array_job in job.array:
+                    if selected is None or array_job.id in selected:
+                        self.delete_logs(array_job)
+            job.submit(array_ids=selected)
+            array = (
+                job.get_array()
+                if selected is None
+                else self._array_for_tasks(job, selected)
+            )
+            if job.queue_name == "local" and "queue" not in arguments:
+                logger.warn(
+                    "Re-submitting job '%s' locally (since no queue name is specified)."
+                    % job
+                )
+            else:
+                deps = [dep.unique for dep in job.get_jobs_we_wait_for()]
+                logger.debug(
+                    "Re-submitting job '%s' with dependencies '%s' to the %s."
+                    % (job, deps, self.scheduler)
+                )
+                batch.append(
+                    (
+                        job,
+                        job.name,
+                        array,
+                        deps,
+                        job.log_dir,
+                        verbosity,
+                        arguments,
+                    )
+                )
+
+        # the submission commits after each round, to avoid failures of not
+        # finding the job during execution in the grid
+        try:
+            self.session.commit()
+            self._submit_many_to_grid(batch)
+        finally:
+            self.session.commit()
+            self.unlock()
+
+    def _array_for_tasks(self, job, array_ids):
+        """Returns the array to submit to re-run only the given array jobs of
+        the given job.
+
+        If the array jobs form a range, it is submitted as is.  Otherwise, a
+        new array ``1-N`` is submitted, and each of its tasks is mapped back to
+        the original array job (see :py:meth:`_run_array_task`).
+        """
+        array_ids = sorted(array_ids)
+        steps = {b - a for a, b in zip(array_ids, array_ids[1:])}
+        if len(steps) <= 1:
+            return (array_ids[0], array_ids[-1], steps.pop() if steps else 1)
+        for array_job in job.array:
+            if array_job.id in array_ids:
+                array_job.grid_task = array_ids.index(array_job.id) + 1
+        return (1, len(array_ids), 1)
+
+    def _run_array_task(self, job, task):
+        """Returns the id of the array job run by the given task of the grid
+        array job, and sets up the environment of the array job, as if the
+        whole array job was submitted."""
+        mapped = {
+            array_job.grid_task: array_job.id
+            for array_job in job.array
+            if array_job.grid_id is None and array_job.grid_task is not None
+        }
+        array_id = mapped.get(task, task)
+        set_array_task(array_id, job.get_array())
+        return array_id
+
+    def accounting(self, job_ids=None, refresh=False, accounting_file=None):
+        """Imports the resources used by finished jobs (wall time, CPU time,
+        peak memory and execution host) from the accounting of the grid, in a
+        single pass.
+
+        Parameters:
+
+            job_ids: The ids of the jobs to import; if not given, all jobs
+
+            refresh: If set, also imports the jobs whose resources are
+                already known
+
+            accounting_file: The accounting file of the grid to read; if not
+                given, the default one is used
+
+
+        Returns:
+
+            The number of jobs whose resources could be imported
+        """
+        self.lock()
+        jobs = [
+            job
+            for job in self.get_jobs(job_ids)
+            if job.status in ("success", "failure")
+            and job.queue_name != "local"
+            and (refresh or job.wall_time is None)
+        ]
+        # array jobs might have been run by earlier submissions of their job
+        grid_ids = {job.id for job in jobs} | {
+            array_job.grid_ids()[0] for job in jobs for array_job in job.array
+        }
+        try:
+            records = (
+                self._grid_resources(sorted(grid_ids), accounting_file)
+                if jobs
+                else {}
+            )
+        except BaseException:
+            self.unlock()
+            raise
+
+        def _import(job, record):
+            job.set_resources(
+                record["wall_time"], record["cpu_time"], record["max_memory"]
+            )
+            if job.machine_name is None and record["hostname"]:
+                job.machine_name = record["hostname"]
+
+        imported = 0
+        for job in jobs:
+            tasks = records.get(job.id)
+            if not tasks:
+                logger.info(
+                    "The job '%s' was not found in the accounting of the %s."
+                    % (job, self.scheduler)
+                )
+                continue
+            if job.array:
+                for array_job in job.array:
+                    grid_id, task = array_job.grid_ids()
+                    if task in records.get(grid_id, {}):
+                        _import(array_job, records[grid_id][task])
+                # summarize the array jobs
+                job.set_resources()
+            elif job.pack_index is not None:
+                if job.pack_index in tasks:
+                    _import(job, tasks[job.pack_index])
+            elif None in tasks:
+                _import(job, tasks[None])
+            imported += 1
+
+        self.session.commit()
+        self.unlock()
+        return imported
+
+    def run_job(self, job_id, array_id=None):
+        """Overwrites the run-job command from the manager to extract the
+        correct job id before calling base class implementation."""
+        # get the unique job id from the given grid id
+        self.lock()
+        jobs = list(self.session.query(Job).filter(Job.id == job_id))
+        if array_id is not None and any(
+            job.pack_index is not None for job in jobs
+        ):
+            # the task of a packed array job runs a single job
+            jobs = [job for job in jobs if job.pack_index == array_id]
+            array_id = None
+            unset_array_task()
+        if len(jobs) != 1:
+            self.unlock()
+            raise ValueError(
+                "Could not find job id '%d' in the database'" % job_id
+            )
+        job_id = jobs[0].unique
+        if array_id is not None and jobs[0].array:
+            array_id = self._run_array_task(jobs[0], array_id)
+        self.unlock()
+        # call base class implementation with the corrected job id
+        return JobManager.run_job(self, job_id, array_id)
+
+    def _stop_in_grid(self, jobs):
+        """Deletes the given jobs from the grid, with as few calls to the
+        scheduler as possible."""
+        if not jobs:
+            return {}
+        failures = self._grid_delete([self._grid_job_id(job) for job in jobs])
+        for job in jobs:
+            if self._grid_job_id(job) in failures:
+                logger.error(
+                    "Could not stop job '%s' in the %s: %s",
+                    job,
+                    self.scheduler,
+                    failures[self._grid_job_id(job)],
+                )
+            else:
+                logger.info(
+                    "Stopped job '%s' in the %s." % (job, self.scheduler)
+                )
+        return failures
+
+    def _stop_tasks_in_grid(self, array_jobs, snapshot):
+        """Deletes the given array jobs from the grid, if they are still in
+        the given snapshot (see :py:meth:`_grid_status`)."""
+        tasks = {}
+        for array_job in array_jobs:
+            grid_id, task = array_job.grid_ids()
+            if task in snapshot.get(grid_id, {}):
+                tasks[self._task_id(grid_id, task)] = array_job
+        if not tasks:
+            return {}
+        failures = self._grid_delete(list(tasks))
+        for task_id, array_job in tasks.items():
+            if task_id in failures:
+                logger.error(
+                    "Could not stop array job '%s' in the %s: %s",
+                    array_job,
+                    self.scheduler,
+                    failures[task_id],
+                )
+            else:
+                logger.warn(
+                    "Deleted array job '%s' since it was still running in the %s."
+                    % (array_job, self.scheduler)
+                )
+        return failures
+
+    def stop_jobs(self, job_ids):
+        """Stops the jobs in the grid."""
+        self.lock()
+
+        jobs = self.get_jobs(job_ids)
+        active = [
+            job
+            for job in jobs
+            if job.status in ("executing", "queued", "waiting")
+        ]
+        snapshot = self._grid_status() if active else {}
+        self._stop_in_grid(
+            [job for job in active if self._in_grid(job, snapshot)]
+        )
+        for job in jobs:
+            job.submit()
+
+        self.session.commit()
+        self.unlock()
@@ -0,0 +1,16 @@
+# Copyright © 2022 Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Defines the constants that are shared by the job managers and ``jman``,
+which must not import anything, so that ``jman`` can use them without loading
+SQLAlchemy."""
+
+# The states of jobs (and array jobs)
+Status = ("submitted", "queued", "waiting", "executing", "success", "failure")
+
+# The formats in which jobs can be listed, one record per job
+LIST_FORMATS = ("json", "jsonl", "csv", "tsv")
+
+# The columns by which the statistics of jobs can be grouped
+STATS_GROUPS = ("name", "queue", "machine")
@@ -44,6 +44,7 @@ class JobManagerLocal(JobManager):
         log_dir=None,
         dry_run=False,
         stop_on_failure=False,
+        array_file=None,
         **kwargs,
     ):
         """Submits a job that will be executed on the local machine during a
@@ -65,6 +66,7 @@ class JobManagerLocal(JobManager):
             exec_dir=exec_dir,
             log_dir=log_dir,
             stop_on_failure=stop_on_failure,
+            array_file=array_file,
         )
         logger.info("Added job '%s' to the database", job)
 
@@ -93,9 +95,18 @@ class JobManagerLocal(JobManager):
         running_jobs=False,
         new_command=None,
         keep_logs=False,
+        array_ids=None,
+        failed_only=False,
         **kwargs,
     ):
-        """Re-submit jobs automatically."""
+        """Re-submit jobs automatically.
+
+        Of array jobs, only the array jobs with the given ``array_ids``, or
+        only the failed array jobs (if ``failed_only`` is set) can be
+        re-submitted, so that the scheduler runs only these.
+        """
+        # the status changes of the jobs might not be in the database, yet
+        self.merge_spool()
         self.lock()
         # iterate over all jobs
         jobs = self.get_jobs(job_ids)
@@ -117,7 +128,18 @@ class JobManagerLocal(JobManager):
         for job in jobs:
             # check if this job needs re-submission
             if running_jobs or job.status in accepted_old_status:
-                if job.queue_name != "local" and job.status == "executing":
+                selected = self._resubmitted_array_ids(
+                    job,
+                    array_ids,
+                    failed_only,
+                    None if running_jobs else accepted_old_status,
+                )
+                if selected == set():
+                    logger.info(
+                        "No array jobs of job '%s' need to be re-submitted",
+                        job,
+                    )
+                elif job.queue_name != "local" and job.status == "executing":
                     logger.error(
                         "Cannot re-submit job '%s' locally since it is still running in the grid. Use 'jman stop' to stop it's execution!",
                         job,
@@ -127,7 +149,10 @@ class JobManagerLocal(JobManager):
                     logger.info("Re-submitted job '%s' to the database", job)
                     if not keep_logs:
                         self.delete_logs(job)
-                    job.submit("local")
+                        for array_job in job.array:
+                            if selected is None or array_job.id in selected:
+                                self.delete_logs(array_job)
+                    job.submit("local", array_ids=selected)
 
         self.session.commit()
         self.unlock()
@@ -208,6 +233,8 @@ class JobManagerLocal(JobManager):
             self._database,
             "run-job",
         ]
+        if self.lean:
+            command.append("--lean")
 
         if nice is not None:
             command = ["nice", "-n%d" % nice] + command
@@ -292,6 +319,7 @@ class JobManagerLocal(JobManager):
                         # process ended
                         job_id = task[1]
                         array_id = task[2] if len(task) > 2 else None
+                        self.merge_spool()
                         self.lock()
                         job, array_job = self._job_and_array(job_id, array_id)
                         if job is not None:
@@ -2,34 +2,138 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
 import logging
 import os
+import pickle
+import shlex
 import socket  # to get the host name
-import subprocess
+import sys
+import time
 
-from shutil import which
+from datetime import datetime, timedelta
+from shutil import rmtree, which
 
 import sqlalchemy
 
-from .models import ArrayJob, Base, Job, Status, times
+from . import spool
+from .models import (
+    ArrayJob,
+    Base,
+    Job,
+    JobDependence,
+    LogIndex,
+    Status,
+    times,
+    upgrade,
+)
+from .runner import run_command
+from .tools import copy_log, get_array_file_line, grep_log, pe_slots, read_log
 
 logger = logging.getLogger(__name__)
 
+# The percentiles of the wait and run times in the statistics of jobs
+STATS_PERCENTILES = (50, 90, 99)
+# The upper bounds of the bins of the histogram of run times, in seconds
+STATS_BINS = (("<1m", 60), ("<10m", 600), ("<1h", 3600), ("<6h", 6 * 3600))
+STATS_BINS += (("<1d", 86400), (">=1d", None))
+
+
+def _unpickle(value):
+    """Unpickles a column, which might have been stored as text."""
+    return pickle.loads(value if isinstance(value, bytes) else value.encode())
+
+
+def _print_table(header, rows):
+    """Prints the given rows of strings as a table with aligned columns."""
+    widths = [
+        max(len(row[k]) for row in [header] + rows) for k in range(len(header))
+    ]
+    print("  ".join(h.center(w) for h, w in zip(header, widths)))
+    print("  ".join("=" * w for w in widths))
+    for row in rows:
+        print(
+            "  ".join(
+                [row[0].ljust(widths[0])]
+                + [v.rjust(w) for v, w in zip(row[1:], widths[1:])]
+            )
+        )
+
+
+def _write_records(records, output_format, stream=None):
+    """Writes the given records in the given format (see
+    :py:data:`gridtk.constants.LIST_FORMATS`) while they are iterated,
+    without keeping them."""
+    stream = stream or sys.stdout
+    if output_format == "jsonl":
+        for record in records:
+            stream.write(json.dumps(record) + "\n")
+    elif output_format == "json":
+        separator = "[\n"
+        for record in records:
+            stream.write(separator + json.dumps(record))
+            separator = ",\n"
+        stream.write("[]\n" if separator == "[\n" else "\n]\n")
+    else:
+        writer = None
+        for record in records:
+            if writer is None:
+                writer = csv.DictWriter(
+                    stream,
+                    fieldnames=list(record),
+                    dialect="excel-tab" if output_format == "tsv" else "excel",
+                    lineterminator="\n",
+                )
+                writer.writeheader()
+            writer.writerow(
+                {
+                    key: (
+                        " ".join(str(v) for v in value)
+                        if isinstance(value, list)
+                        else value
+                    )
+                    for key, value in record.items()
+                }
+            )
+
 
 class JobManager:
     """This job manager defines the basic interface for handling jobs in the
     SQL database."""
 
+    # The number of threads reading log files in advance for the report
+    report_workers = 8
+    # The size of log files above which they are streamed, not read in advance
+    report_prefetch_size = 16 * 2**20
+
     def __init__(
-        self, database="submitted.sql3", wrapper_script=None, debug=False
+        self,
+        database="submitted.sql3",
+        wrapper_script=None,
+        debug=False,
+        spool=False,
+        lean=False,
     ):
         self._database = os.path.realpath(database)
+        # jobs are run by the lean runner (see gridtk.runner), which does not
+        # load the ORM
+        self.lean = lean
+        # running jobs report their status through the spool directory, if it
+        # is enabled, instead of writing to the database
+        self._spool = self._spool_directory()
+        if spool:
+            self._enable_spool()
         self._engine = sqlalchemy.create_engine(
             "sqlite:///" + self._database,
             connect_args={"timeout": 600},
             echo=debug,
         )
         self._session_maker = sqlalchemy.orm.sessionmaker(bind=self._engine)
+        self._upgraded = False
 
         # store the command that this job manager was called with
         if wrapper_script is None:
@@ -52,19 +156,25 @@ class JobManager:
         self.wrapper_script = wrapper_script
 
     def __del__(self):
-        # remove the database if it is empty
+        self.remove_empty_database()
+
+    def remove_empty_database(self):
+        """Removes the database file (and its spool directory) if the database
+        contains no jobs."""
         if os.path.isfile(self._database):
             # in errornous cases, the session might still be active, so don't create a deadlock here!
             if not hasattr(self, "session"):
                 self.lock()
-            job_count = len(self.get_jobs())
+            empty = self.session.query(Job.unique).first() is None
             self.unlock()
-            if not job_count:
+            if empty:
                 logger.debug(
                     "Removed database file '%s' since database is empty"
                     % self._database
                 )
                 os.remove(self._database)
+                if not spool.read(self._spool):
+                    rmtree(self._spool, ignore_errors=True)
 
     def lock(self):
         """Generates (and returns) a blocking session object to the
@@ -77,6 +187,9 @@ class JobManager:
         # create the database if it does not exist yet
         if not os.path.exists(self._database):
             self._create()
+        elif not self._upgraded:
+            upgrade(self._engine)
+        self._upgraded = True
 
         # now, create a session
         self.session = self._session_maker()
@@ -102,6 +215,149 @@ class JobManager:
         Base.metadata.create_all(self._engine)
         logger.debug("Created new empty database '%s'" % self._database)
 
+    def _spool_directory(self):
+        return spool.directory(self._database)
+
+    def _enable_spool(self):
+        spool.enable(self._spool)
+
+    def merge_spool(self):
+        """Merges the status changes that running jobs wrote into the spool
+        directory (see :py:mod:`gridtk.spool`) into the database, in a single
+        transaction.
+
+        Returns:
+
+            The number of merged records
+        """
+        if not os.path.isdir(self._spool):
+            return 0
+        with spool.consumer(self._spool) as owner:
+            if not owner:
+                # another process is merging the records right now
+                return 0
+            records = spool.read(self._spool)
+            if not records:
+                return 0
+
+            self.lock()
+            failed = []
+            for path, record in records:
+                jobs = self.get_jobs((record["job"],))
+                if not jobs:
+                    logger.warn(
+                        "Ignoring the status of job '%d', which is not in the database any more"
+                        % record["job"]
+                    )
+                    continue
+                job = jobs[0]
+                when = datetime.fromtimestamp(record["time"])
+                if record["event"] == "execute":
+                    job.execute(record["array"], record["host"], now=when)
+                else:
+                    job.finish(record["result"], record["array"], now=when)
+                    if record.get("resources"):
+                        self._set_resources(
+                            job, record["array"], record["resources"]
+                        )
+                    if job.stop_on_failure and job.status == "failure":
+                        failed.append(job)
+            dependent_job_ids = sorted(
+                {u for job in failed for u in self._dependent_job_ids(job)}
+            )
+            self.session.commit()
+            self.unlock()
+
+            for path, record in records:
+                os.remove(path)
+        logger.info("Merged %d status records from the spool" % len(records))
+
+        if dependent_job_ids:
+            self.stop_jobs(dependent_job_ids)
+            logger.warn(
+                "Stopped dependent jobs '%s' since jobs failed.",
+                str(dependent_job_ids),
+            )
+        return len(records)
+
+    def _report(self, event, job_id, array_id=None, **kwargs):
+        """Writes the status change of a running job into the spool
+        directory."""
+        spool.write(
+            self._spool,
+            dict(
+                event=event,
+                job=job_id,
+                array=array_id,
+                time=time.time(),
+                **kwargs,
+            ),
+        )
+
+    @staticmethod
+    def _set_resources(job, array_id, resources):
+        """Stores the resources used by the given (array) job, which was run
+        locally."""
+        if array_id is None:
+            job.set_resources(*resources)
+            return
+        for array_job in job.array:
+            if array_job.id == array_id:
+                array_job.set_resources(*resources)
+        # summarize the array jobs
+        job.set_resources()
+
+    @staticmethod
+    def _resubmitted_array_ids(
+        job, array_ids=None, failed_only=False, status=None
+    ):
+        """Returns the ids of the array jobs of the given job to re-submit.
+
+        Parameters:
+
+            job: The job to re-submit
+
+            array_ids: Re-submit only the array jobs with these ids
+
+            failed_only: Re-submit only the array jobs that failed
+
+            status: Re-submit only the array jobs with one of these states; if
+                not given, array jobs of any status are re-submitted
+
+
+        Returns:
+
+            ``None`` if the whole job is re-submitted, otherwise the set of ids
+            of the array jobs to re-submit (which might be empty)
+        """
+        if not job.array or (array_ids is None and not failed_only):
+            return None
+        selected = {
+            array_job.id
+            for array_job in job.array
+            if (array_ids is None or array_job.id in array_ids)
+            and (not failed_only or array_job.status == "failure")
+            and (status is None or array_job.status in status)
+        }
+        if len(selected) == len(job.array):
+            return None
+        return selected
+
+    @staticmethod
+    def _dependent_job_ids(job):
+        """Returns the ids of the given job and of all jobs that (indirectly)
+        depend on it."""
+        dependent_jobs = job.get_jobs_waiting_for_us()
+        dependent_job_ids = set(
+            [dep.unique for dep in dependent_jobs] + [job.unique]
+        )
+        while len(dependent_jobs):
+            dep = dependent_jobs.pop(0)
+            new = dep.get_jobs_waiting_for_us()
+            dependent_jobs += new
+            dependent_job_ids.update([dep.unique for dep in new])
+        return dependent_job_ids
+
     def get_jobs(self, job_ids=None):
         """Returns a list of jobs that are stored in the database."""
         if job_ids is not None and len(job_ids) == 0:
@@ -111,6 +367,52 @@ class JobManager:
             q = q.filter(Job.unique.in_(job_ids))
         return sorted(list(q), key=lambda job: job.unique)
 
+    @staticmethod
+    def _batch_dependencies(submission, index):
+        """Returns (and removes) the indexes of the earlier submissions of a
+        batch that the given submission depends on."""
+        after = submission.pop("after", [])
+        for k in after:
+            if not 0 <= k < index:
+                raise ValueError(
+                    "Submission %d of the batch can only depend on earlier submissions, not on %d"
+                    % (index, k)
+                )
+        return after
+
+    def submit_many(self, submissions, **kwargs):
+        """Submits several jobs at once.
+
+        Parameters:
+
+            submissions: A list of dictionaries, each containing the keyword
+                arguments to :py:meth:`submit` (including ``command_line``)
+                for one job.  Besides the ``dependencies`` on jobs already in
+                the database, a job may depend on earlier jobs of the same
+                list, by listing their indexes under the key ``after``.
+
+            kwargs: Keyword arguments to :py:meth:`submit` shared by all jobs
+
+
+        Returns:
+
+            The list of ids of the submitted jobs
+        """
+        job_ids = []
+        for s in submissions:
+            s = {**kwargs, **s}
+            dependencies = list(s.pop("dependencies", [])) + [
+                job_ids[k]
+                for k in self._batch_dependencies(s, len(job_ids))
+                if job_ids[k] is not None
+            ]
+            job_ids.append(
+                self.submit(
+                    s.pop("command_line"), dependencies=dependencies, **s
+                )
+            )
+        return job_ids
+
     def _job_and_array(self, job_id, array_id=None):
         # get the job (and the array job) with the given id(s)
         job = self.get_jobs((job_id,))
@@ -142,49 +444,82 @@ class JobManager:
     def run_job(self, job_id, array_id=None):
         """This function is called to run a job (e.g. in the grid) with the
         given id and the given array index if applicable."""
-        # set the job's status in the database
-        try:
-            # get the job from the database
-            self.lock()
-            jobs = self.get_jobs((job_id,))
-            if not len(jobs):
-                # it seems that the job has been deleted in the meanwhile
-                return
-            job = jobs[0]
+        # get the machine name we are executing on; this might only work at idiap
+        machine_name = socket.gethostname()
 
-            # get the machine name we are executing on; this might only work at idiap
-            machine_name = socket.gethostname()
+        # with the spool directory enabled, the status changes are merged into
+        # the database later on, to avoid many concurrent writes to it
+        spooled = spool.enabled(self._spool)
 
-            # set the 'executing' status to the job
-            job.execute(array_id, machine_name)
+        if spooled:
+            self._report("execute", job_id, array_id, host=machine_name)
+        else:
+            # set the job's status in the database
+            try:
+                # get the job from the database
+                self.lock()
+                jobs = self.get_jobs((job_id,))
+                if not len(jobs):
+                    # it seems that the job has been deleted in the meanwhile
+                    return
+                job = jobs[0]
 
-            self.session.commit()
-        except Exception as e:
-            logger.error("Caught exception '%s'", e)
-            pass
-        finally:
-            self.unlock()
+                # set the 'executing' status to the job
+                job.execute(array_id, machine_name)
+
+                self.session.commit()
+            except Exception as e:
+                logger.error("Caught exception '%s'", e)
+                pass
+            finally:
+                self.unlock()
 
         # get the command line of the job from the database; does not need write access
         self.lock()
         job = self.get_jobs((job_id,))[0]
         command_line = job.get_command_line()
         exec_dir = job.get_exec_dir()
+        array_file = job.array_file
+        local = job.queue_name == "local"
+        pe_opt = job.get_arguments().get("pe_opt")
         self.unlock()
 
-        logger.info("Starting job %d: %s", job_id, " ".join(command_line))
+        # let the job know the slots it requested, if the grid did not tell
+        if pe_opt and "NSLOTS" not in os.environ:
+            os.environ["NSLOTS"] = str(pe_slots(pe_opt))
 
         # execute the command line of the job, and wait until it has finished
+        resources = None
         try:
-            result = subprocess.call(command_line, cwd=exec_dir)
+            if array_file is not None and array_id is not None:
+                command_line += shlex.split(
+                    get_array_file_line(array_file, array_id)
+                )
+            logger.info("Starting job %d: %s", job_id, " ".join(command_line))
+            result, resources = run_command(command_line, exec_dir)
             logger.info("Job %d finished with result %s", job_id, str(result))
         except Exception as e:
             logger.error(
                 "The job with id '%d' could not be executed: %s", job_id, e
             )
             result = 69  # ASCII: 'E'
+        if not local:
+            # the accounting of the grid knows better
+            resources = None
+
+        if spooled:
+            self._report(
+                "finish", job_id, array_id, result=result, resources=resources
+            )
+            return
+
+        self.finish_job(job_id, array_id, result, resources)
 
-        # set a new status and the results of the job
+    def finish_job(self, job_id, array_id, result, resources=None):
+        """Records the result of a job that was run, and the resources it used
+        (if given), and stops the jobs that depend on it if it failed (and was
+        submitted with ``stop_on_failure``)."""
+        job_finished = False
         try:
             self.lock()
             jobs = self.get_jobs((job_id,))
@@ -199,22 +534,17 @@ class JobManager:
 
             job = jobs[0]
             job.finish(result, array_id)
+            if resources is not None:
+                self._set_resources(job, array_id, resources)
 
             self.session.commit()
+            job_finished = True
 
             # This might not be working properly, so use with care!
             if job.stop_on_failure and job.status == "failure":
                 # the job has failed
                 # stop this and all dependent jobs from execution
-                dependent_jobs = job.get_jobs_waiting_for_us()
-                dependent_job_ids = set(
-                    [dep.unique for dep in dependent_jobs] + [job.unique]
-                )
-                while len(dependent_jobs):
-                    dep = dependent_jobs.pop(0)
-                    new = dep.get_jobs_waiting_for_us()
-                    dependent_jobs += new
-                    dependent_job_ids.update([dep.unique for dep in new])
+                dependent_job_ids = self._dependent_job_ids(job)
 
                 self.unlock()
                 deps = sorted(list(dependent_job_ids))
@@ -226,11 +556,254 @@ class JobManager:
 
         except Exception as e:
             logger.error("Caught exception '%s'", e)
-            pass
+            if not job_finished:
+                # never lose the result, which will be merged later on (this
+                # does not enable the spool directory for other jobs)
+                logger.warn(
+                    "Writing the result of job '%d' into the spool directory",
+                    job_id,
+                )
+                self._report(
+                    "finish",
+                    job_id,
+                    array_id,
+                    result=result,
+                    resources=resources,
+                )
         finally:
             if hasattr(self, "session"):
                 self.unlock()
 
+    @staticmethod
+    def _filter_jobs(query, job_ids, status, names, limit=None, offset=None):
+        """Selects the jobs with the given ids, statuses and names (in the
+        order of their ids) from the given query, or the given page of them.
+
+        The query can be a query of :py:class:`gridtk.models.Job` objects, or
+        a selection of some of the columns of its table.
+        """
+        if job_ids is not None:
+            query = query.filter(Job.unique.in_(job_ids))
+        if names is not None:
+            query = query.filter(Job.name.in_(names))
+        query = query.filter(Job.status.in_(status)).order_by(Job.unique)
+        if limit is not None:
+            query = query.limit(limit)
+        if offset:
+            query = query.offset(offset)
+        return query
+
+    def _refresh_array_jobs(self, job_ids=None):
+        """Sets the status and result of the executing jobs whose array jobs
+        have all finished, like :py:meth:`gridtk.models.Job.refresh` does,
+        but with a single update of the database."""
+        job = Job.__table__
+        array = ArrayJob.__table__
+        tasks = sqlalchemy.select(array.c.id).where(
+            array.c.job_id == job.c.unique
+        )
+        result = sqlalchemy.func.coalesce(
+            tasks.with_only_columns(array.c.result)
+            .where(array.c.status == "failure")
+            .order_by(array.c.id.desc())
+            .limit(1)
+            .scalar_subquery(),
+            0,
+        )
+        update = (
+            job.update()
+            .where(job.c.status == "executing")
+            .where(tasks.exists())
+            .where(
+                ~tasks.where(
+                    array.c.status.not_in(("success", "failure"))
+                ).exists()
+            )
+            .values(
+                status=sqlalchemy.case(
+                    (result == 0, "success"), else_="failure"
+                ),
+                result=result,
+            )
+        )
+        if job_ids is not None:
+            update = update.where(job.c.unique.in_(job_ids))
+        self.session.execute(update)
+        self.session.commit()
+
+    def list_records(
+        self,
+        job_ids=None,
+        status=Status,
+        names=None,
+        array_jobs=False,
+        long=False,
+        print_times=False,
+        dependencies=False,
+        limit=None,
+        offset=None,
+    ):
+        """Yields the jobs of the database as dictionaries, which are streamed
+        from the database one by one.  Only the columns needed for the
+        requested information are read, and the jobs are filtered by their
+        status once the status of array jobs was refreshed (see
+        :py:meth:`gridtk.models.Job.refresh`).
+
+        Parameters:
+
+            job_ids: The unique ids of the jobs; if not given, all jobs
+
+            status: The statuses of the jobs (and array jobs) to list
+
+            names: The names of the jobs to list; if not given, all jobs
+
+            array_jobs: If set, each job is followed by a record for each of
+                its array jobs, which has an ``array_id``
+
+            long: If set, the records contain the command line of the jobs
+
+            print_times: If set, the records contain the times of the jobs,
+                and the resources they used
+
+            dependencies: If set, the records contain the ids of the jobs
+                that the jobs wait for
+
+            limit: The maximum number of jobs to list
+
+            offset: The number of jobs to skip before listing
+
+
+        Yields:
+
+            A dictionary for each job (or array job), with the same keys for
+            all of them
+        """
+        job = Job.__table__
+        array = ArrayJob.__table__
+        columns = [
+            job.c.unique,
+            job.c.id,
+            job.c.array_string,
+            job.c.pack_index,
+            job.c.queue_name,
+            job.c.machine_name,
+            job.c.status,
+            job.c.result,
+            job.c.name,
+        ]
+        if long:
+            columns += [job.c.command_line, job.c.exec_dir]
+        time_columns = (
+            ("submit_time", "start_time", "finish_time")
+            + ("wall_time", "cpu_time", "max_memory")
+            if print_times
+            else ()
+        )
+        columns += [job.c[name] for name in time_columns]
+        if dependencies:
+            dependence = JobDependence.__table__
+            columns.append(
+                sqlalchemy.select(
+                    sqlalchemy.func.group_concat(dependence.c.waited_for_job_id)
+                )
+                .where(dependence.c.waiting_job_id == job.c.unique)
+                .scalar_subquery()
+                .label("dependencies")
+            )
+
+        array_columns = ["id", "machine_name", "status", "result"]
+        array_columns += time_columns
+        if array_jobs:
+            # the page is selected on the jobs, not on their array jobs
+            unique = self._filter_jobs(
+                sqlalchemy.select(job.c.unique),
+                job_ids,
+                status,
+                names,
+                limit,
+                offset,
+            )
+            query = (
+                sqlalchemy.select(
+                    *columns,
+                    *[
+                        array.c[name].label("array_" + name)
+                        for name in array_columns
+                    ],
+                )
+                .select_from(
+                    job.outerjoin(
+                        array,
+                        sqlalchemy.and_(
+                            array.c.job_id == job.c.unique,
+                            array.c.status.in_(status),
+                        ),
+                    )
+                )
+                .where(job.c.unique.in_(unique.scalar_subquery()))
+                .order_by(job.c.unique, array.c.id)
+            )
+        else:
+            query = self._filter_jobs(
+                sqlalchemy.select(*columns),
+                job_ids,
+                status,
+                names,
+                limit,
+                offset,
+            )
+
+        def _value(value):
+            return value.isoformat() if isinstance(value, datetime) else value
+
+        self.lock()
+        try:
+            self._refresh_array_jobs(job_ids)
+            rows = self.session.execute(
+                query.execution_options(stream_results=True)
+            )
+            last = None
+            for row in rows:
+                array_string = (
+                    _unpickle(row.array_string)
+                    if row.array_string is not None
+                    else None
+                )
+                record = dict(
+                    job_id=row.unique,
+                    grid_id=row.id,
+                    array="%d-%d:%d" % array_string if array_string else None,
+                    pack_index=row.pack_index,
+                    queue=row.queue_name,
+                    machine=row.machine_name,
+                    status=row.status,
+                    result=row.result,
+                    name=row.name,
+                )
+                if array_jobs:
+                    record["array_id"] = None
+                if long:
+                    record["command"] = shlex.join(_unpickle(row.command_line))
+                    record["exec_dir"] = row.exec_dir
+                for name in time_columns:
+                    record[name] = _value(row._mapping[name])
+                if dependencies:
+                    record["dependencies"] = sorted(
+                        int(k) for k in (row.dependencies or "").split(",") if k
+                    )
+
+                if row.unique != last:
+                    last = row.unique
+                    yield record
+                if array_jobs and row.array_id is not None:
+                    record = dict(record, array_id=row.array_id)
+                    for name in array_columns[1:]:
+                        key = "machine" if name == "machine_name" else name
+                        record[key] = _value(row._mapping["array_" + name])
+                    yield record
+        finally:
+            self.unlock()
+
     def list(
         self,
         job_ids,
@@ -241,8 +814,45 @@ class JobManager:
         status=Status,
         names=None,
         ids_only=False,
+        output_format=None,
+        limit=None,
+        offset=None,
     ):
-        """Lists the jobs currently added to the database."""
+        """Lists the jobs currently added to the database.
+
+        With an ``output_format`` (see
+        :py:data:`gridtk.constants.LIST_FORMATS`), the jobs are written as
+        records (see :py:meth:`list_records`) while they are read from the
+        database.  The ``limit`` and ``offset`` select a page of the jobs, in
+        the order of their ids.
+        """
+        # the status changes of the jobs might not be in the database, yet
+        self.merge_spool()
+        if output_format is not None:
+            _write_records(
+                self.list_records(
+                    job_ids,
+                    status,
+                    names,
+                    array_jobs=print_array_jobs,
+                    long=long,
+                    print_times=print_times,
+                    dependencies=print_dependencies,
+                    limit=limit,
+                    offset=offset,
+                ),
+                output_format,
+            )
+            return
+
+        if ids_only and not print_times:
+            # the ids are read without loading the jobs
+            for record in self.list_records(
+                job_ids, status, names, limit=limit, offset=offset
+            ):
+                print(record["job_id"], end=" ")
+            return
+
         # configuration for jobs
         fields = ("job-id", "grid-id", "queue", "status", "job-name")
         lengths = (6, 17, 11, 12, 16)
@@ -260,13 +870,6 @@ class JobManager:
         format = "{:^%d}  " * len(lengths)
         format = format % lengths
 
-        # if ids_only:
-        #   self.lock()
-        #   for job in self.get_jobs():
-        #     print(job.unique, end=" ")
-        #   self.unlock()
-        #   return
-
         array_format = "{0:^%d}  {1:>%d}  {2:^%d}  {3:^%d}" % lengths[:4]
         delimiter = format.format(*["=" * k for k in lengths])
         array_delimiter = array_format.format(*["-" * k for k in lengths[:4]])
@@ -277,28 +880,94 @@ class JobManager:
             print("  ".join(header))
             print(delimiter)
 
+        def _refreshed(jobs):
+            # the stored status of a job might be outdated, so that the jobs
+            # are filtered by status (and paginated) only once refreshed
+            for job in jobs:
+                job.refresh()
+                if job.status in status:
+                    yield job
+
         self.lock()
-        for job in self.get_jobs(job_ids):
-            job.refresh()
-            if job.status in status and (names is None or job.name in names):
-                if ids_only:
-                    print(job.unique, end=" ")
-                else:
-                    print(job.format(format, dependency_length))
-                if print_times:
-                    print(times(job))
+        jobs = itertools.islice(
+            _refreshed(
+                self._filter_jobs(
+                    self.session.query(Job), job_ids, Status, names
+                )
+            ),
+            offset or 0,
+            None if limit is None else (offset or 0) + limit,
+        )
+        for job in jobs:
+            if ids_only:
+                print(job.unique, end=" ")
+            else:
+                print(job.format(format, dependency_length))
+            if print_times:
+                print(times(job))
 
-                if (not ids_only) and print_array_jobs and job.array:
-                    print(array_delimiter)
-                    for array_job in job.array:
-                        if array_job.status in status:
-                            print(array_job.format(array_format))
-                            if print_times:
-                                print(times(array_job))
-                    print(array_delimiter)
+            if (not ids_only) and print_array_jobs and job.array:
+                print(array_delimiter)
+                for array_job in job.array:
+                    if array_job.status in status:
+                        print(array_job.format(array_format))
+                        if print_times:
+                            print(times(array_job))
+                print(array_delimiter)
 
         self.unlock()
 
+    def _read_log(self, path, head=None, tail=None):
+        """Reads a log file for :py:meth:`report`, in a worker thread.
+
+        Returns:
+
+            The contents of the file; ``None`` if the file does not exist or
+            is empty; or ``False`` if the file is too large to be read in
+            advance, and needs to be streamed when it is reported
+        """
+        if path is None:
+            return None
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return None
+        if not size:
+            return None
+        if head is None and tail is None and size > self.report_prefetch_size:
+            return False
+        return read_log(path, head, tail)
+
+    def _grep_log(self, path, pattern, indexed):
+        """Searches a log file for :py:meth:`report`, in a worker thread,
+        unless its matches are known already.
+
+        Parameters:
+
+            indexed: The size and modification time of the file when it was
+                last searched for the pattern, and the matching lines (see
+                :py:class:`gridtk.models.LogIndex`); ``None`` if unknown
+
+        Returns:
+
+            A tuple ``(size, mtime, matches, searched)`` with the size and
+            modification time of the file, the matching lines (see
+            :py:func:`gridtk.tools.grep_log`), and whether the file was
+            searched; ``None`` if the file does not exist
+        """
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if indexed is not None:
+            size, mtime, matches = indexed
+            if (size, mtime) == (stat.st_size, stat.st_mtime_ns):
+                return size, mtime, matches, False
+        matches = grep_log(path, pattern)
+        return stat.st_size, stat.st_mtime_ns, matches, True
+
     def report(
         self,
         job_ids=None,
@@ -307,85 +976,418 @@ class JobManager:
         error=True,
         status=Status,
         name=None,
+        head=None,
+        tail=None,
+        failed_only=False,
+        grep=False,
+        pattern=None,
+        index=True,
     ):
         """Iterates through the output and error files and write the results to
-        command line."""
+        command line.
 
-        def _write_contents(job):
-            # Writes the contents of the output and error files to command line
+        The log files are read in advance by a few threads (see
+        :py:attr:`report_workers`), while they are written in the order of the
+        jobs.  With ``head`` or ``tail``, only the first or last lines of each
+        log file are read; with ``failed_only``, only the failed jobs (and
+        array jobs) are reported.
+
+        With ``grep``, only the lines of the log files that match the given
+        regular expression ``pattern`` (by default, the lines that hint at
+        errors) are reported, as ``path:number:line``.  Unless ``index`` is
+        unset, the matches in the log files of finished jobs are stored in the
+        database (see :py:class:`gridtk.models.LogIndex`) when they are first
+        searched, so that the log files are not searched again for the same
+        pattern, unless they change.
+        """
+        if failed_only:
+            status = ("failure",)
+        # the status changes of the jobs might not be in the database, yet
+        self.merge_spool()
+
+        def _contents(job):
+            # the log files to write, with the separators written after them
             out_file, err_file = job.std_out_file(), job.std_err_file()
-            logger.info("Contents of output file: '%s'" % out_file)
-            if (
-                output
-                and out_file is not None
-                and os.path.exists(out_file)
-                and os.stat(out_file).st_size > 0
-            ):
-                print(open(out_file).read().rstrip())
-                print("-" * 20)
-            if (
-                error
-                and err_file is not None
-                and os.path.exists(err_file)
-                and os.stat(err_file).st_size > 0
-            ):
-                logger.info("Contents of error file: '%s'" % err_file)
-                print(open(err_file).read().rstrip())
-                print("-" * 40)
+            finished = job.status in ("success", "failure")
+            if output and out_file is not None:
+                yield out_file, "Contents of output file", "-" * 20, finished
+            if error and err_file is not None:
+                yield err_file, "Contents of error file", "-" * 40, finished
 
-        def _write_array_jobs(array_jobs):
+        def _array_jobs(array_jobs):
             for array_job in array_jobs:
-                print(
-                    "Array Job",
-                    str(array_job.id),
+                if failed_only and array_job.status != "failure":
+                    continue
+                yield " ".join(
                     (
-                        "(%s) :" % array_job.machine_name
-                        if array_job.machine_name is not None
-                        else ":"
-                    ),
+                        "Array Job",
+                        str(array_job.id),
+                        (
+                            "(%s) :" % array_job.machine_name
+                            if array_job.machine_name is not None
+                            else ":"
+                        ),
+                    )
                 )
-                _write_contents(array_job)
-
-        self.lock()
+                yield from _contents(array_job)
 
-        # check if an array job should be reported
-        if array_ids:
-            if len(job_ids) != 1:
-                logger.error(
-                    "If array ids are specified exactly one job id must be given."
+        def _lines():
+            # the lines to write, and the log files to write in between
+            if array_ids:
+                # check if an array job should be reported
+                if len(job_ids) != 1:
+                    logger.error(
+                        "If array ids are specified exactly one job id must be given."
+                    )
+                array_jobs = list(
+                    self.session.query(ArrayJob)
+                    .join(Job)
+                    .filter(Job.unique.in_(job_ids))
+                    .filter(Job.unique == ArrayJob.job_id)
+                    .filter(ArrayJob.id.in_(array_ids))
                 )
-            array_jobs = list(
-                self.session.query(ArrayJob)
-                .join(Job)
-                .filter(Job.unique.in_(job_ids))
-                .filter(Job.unique == ArrayJob.job_id)
-                .filter(ArrayJob.id.in_(array_ids))
-            )
-            if array_jobs:
-                print(array_jobs[0].job)
-            _write_array_jobs(array_jobs)
+                if array_jobs:
+                    yield str(array_jobs[0].job)
+                yield from _array_jobs(array_jobs)
+                return
 
-        else:
             # iterate over all jobs
-            jobs = self.get_jobs(job_ids)
+            jobs = self._filter_jobs(
+                self.session.query(Job),
+                job_ids,
+                status,
+                None if name is None else (name,),
+            )
             for job in jobs:
-                if name is not None and job.name != name:
-                    continue
-                if job.status not in status:
-                    continue
+                yield str(job)
                 if job.array:
-                    print(job)
-                    _write_array_jobs(job.array)
+                    yield from _array_jobs(job.array)
                 else:
-                    print(job)
-                    _write_contents(job)
+                    yield from _contents(job)
                 if job.log_dir is not None:
-                    print("-" * 60)
+                    yield "-" * 60
 
-        self.unlock()
+        def _indexed(path):
+            # the known matches of a log file, which are looked up here, as
+            # the worker threads must not use the database session
+            log_index = self.session.get(LogIndex, path) if index else None
+            if log_index is None:
+                return None
+            size, mtime = log_index.size, log_index.mtime
+            matches = log_index.get_matches(pattern, size, mtime)
+            return None if matches is None else (size, mtime, matches)
+
+        def _read(log, indexed):
+            if grep:
+                return self._grep_log(log[0], pattern, indexed)
+            return self._read_log(log[0], head, tail)
+
+        def _write(lines):
+            for line in lines:
+                if isinstance(line, str):
+                    if not grep:
+                        print(line)
+                    continue
+                (path, message, separator, finished), contents = line
+                if grep:
+                    if contents is None:
+                        continue
+                    size, mtime, matches, searched = contents
+                    if index and searched and finished:
+                        log_index = self.session.get(LogIndex, path)
+                        if log_index is None:
+                            log_index = LogIndex(path)
+                            self.session.add(log_index)
+                        log_index.set_matches(pattern, size, mtime, matches)
+                    for number, _, text in matches:
+                        print("%s:%d:%s" % (path, number, text))
+                    continue
+                if contents is None:
+                    # the log file does not exist, or is empty
+                    continue
+                logger.info("%s: '%s'", message, path)
+                if contents is False:
+                    sys.stdout.flush()
+                    copy_log(path, sys.stdout)
+                else:
+                    print(contents)
+                print(separator)
+
+        self.lock()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                self.report_workers
+            ) as pool:
+                # the log files are read ahead, but at most a few at a time
+                pending = collections.deque()
+
+                def _next():
+                    line = pending.popleft()
+                    if isinstance(line, str):
+                        return line
+                    return line[0], line[1].result()
+
+                def _prefetched():
+                    for line in _lines():
+                        if not isinstance(line, str):
+                            indexed = _indexed(line[0]) if grep else None
+                            line = line, pool.submit(_read, line, indexed)
+                        pending.append(line)
+                        if len(pending) > 4 * self.report_workers:
+                            yield _next()
+                    while pending:
+                        yield _next()
+
+                _write(_prefetched())
+            self.session.commit()
+        finally:
+            self.unlock()
+
+    def statistics(self, group_by="name", since=None, job_ids=None):
+        """Computes the statistics of the tasks in the database (the jobs, or
+        the array jobs of array jobs), which are aggregated by the database.
+
+        Parameters:
+
+            group_by: The column to group the tasks by (see
+                :py:data:`gridtk.constants.STATS_GROUPS`)
+
+            since: If given, only the tasks submitted since this time are
+                considered
+
+            job_ids: The unique ids of the jobs to consider; if not given, all
+                jobs
+
+
+        Returns:
+
+            A list of dictionaries, one per group, sorted by the value of the
+            column (``group``): the number of ``tasks``, of ``finished`` and
+            ``failed`` tasks, the ``failure_rate`` of the finished tasks, the
+            ``throughput`` in finished tasks per hour, the ``mean``, ``max``
+            and percentiles (see :py:data:`STATS_PERCENTILES`) of the times
+            that tasks ``wait`` in the queue and ``run``, in seconds, and the
+            ``histogram`` of the run times (see :py:data:`STATS_BINS`)
+        """
+        # the status changes of the jobs might not be in the database, yet
+        self.merge_spool()
+        case, func = sqlalchemy.case, sqlalchemy.func
+        job = Job.__table__
+        array = ArrayJob.__table__
+
+        def _seconds(end, start):
+            return (func.julianday(end) - func.julianday(start)) * 86400.0
+
+        def _tasks(query, task, submit):
+            # the columns of the tasks, which are either array jobs or jobs
+            query = query.add_columns(
+                dict(
+                    name=job.c.name,
+                    queue=job.c.queue_name,
+                    machine=task.c.machine_name,
+                )[group_by].label("group"),
+                task.c.status,
+                task.c.start_time.label("start"),
+                task.c.finish_time.label("finish"),
+                _seconds(task.c.start_time, submit).label("wait"),
+                case(
+                    (
+                        task.c.status.in_(("success", "failure")),
+                        _seconds(task.c.finish_time, task.c.start_time),
+                    )
+                ).label("run"),
+            )
+            if since is not None:
+                query = query.where(submit >= since)
+            if job_ids is not None:
+                query = query.where(job.c.unique.in_(job_ids))
+            return query
+
+        tasks = sqlalchemy.union_all(
+            _tasks(
+                sqlalchemy.select().select_from(
+                    array.join(job, array.c.job_id == job.c.unique)
+                ),
+                array,
+                func.coalesce(array.c.submit_time, job.c.submit_time),
+            ),
+            _tasks(
+                sqlalchemy.select()
+                .select_from(job)
+                .where(
+                    ~sqlalchemy.exists().where(array.c.job_id == job.c.unique)
+                ),
+                job,
+                job.c.submit_time,
+            ),
+        ).subquery()
+
+        def _sum(condition):
+            return func.sum(case((condition, 1), else_=0))
+
+        columns = [
+            tasks.c.group,
+            func.count().label("tasks"),
+            _sum(tasks.c.status.in_(("success", "failure"))).label("finished"),
+            _sum(tasks.c.status == "failure").label("failed"),
+            _seconds(func.max(tasks.c.finish), func.min(tasks.c.start)).label(
+                "span"
+            ),
+        ]
+        for duration in ("wait", "run"):
+            columns += [
+                func.count(tasks.c[duration]).label(duration + "_count"),
+                func.avg(tasks.c[duration]).label(duration + "_mean"),
+                func.max(tasks.c[duration]).label(duration + "_max"),
+            ]
+        # julianday() is only precise to about a millisecond, which is allowed
+        # for at the bounds of the bins
+        lower = 0
+        for label, upper in STATS_BINS:
+            condition = tasks.c.run >= lower - 0.001
+            if upper is not None:
+                condition = sqlalchemy.and_(
+                    condition, tasks.c.run < upper - 0.001
+                )
+            columns.append(_sum(condition).label(label))
+            lower = upper
+
+        self.lock()
+        try:
+            rows = self.session.execute(
+                sqlalchemy.select(*columns)
+                .group_by(tasks.c.group)
+                .order_by(tasks.c.group)
+            ).all()
+
+            # the percentiles are the values at the nearest ranks, which are
+            # the smallest ones not below the percentiles of the counts, so
+            # only the tasks at these ranks are selected from the ranked ones
+            percentiles = {}
+            for duration in ("wait", "run"):
+                ranks = {
+                    (row.group, p): max(
+                        1, -(-row._mapping[duration + "_count"] * p // 100)
+                    )
+                    for row in rows
+                    for p in STATS_PERCENTILES
+                }
+                ranked = (
+                    sqlalchemy.select(
+                        tasks.c.group,
+                        tasks.c[duration].label("value"),
+                        func.row_number()
+                        .over(
+                            partition_by=tasks.c.group,
+                            order_by=tasks.c[duration],
+                        )
+                        .label("rank"),
+                    )
+                    .where(tasks.c[duration].isnot(None))
+                    .subquery()
+                )
+                values = {
+                    (group, rank): value
+                    for group, value, rank in self.session.execute(
+                        sqlalchemy.select(ranked).where(
+                            ranked.c.rank.in_(set(ranks.values()))
+                        )
+                    )
+                }
+                for key, rank in ranks.items():
+                    percentiles[(duration,) + key] = values.get((key[0], rank))
+        finally:
+            self.unlock()
+
+        records = []
+        for row in rows:
+            row = row._mapping
+            record = dict(
+                group=row["group"],
+                tasks=row["tasks"],
+                finished=row["finished"],
+                failed=row["failed"],
+                failure_rate=(
+                    row["failed"] / row["finished"] if row["finished"] else None
+                ),
+                throughput=(
+                    row["finished"] * 3600.0 / row["span"]
+                    if row["span"]
+                    else None
+                ),
+            )
+            for duration in ("wait", "run"):
+                record[duration] = dict(mean=row[duration + "_mean"])
+                for p in STATS_PERCENTILES:
+                    record[duration]["p%d" % p] = percentiles[
+                        (duration, row["group"], p)
+                    ]
+                record[duration]["max"] = row[duration + "_max"]
+            record["histogram"] = {label: row[label] for label, _ in STATS_BINS}
+            records.append(record)
+        return records
+
+    def stats(
+        self, group_by="name", since=None, job_ids=None, print_json=False
+    ):
+        """Prints the statistics of the tasks in the database (see
+        :py:meth:`statistics`), as tables or as JSON."""
+        records = self.statistics(group_by, since, job_ids)
+        if print_json:
+            print(json.dumps(records, indent=2))
+            return
+
+        def _duration(seconds):
+            return (
+                "-"
+                if seconds is None
+                else str(timedelta(seconds=round(seconds)))
+            )
+
+        percentiles = ["p%d" % p for p in STATS_PERCENTILES]
+        header = [group_by, "tasks", "failed", "tasks/h"]
+        header += ["wait " + key for key in ["mean"] + percentiles + ["max"]]
+        header += ["run " + key for key in ["mean"] + percentiles + ["max"]]
+        rows = []
+        for record in records:
+            rows.append(
+                [
+                    str(record["group"]),
+                    str(record["tasks"]),
+                    "%d (%.1f%%)"
+                    % (record["failed"], 100 * (record["failure_rate"] or 0)),
+                    (
+                        "%.1f" % record["throughput"]
+                        if record["throughput"] is not None
+                        else "-"
+                    ),
+                ]
+                + [_duration(value) for value in record["wait"].values()]
+                + [_duration(value) for value in record["run"].values()]
+            )
+        _print_table(header, rows)
+
+        # the histogram of the run times of each group
+        print()
+        _print_table(
+            [group_by] + [label for label, _ in STATS_BINS],
+            [
+                [str(record["group"])]
+                + [str(count) for count in record["histogram"].values()]
+                for record in records
+            ],
+        )
+
+    def _delete_log_index(self, job):
+        """Deletes the matches found in the log files of the given job (see
+        :py:class:`gridtk.models.LogIndex`)."""
+        self.session.query(LogIndex).filter(
+            LogIndex.path.in_([job.std_out_file(), job.std_err_file()])
+        ).delete(synchronize_session=False)
 
     def delete_logs(self, job):
         out_file, err_file = job.std_out_file(), job.std_err_file()
+        self._delete_log_index(job)
         if out_file and os.path.exists(out_file):
             os.remove(out_file)
             logger.debug("Removed output log file '%s'" % out_file)
@@ -421,8 +1423,11 @@ class JobManager:
                 if try_to_delete_dir:
                     _delete_dir_if_empty(job.log_dir)
             if delete_jobs:
+                self._delete_log_index(job)
                 self.session.delete(job)
 
+        # the status changes of the jobs might not be in the database, yet
+        self.merge_spool()
         self.lock()
 
         # check if array ids are specified
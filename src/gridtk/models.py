@@ -2,23 +2,30 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import json
 import logging
 import os
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from pickle import dumps, loads
 
+import sqlalchemy
+
 from sqlalchemy import (
     Boolean,
     Column,
     DateTime,
     Enum,
+    Float,
     ForeignKey,
     Integer,
     String,
 )
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, relationship
 
+from .constants import Status
+
 logger = logging.getLogger(__name__)
 
 
@@ -28,8 +35,6 @@ class Base:
 
 Base = declarative_base(cls=Base)  # type: ignore
 
-Status = ("submitted", "queued", "waiting", "executing", "success", "failure")
-
 
 class ArrayJob(Base):
     """This class defines one element of an array job."""
@@ -38,15 +43,26 @@ class ArrayJob(Base):
 
     unique = Column(Integer, primary_key=True)
     id = Column(Integer)
-    job_id = Column(Integer, ForeignKey("Job.unique"))
+    job_id = Column(Integer, ForeignKey("Job.unique"), index=True)
     status = Column(Enum(*Status))
     result = Column(Integer)
     machine_name = Column(String(10))
+    grid_id = Column(
+        Integer
+    )  # The grid ID of the job that ran this array job, if not the one of the job
+    grid_task = Column(
+        Integer
+    )  # The task of the grid array job that runs this array job, if not its id
 
     submit_time = Column(DateTime)
     start_time = Column(DateTime)
     finish_time = Column(DateTime)
 
+    # resources used, as recorded by the accounting of the grid
+    wall_time = Column(Float)  # in seconds
+    cpu_time = Column(Float)  # in seconds
+    max_memory = Column(Integer)  # in bytes
+
     job = relationship("Job", backref="array", order_by=id)
 
     def __init__(self, id, job_id):
@@ -60,19 +76,30 @@ class ArrayJob(Base):
         self.start_time = None
         self.finish_time = None
 
-    def std_out_file(self):
+    def set_resources(self, wall_time=None, cpu_time=None, max_memory=None):
+        """Sets the resources used by this array job (see
+        :py:meth:`Job.set_resources`)."""
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.max_memory = max_memory
+
+    def grid_ids(self):
+        """Returns the grid id of the job and the task that (last) ran this
+        array job in the grid.
+
+        These differ from the ids of the job and of this array job when only
+        some array jobs were re-submitted to the grid.
+        """
         return (
-            self.job.std_out_file() + "." + str(self.id)
-            if self.job.log_dir
-            else None
+            self.job.id if self.grid_id is None else self.grid_id,
+            self.id if self.grid_task is None else self.grid_task,
         )
 
+    def std_out_file(self):
+        return self.job._log_file("o", *self.grid_ids())
+
     def std_err_file(self):
-        return (
-            self.job.std_err_file() + "." + str(self.id)
-            if self.job.log_dir
-            else None
-        )
+        return self.job._log_file("e", *self.grid_ids())
 
     def __str__(self):
         n = "<ArrayJob %d> of <Job %d>" % (self.id, self.job.id)
@@ -126,6 +153,12 @@ class Job(Base):
     array_string = Column(
         String(255)
     )  # The array string (only needed for re-submission)
+    pack_index = Column(
+        Integer
+    )  # The task of the grid array job that runs this job, if packed
+    array_file = Column(
+        String(255)
+    )  # The file with the parameters of each array job, one per line
     stop_on_failure = Column(
         Boolean
     )  # An indicator whether to stop depending jobs when this job finishes with an error
@@ -133,10 +166,18 @@ class Job(Base):
     submit_time = Column(DateTime)
     start_time = Column(DateTime)
     finish_time = Column(DateTime)
+    next_check = Column(
+        DateTime
+    )  # When to check the status of the job in the grid again
 
     status = Column(Enum(*Status))
     result = Column(Integer)
 
+    # resources used, as recorded by the accounting of the grid
+    wall_time = Column(Float)  # in seconds
+    cpu_time = Column(Float)  # in seconds
+    max_memory = Column(Integer)  # in bytes
+
     def __init__(
         self,
         command_line,
@@ -147,6 +188,7 @@ class Job(Base):
         queue_name="local",
         machine_name=None,
         stop_on_failure=False,
+        array_file=None,
         **kwargs,
     ):
         """Constructs a Job object without an ID (needs to be set later)."""
@@ -163,22 +205,37 @@ class Job(Base):
         self.log_dir = log_dir
         self.stop_on_failure = stop_on_failure
         self.array_string = dumps(array_string)
+        self.array_file = array_file
         self.submit()
 
-    def submit(self, new_queue=None):
-        """Sets the status of this job to 'submitted'."""
+    def submit(self, new_queue=None, array_ids=None):
+        """Sets the status of this job to 'submitted'.
+
+        If ``array_ids`` are given, only these array jobs are submitted again,
+        while the others keep their status and results.
+        """
         self.status = "submitted"
         self.result = None
         self.machine_name = None
         if new_queue is not None:
             self.queue_name = new_queue
         for array_job in self.array:
+            if array_ids is not None and array_job.id not in array_ids:
+                # remember the grid job that wrote the log files
+                if array_job.grid_id is None:
+                    array_job.grid_id = self.id
+                continue
             array_job.status = "submitted"
             array_job.result = None
             array_job.machine_name = None
+            array_job.grid_id = None
+            array_job.grid_task = None
+            array_job.set_resources()
         self.submit_time = datetime.now()
         self.start_time = None
         self.finish_time = None
+        self.next_check = None
+        self.set_resources()
 
     def queue(self, new_job_id=None, new_job_name=None, queue_name=None):
         """Sets the status of this job to 'queued' or 'waiting'."""
@@ -192,6 +249,9 @@ class Job(Base):
         if queue_name is not None:
             self.queue_name = queue_name
 
+        # check the new job in the grid as soon as possible
+        self.next_check = None
+
         new_status = "queued"
         self.result = None
         # check if we have to wait for another job to finish
@@ -211,8 +271,10 @@ class Job(Base):
             if array_job.status not in ("success", "failure"):
                 array_job.status = new_status
 
-    def execute(self, array_id=None, machine_name=None):
-        """Sets the status of this job to 'executing'."""
+    def execute(self, array_id=None, machine_name=None, now=None):
+        """Sets the status of this job to 'executing' (at the given time, or
+        now)."""
+        now = now or datetime.now()
         self.status = "executing"
         if array_id is not None:
             for array_job in self.array:
@@ -220,11 +282,11 @@ class Job(Base):
                     array_job.status = "executing"
                     if machine_name is not None:
                         array_job.machine_name = machine_name
-                        array_job.start_time = datetime.now()
+                        array_job.start_time = now
         elif machine_name is not None:
             self.machine_name = machine_name
         if self.start_time is None:
-            self.start_time = datetime.now()
+            self.start_time = now
 
         # sometimes, the 'finish' command did not work for array jobs,
         # so check if any old job still has the 'executing' flag set
@@ -232,8 +294,10 @@ class Job(Base):
             if job.array and job.status == "executing":
                 job.finish(0, -1)
 
-    def finish(self, result, array_id=None):
-        """Sets the status of this job to 'success' or 'failure'."""
+    def finish(self, result, array_id=None, now=None):
+        """Sets the status of this job to 'success' or 'failure' (at the given
+        time, or now)."""
+        now = now or datetime.now()
         # check if there is any array job still running
         new_status = "success" if result == 0 else "failure"
         new_result = result
@@ -243,7 +307,7 @@ class Job(Base):
                 if array_job.id == array_id:
                     array_job.status = new_status
                     array_job.result = result
-                    array_job.finish_time = datetime.now()
+                    array_job.finish_time = now
                 if array_job.status not in ("success", "failure"):
                     finished = False
                 elif new_result == 0:
@@ -253,13 +317,31 @@ class Job(Base):
             # There was no array job, or all array jobs finished
             self.status = "success" if new_result == 0 else "failure"
             self.result = new_result
-            self.finish_time = datetime.now()
+            self.finish_time = now
 
             # update all waiting jobs
             for job in self.get_jobs_waiting_for_us():
                 if job.status == "waiting":
                     job.queue()
 
+    def set_resources(self, wall_time=None, cpu_time=None, max_memory=None):
+        """Sets the resources used by this job, i.e., its wall-clock and CPU
+        time in seconds and its peak memory in bytes.
+
+        For array jobs, the resources of the array jobs are summarized, if not
+        given: the wall and CPU times are summed up, and the peak memory is
+        the largest of all array jobs.
+        """
+        if self.array and wall_time is None:
+            recorded = [a for a in self.array if a.wall_time is not None]
+            if recorded:
+                wall_time = sum(a.wall_time for a in recorded)
+                cpu_time = sum(a.cpu_time or 0.0 for a in recorded)
+                max_memory = max(a.max_memory or 0 for a in recorded)
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.max_memory = max_memory
+
     def refresh(self):
         """Refreshes the status information."""
         if self.status == "executing" and self.array:
@@ -357,25 +439,26 @@ class Job(Base):
             if j.waiting_job is not None
         ]
 
-    def std_out_file(self, array_id=None):
-        return (
-            os.path.join(
-                self.log_dir,
-                (self.name if self.name else "job") + ".o" + str(self.id),
-            )
-            if self.log_dir
-            else None
+    def _log_file(self, stream, grid_id, task=None):
+        """Returns the log file of the given stream ('o' or 'e') written by
+        the given grid job (and task)."""
+        if not self.log_dir:
+            return None
+        return os.path.join(
+            self.log_dir,
+            (self.name if self.name else "job")
+            + "."
+            + stream
+            + str(grid_id)
+            + ("" if task is None else ".%d" % task),
         )
 
+    def std_out_file(self, array_id=None):
+        # packed jobs write the log files of their task of the array job
+        return self._log_file("o", self.id, self.pack_index)
+
     def std_err_file(self, array_id=None):
-        return (
-            os.path.join(
-                self.log_dir,
-                (self.name if self.name else "job") + ".e" + str(self.id),
-            )
-            if self.log_dir
-            else None
-        )
+        return self._log_file("e", self.id, self.pack_index)
 
     def _cmdline(self):
         cmdline = self.get_command_line()
@@ -419,6 +502,8 @@ class Job(Base):
         job_id = "%d" % self.id + (
             " [%d-%d:%d]" % self.get_array() if self.array else ""
         )
+        if self.pack_index is not None:
+            job_id += ".%d" % self.pack_index
         status = "%s" % self.status + (
             " (%d)" % self.result if self.result is not None else ""
         )
@@ -502,6 +587,46 @@ class JobDependence(Base):
         self.waited_for_job_id = waited_for_job_id
 
 
+class LogIndex(Base):
+    """This class stores the lines of a log file that match the patterns
+    searched with ``jman report --grep`` (see
+    :py:func:`gridtk.tools.grep_log`), so that the file is not searched again
+    as long as it does not change."""
+
+    __tablename__ = "LogIndex"
+    path = Column(String(255), primary_key=True)  # The path of the log file
+    size = Column(Integer)  # The size of the log file when it was searched
+    mtime = Column(Integer)  # The modification time of the log file, in ns
+    matches = Column(String)  # The lines matching each pattern, as JSON
+
+    def __init__(self, path):
+        self.path = path
+        self.size = self.mtime = None
+        self.matches = "{}"
+
+    def get_matches(self, pattern, size, mtime):
+        """Returns the lines of the log file that match the given pattern
+        (``None`` for the lines that hint at errors), if the file was
+        searched for it with the given size and modification time; otherwise
+        ``None``."""
+        if (self.size, self.mtime) != (size, mtime):
+            return None
+        matches = json.loads(self.matches).get(pattern or "")
+        return None if matches is None else [tuple(m) for m in matches]
+
+    def set_matches(self, pattern, size, mtime, matches):
+        """Stores the lines of the log file that match the given pattern,
+        forgetting the matches of other patterns if the file has changed."""
+        stored = (
+            json.loads(self.matches)
+            if (self.size, self.mtime) == (size, mtime)
+            else {}
+        )
+        stored[pattern or ""] = matches
+        self.size, self.mtime = size, mtime
+        self.matches = json.dumps(stored)
+
+
 def add_job(
     session,
     command_line,
@@ -511,10 +636,18 @@ def add_job(
     exec_dir=None,
     log_dir=None,
     stop_on_failure=False,
+    commit=True,
+    array_file=None,
     **kwargs,
 ):
     """Helper function to create a job, add the dependencies and the array
-    jobs."""
+    jobs.
+
+    If ``commit`` is not set, the changes are only flushed to the database,
+    leaving it to the caller to commit them.  If an ``array_file`` is given,
+    each array job appends the parameters of its line in this file to the
+    command line (see :py:func:`gridtk.tools.get_array_file_line`).
+    """
     job = Job(
         command_line=command_line,
         name=name,
@@ -522,6 +655,7 @@ def add_job(
         log_dir=log_dir,
         array_string=array,
         stop_on_failure=stop_on_failure,
+        array_file=array_file,
         kwargs=kwargs,
     )
 
@@ -550,11 +684,74 @@ def add_job(
         for i in range(start, stop + 1, step):
             session.add(ArrayJob(i, job.unique))
 
-    session.commit()
+    if commit:
+        session.commit()
+    else:
+        session.flush()
 
     return job
 
 
+def upgrade(engine):
+    """Adds the tables, columns and indexes missing in an existing database,
+    which was created by an older version of gridtk."""
+    inspector = sqlalchemy.inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            try:
+                table.create(engine)
+                logger.info("Added the table '%s' to the database" % table.name)
+            except OperationalError as e:
+                # another process might have upgraded the database already
+                if "already exists" not in str(e):
+                    raise
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            statement = 'ALTER TABLE "%s" ADD COLUMN "%s" %s' % (
+                table.name,
+                column.name,
+                column.type.compile(dialect=engine.dialect),
+            )
+            try:
+                with engine.begin() as connection:
+                    connection.execute(sqlalchemy.text(statement))
+                logger.info(
+                    "Added column '%s' to the table '%s' of the database"
+                    % (column.name, table.name)
+                )
+            except OperationalError as e:
+                # another process might have upgraded the database already
+                if "duplicate column" not in str(e):
+                    raise
+        existing = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(engine)
+                logger.info("Added the index '%s' to the database" % index.name)
+            except OperationalError as e:
+                if "already exists" not in str(e):
+                    raise
+
+
+def _duration(seconds):
+    """Formats the given number of seconds like a timedelta."""
+    return str(timedelta(seconds=round(seconds)))
+
+
+def _memory(size):
+    """Formats the given number of bytes in a human-readable form."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return "%.1f %s" % (size, unit)
+        size /= 1024.0
+    return "%.1f TB" % size
+
+
 def times(job):
     """Returns a string containing timing information for teh given job, which
     might be a :py:class:`Job` or an :py:class:`ArrayJob`."""
@@ -569,4 +766,10 @@ def times(job):
             job.finish_time.ctime(),
             job.finish_time - job.start_time,
         )
+    if job.wall_time is not None:
+        timing += "\nResources: wall time: {} \t CPU time: {} \t max. memory: {}".format(
+            _duration(job.wall_time),
+            _duration(job.cpu_time or 0.0),
+            _memory(job.max_memory or 0),
+        )
     return timing
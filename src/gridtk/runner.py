@@ -0,0 +1,400 @@
+# Copyright © 2022 Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Runs jobs with the Python standard library only, as a lean alternative to
+:py:meth:`gridtk.manager.JobManager.run_job` (see ``jman run-job --lean``).
+
+The runner claims the job, reads its command line and records its result with
+prepared :py:mod:`sqlite3` statements that follow the schema of
+:py:mod:`gridtk.models`, instead of loading SQLAlchemy and the ORM models for
+each task.  Only the result of jobs that other jobs depend on, or that stop
+their dependent jobs on failure, is left to
+:py:meth:`gridtk.manager.JobManager.finish_job`, which also updates the
+dependent jobs.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import logging
+import os
+import pickle
+import shlex
+import socket
+import sqlite3
+import subprocess
+import time
+import typing
+
+from datetime import datetime
+
+from . import spool
+from .tools import get_array_file_line, pe_slots
+
+logger = logging.getLogger(__name__)
+
+# The environment variables describing the task of an array job
+ARRAY_TASK_VARIABLES = (
+    "SGE_TASK_ID",
+    "SGE_TASK_FIRST",
+    "SGE_TASK_LAST",
+    "SGE_TASK_STEPSIZE",
+)
+
+# The format in which SQLAlchemy stores date and time columns in SQLite
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def run_command(
+    command_line: list[str], exec_dir: str | None
+) -> tuple[int, tuple[float, float, int]]:
+    """Runs the given command line, and waits until it has finished.
+
+    Returns:
+
+        A tuple ``(result, resources)``, where the resources are the
+        wall-clock time, the CPU time and the peak memory (in bytes) used by
+        the command, as measured by the operating system
+    """
+    start = time.time()
+    process = subprocess.Popen(command_line, cwd=exec_dir)
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    process.returncode = os.waitstatus_to_exitcode(status)
+    resources = (
+        time.time() - start,
+        usage.ru_utime + usage.ru_stime,
+        # Linux reports the maximum resident set size in kilobytes
+        usage.ru_maxrss * 1024,
+    )
+    return process.returncode, resources
+
+
+def unset_array_task():
+    """Hides the array task from a packed job, which is no array job (e.g. for
+    :py:func:`gridtk.tools.get_array_job_slice`)."""
+    for key in ARRAY_TASK_VARIABLES:
+        os.environ[key] = "undefined"
+    for key in [k for k in os.environ if k.startswith("SLURM_ARRAY_")]:
+        del os.environ[key]
+
+
+def set_array_task(array_id: int, array: tuple[int, int, int]):
+    """Sets up the environment of the given array job, as if the whole array
+    ``(first, last, step)`` was submitted, even if the grid runs a different
+    array (see :py:meth:`gridtk.backend.GridJobManager._array_for_tasks`)."""
+    first, last, step = array
+    os.environ.update(
+        SGE_TASK_ID=str(array_id),
+        SGE_TASK_FIRST=str(first),
+        SGE_TASK_LAST=str(last),
+        SGE_TASK_STEPSIZE=str(step),
+    )
+    if "SLURM_ARRAY_TASK_ID" in os.environ:
+        os.environ.update(
+            SLURM_ARRAY_TASK_ID=str(array_id),
+            SLURM_ARRAY_TASK_MIN=str(first),
+            SLURM_ARRAY_TASK_MAX=str(last),
+            SLURM_ARRAY_TASK_STEP=str(step),
+        )
+
+
+def _loads(value):
+    """Unpickles a column, which might have been stored as text."""
+    return pickle.loads(value if isinstance(value, bytes) else value.encode())
+
+
+def _now():
+    return datetime.now().strftime(DATETIME_FORMAT)
+
+
+@contextlib.contextmanager
+def _transaction(connection: sqlite3.Connection) -> typing.Iterator[None]:
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+def _connect(database: str) -> sqlite3.Connection:
+    # the same timeout as the ORM, and transactions are handled explicitly
+    return sqlite3.connect(database, timeout=600, isolation_level=None)
+
+
+def _find_job(connection, job_id, array_id, grid):
+    """Returns the unique id of the job to run, and the id of its array job to
+    run, like :py:meth:`gridtk.backend.GridJobManager.run_job` does."""
+    rows = connection.execute(
+        'SELECT "unique", pack_index, array_string FROM Job WHERE %s = ?'
+        % ("id" if grid else '"unique"'),
+        (job_id,),
+    ).fetchall()
+    if array_id is not None and any(r[1] is not None for r in rows):
+        # the task of a packed array job runs a single job
+        rows = [r for r in rows if r[1] == array_id]
+        array_id = None
+        unset_array_task()
+    if len(rows) != 1:
+        raise ValueError("Could not find job id '%d' in the database'" % job_id)
+    unique, _, array_string = rows[0]
+    array = _loads(array_string) if array_string is not None else None
+    if grid and array_id is not None and array:
+        # tasks of re-submitted array jobs might run other array jobs
+        mapped = dict(
+            connection.execute(
+                "SELECT grid_task, id FROM ArrayJob WHERE job_id = ? "
+                "AND grid_id IS NULL AND grid_task IS NOT NULL",
+                (unique,),
+            )
+        )
+        array_id = mapped.get(array_id, array_id)
+        set_array_task(array_id, array)
+    return unique, array_id
+
+
+def _execute(connection, unique, array_id, machine_name):
+    """Sets the status of the job to 'executing', like
+    :py:meth:`gridtk.models.Job.execute` does."""
+    now = _now()
+    with _transaction(connection):
+        if array_id is None:
+            connection.execute(
+                "UPDATE Job SET status = 'executing', machine_name = ?, "
+                'start_time = COALESCE(start_time, ?) WHERE "unique" = ?',
+                (machine_name, now, unique),
+            )
+        else:
+            connection.execute(
+                "UPDATE ArrayJob SET status = 'executing', machine_name = ?, "
+                "start_time = ? WHERE job_id = ? AND id = ?",
+                (machine_name, now, unique, array_id),
+            )
+            connection.execute(
+                "UPDATE Job SET status = 'executing', "
+                'start_time = COALESCE(start_time, ?) WHERE "unique" = ?',
+                (now, unique),
+            )
+
+
+def _finish(connection, unique, array_id, result, resources):
+    """Sets the status and the result of the job (and the resources it used,
+    if given), like :py:meth:`gridtk.models.Job.finish` does.
+
+    Returns:
+
+        ``False`` if the job needs to be finished by the ORM, since other jobs
+        depend on it
+    """
+    now = _now()
+    status = "success" if result == 0 else "failure"
+    with _transaction(connection):
+        job = connection.execute(
+            'SELECT stop_on_failure FROM Job WHERE "unique" = ?', (unique,)
+        ).fetchone()
+        if job is None:
+            # it seems that the job has been deleted in the meanwhile
+            logger.error(
+                "The job with id '%d' could not be found in the database!",
+                unique,
+            )
+            return True
+        dependent = connection.execute(
+            "SELECT 1 FROM JobDependence WHERE waited_for_job_id = ? LIMIT 1",
+            (unique,),
+        ).fetchone()
+        if job[0] or dependent:
+            return False
+
+        if array_id is None:
+            connection.execute(
+                "UPDATE Job SET status = ?, result = ?, finish_time = ? "
+                'WHERE "unique" = ?',
+                (status, result, now, unique),
+            )
+            if resources is not None:
+                connection.execute(
+                    "UPDATE Job SET wall_time = ?, cpu_time = ?, "
+                    'max_memory = ? WHERE "unique" = ?',
+                    resources + (unique,),
+                )
+            return True
+
+        connection.execute(
+            "UPDATE ArrayJob SET status = ?, result = ?, finish_time = ? "
+            "WHERE job_id = ? AND id = ?",
+            (status, result, now, unique, array_id),
+        )
+        if resources is not None:
+            connection.execute(
+                "UPDATE ArrayJob SET wall_time = ?, cpu_time = ?, "
+                "max_memory = ? WHERE job_id = ? AND id = ?",
+                resources + (unique, array_id),
+            )
+            # summarize the array jobs
+            connection.execute(
+                "UPDATE Job SET (wall_time, cpu_time, max_memory) = ("
+                "SELECT SUM(wall_time), SUM(COALESCE(cpu_time, 0)), "
+                "MAX(COALESCE(max_memory, 0)) FROM ArrayJob "
+                'WHERE job_id = ? AND wall_time IS NOT NULL) WHERE "unique" = ?',
+                (unique, unique),
+            )
+
+        # the job has finished when all of its array jobs have
+        new_result = result
+        for array_status, array_result in connection.execute(
+            "SELECT status, result FROM ArrayJob WHERE job_id = ? ORDER BY id",
+            (unique,),
+        ):
+            if array_status not in ("success", "failure"):
+                return True
+            if new_result == 0:
+                new_result = array_result
+        connection.execute(
+            "UPDATE Job SET status = ?, result = ?, finish_time = ? "
+            'WHERE "unique" = ?',
+            (
+                "success" if new_result == 0 else "failure",
+                new_result,
+                now,
+                unique,
+            ),
+        )
+    return True
+
+
+def run_job(
+    database: str, job_id: int, array_id: int | None = None, grid: bool = True
+) -> dict:
+    """Runs a job with the given id, and the given array job, if any.
+
+    If the spool directory of the database is enabled (see
+    :py:mod:`gridtk.spool`), the status changes of the job are written there
+    instead of into the database.  The result of the job is also written there
+    if it cannot be written into the database.
+
+
+    Parameters:
+
+        database: The path of the database
+
+        job_id: The id of the job: its grid id if ``grid`` is set, otherwise
+            its unique id
+
+        array_id: The task of the array job, if any
+
+        grid: Whether the job was started by the grid, which might run packed
+            jobs or other array jobs than the given task
+
+
+    Returns:
+
+        A dictionary with the unique id of the job (``job``), its ``array``
+        job, the ``result`` and the ``resources`` used by the command, and
+        whether the result was ``recorded`` (possibly in the spool directory).
+        If not, it still needs to be recorded with :py:meth:`gridtk.manager.JobManager.finish_job`.
+    """
+    machine_name = socket.gethostname()
+    spool_directory = spool.directory(database)
+    spooled = spool.enabled(spool_directory)
+
+    connection = _connect(database)
+    try:
+        unique, array_id = _find_job(connection, job_id, array_id, grid)
+        if spooled:
+            spool.write(
+                spool_directory,
+                dict(
+                    event="execute",
+                    job=unique,
+                    array=array_id,
+                    time=time.time(),
+                    host=machine_name,
+                ),
+            )
+        else:
+            _execute(connection, unique, array_id, machine_name)
+        (
+            command_line,
+            exec_dir,
+            array_file,
+            grid_arguments,
+            queue_name,
+        ) = connection.execute(
+            "SELECT command_line, exec_dir, array_file, grid_arguments, "
+            'queue_name FROM Job WHERE "unique" = ?',
+            (unique,),
+        ).fetchone()
+    finally:
+        # do not keep the database open while the job runs
+        connection.close()
+
+    command_line = _loads(command_line)
+    if exec_dir is not None:
+        exec_dir = os.path.realpath(exec_dir)
+    pe_opt = _loads(grid_arguments)["kwargs"].get("pe_opt")
+    if pe_opt and "NSLOTS" not in os.environ:
+        os.environ["NSLOTS"] = str(pe_slots(pe_opt))
+
+    resources = None
+    try:
+        if array_file is not None and array_id is not None:
+            command_line += shlex.split(
+                get_array_file_line(array_file, array_id)
+            )
+        result, resources = run_command(command_line, exec_dir)
+        logger.info("Job %d finished with result %s", unique, str(result))
+    except Exception as e:
+        logger.error(
+            "The job with id '%d' could not be executed: %s", unique, e
+        )
+        result = 69  # ASCII: 'E'
+    if queue_name != "local":
+        # the accounting of the grid knows better
+        resources = None
+
+    retval = dict(
+        job=unique,
+        array=array_id,
+        result=result,
+        resources=resources,
+        recorded=True,
+    )
+    if not spooled:
+        try:
+            connection = _connect(database)
+            try:
+                retval["recorded"] = _finish(
+                    connection, unique, array_id, result, resources
+                )
+            finally:
+                connection.close()
+            return retval
+        except sqlite3.Error as e:
+            # never lose the result, which will be merged later on, like
+            # :py:meth:`gridtk.manager.JobManager.finish_job` does
+            logger.error("Caught exception '%s'", e)
+            logger.warning(
+                "Writing the result of job '%d' into the spool directory",
+                unique,
+            )
+
+    spool.write(
+        spool_directory,
+        dict(
+            event="finish",
+            job=unique,
+            array=array_id,
+            time=time.time(),
+            result=result,
+            resources=resources,
+        ),
+    )
+    return retval
@@ -15,16 +15,24 @@ __epilog__ = """ For a list of available commands:
 """
 
 import argparse
+import contextlib
+import io
 import logging
 import os
+import shlex
 import string
 import sys
 
-from .. import local, sge
-from ..models import Status
+from ..constants import LIST_FORMATS, STATS_GROUPS, Status
+
+# The job managers (and SQLAlchemy with them) are only imported by the
+# commands that need them, to keep the start up of each command fast
 
 logger = logging.getLogger("gridtk")
 
+# The job manager of 'jman server', which handles the commands of its clients
+_served_manager = None
+
 GPU_QUEUES = ["gpu", "lgpu", "sgpu", "gpum", "vsgpu"]
 QUEUES = ["all.q", "q1d", "q1w", "q1m", "q1dm", "q1wm"] + GPU_QUEUES
 
@@ -52,18 +60,35 @@ def setup(args):
         "wrapper_script": args.wrapper_script,
         "debug": args.verbose == 3,
         "database": args.database,
+        "spool": getattr(args, "spool", False),
+        "lean": getattr(args, "lean", False),
     }
 
-    if args.local:
-        jm = local.JobManagerLocal(**kwargs)
+    if _served_manager is not None:
+        jm = _served_manager
+    elif args.local:
+        from ..local import JobManagerLocal
+
+        jm = JobManagerLocal(**kwargs)
+    elif args.backend == "slurm":
+        from ..slurm import JobManagerSlurm
+
+        jm = JobManagerSlurm(**kwargs)
     else:
-        jm = sge.JobManagerSGE(**kwargs)
+        from ..sge import JobManagerSGE
+
+        jm = JobManagerSGE(**kwargs)
 
-    # set-up logging
-    if args.verbose not in range(0, 4):
+    _setup_logging(args.verbose)
+    return jm
+
+
+def _setup_logging(verbose):
+    """Sets up the logging system with the given verbosity level."""
+    if verbose not in range(0, 4):
         raise ValueError(
             "The verbosity level %d does not exist. Please reduce the number of '--verbose' parameters in your call to maximum 3"
-            % args.verbose
+            % verbose
         )
 
     # set up the verbosity level of the logging system
@@ -72,7 +97,7 @@ def setup(args):
         1: logging.WARNING,
         2: logging.INFO,
         3: logging.DEBUG,
-    }[args.verbose]
+    }[verbose]
 
     handler = logging.StreamHandler()
     handler.setFormatter(
@@ -81,8 +106,6 @@ def setup(args):
     logger.addHandler(handler)
     logger.setLevel(log_level)
 
-    return jm
-
 
 def get_array(array):
     if array is None:
@@ -134,13 +157,31 @@ def get_memfree(memory, parallel):
     return "%d%s" % (number * parallel, memtype)
 
 
+def get_commands(args):
+    """Returns the command lines to submit, either the one given on the
+    command line, or one for each line of the file given with --from-file."""
+    if args.from_file is None:
+        return [args.job]
+    commands = []
+    with open(args.from_file) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                commands.append(args.job + shlex.split(line))
+    return commands
+
+
 def submit(args):
     """Submission command."""
     # set full path to command
-    if args.job[0] == "--":
+    if args.job and args.job[0] == "--":
         del args.job[0]
-    if not os.path.isabs(args.job[0]):
-        args.job[0] = os.path.abspath(args.job[0])
+    commands = get_commands(args)
+    if not commands or not all(commands):
+        raise ValueError("Please specify the command that should be executed")
+    for command in commands:
+        if not os.path.isabs(command[0]):
+            command[0] = os.path.abspath(command[0])
 
     jm = setup(args)
     kwargs = {
@@ -156,6 +197,21 @@ def submit(args):
 
     if args.array is not None:
         kwargs["array"] = get_array(args.array)
+    if args.array_from_file is not None:
+        if args.array is not None or args.from_file is not None:
+            raise ValueError(
+                "The --array-from-file option cannot be combined with --array or --from-file"
+            )
+        from ..tools import index_lines
+
+        array_file = os.path.abspath(args.array_from_file)
+        count = index_lines(array_file)
+        if not count:
+            raise ValueError(
+                "The file '%s' does not contain any parameters" % array_file
+            )
+        kwargs["array"] = (1, count, 1)
+        kwargs["array_file"] = array_file
     if args.exec_dir is not None:
         kwargs["exec_dir"] = args.exec_dir
     if args.log_dir is not None:
@@ -173,12 +229,24 @@ def submit(args):
     kwargs["dry_run"] = args.dry_run
     kwargs["stop_on_failure"] = args.stop_on_failure
 
-    # submit the job(s)
-    for _ in range(args.repeat):
-        job_id = jm.submit(args.job, **kwargs)
-        dependencies = kwargs.get("dependencies", [])
-        dependencies.append(job_id)
-        kwargs["dependencies"] = dependencies
+    if len(commands) == 1 and args.repeat == 1:
+        job_id = jm.submit(commands[0], **kwargs)
+    else:
+        # each repetition of a command depends on the ones before
+        submissions = []
+        for command in commands:
+            first = len(submissions)
+            for r in range(args.repeat):
+                submissions.append(
+                    {
+                        "command_line": command,
+                        "after": [first + k for k in range(r)],
+                    }
+                )
+        if not args.local:
+            kwargs["workers"] = args.workers
+            kwargs["pack"] = args.pack
+        job_id = jm.submit_many(submissions, **kwargs)[-1]
 
     if args.print_id:
         print(job_id, end="")
@@ -199,7 +267,8 @@ def resubmit(args):
             appropriate_for_gpu(args, kwargs)
     if args.parallel is not None:
         kwargs["pe_opt"] = "pe_mth %d" % args.parallel
-        kwargs["memfree"] = get_memfree(args.memory, args.parallel)
+        if args.memory is not None:
+            kwargs["memfree"] = get_memfree(args.memory, args.parallel)
     if args.io_big:
         kwargs["io_big"] = True
     if args.no_io_big:
@@ -211,6 +280,9 @@ def resubmit(args):
         args.running_jobs,
         args.overwrite_command,
         keep_logs=args.keep_logs,
+        array_ids=get_ids(args.array_ids),
+        failed_only=args.failed_only,
+        auto_memory=args.auto_memory,
         **kwargs,
     )
 
@@ -241,19 +313,33 @@ def list(args):
     jm = setup(args)
 
     if not args.local:
-        # update the status of jobs from SGE before listing them.
-        jm.communicate(job_ids=get_ids(args.job_ids))
-
-    jm.list(
-        job_ids=get_ids(args.job_ids),
-        print_array_jobs=args.print_array_jobs,
-        print_dependencies=args.print_dependencies,
-        status=args.status,
-        long=args.long,
-        print_times=args.print_times,
-        ids_only=args.ids_only,
-        names=args.names,
-    )
+        # update the status of jobs from SGE before listing them, unless
+        # 'jman watch' does it for us
+        if jm.watcher() is None:
+            jm.communicate(job_ids=get_ids(args.job_ids))
+        else:
+            logger.debug(
+                "Skipping the status update, since the jobs are watched"
+            )
+
+    try:
+        jm.list(
+            job_ids=get_ids(args.job_ids),
+            print_array_jobs=args.print_array_jobs,
+            print_dependencies=args.print_dependencies,
+            status=args.status,
+            long=args.long,
+            print_times=args.print_times,
+            ids_only=args.ids_only,
+            names=args.names,
+            output_format=args.format,
+            limit=args.limit,
+            offset=args.offset,
+        )
+    except BrokenPipeError:
+        # the reader of the listing (e.g. 'head') does not need the rest
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
 
 
 def communicate(args):
@@ -263,7 +349,60 @@ def communicate(args):
             "The communicate command can only be used without the '--local' command line option"
         )
     jm = setup(args)
-    jm.communicate(job_ids=get_ids(args.job_ids))
+    jm.communicate(job_ids=get_ids(args.job_ids), force=True)
+
+
+def watch(args):
+    """Keeps the database in sync with the grid."""
+    if args.local:
+        raise ValueError(
+            "The watch command can only be used without the '--local' command line option"
+        )
+    jm = setup(args)
+    if not jm.watch(interval=args.interval, until_done=args.until_done):
+        raise RuntimeError("The database is already watched by another process")
+
+
+def get_since(since):
+    """Returns the time given as ISO date (and time), or as duration before
+    now, e.g., ``12h``, ``3d`` or ``2w``."""
+    from datetime import datetime, timedelta
+
+    units = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+    if since[-1:] in units and since[:-1].isdigit():
+        return datetime.now() - timedelta(**{units[since[-1]]: int(since[:-1])})
+    try:
+        return datetime.fromisoformat(since)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "'%s' is neither a date nor a duration like 3d" % since
+        )
+
+
+def stats(args):
+    """Prints statistics of the wait and run times of the jobs."""
+    jm = setup(args)
+    jm.stats(
+        group_by=args.by,
+        since=args.since,
+        job_ids=get_ids(args.job_ids),
+        print_json=args.json,
+    )
+
+
+def accounting(args):
+    """Imports the resources used by finished jobs from the grid accounting."""
+    if args.local:
+        raise ValueError(
+            "The accounting command can only be used without the '--local' command line option"
+        )
+    jm = setup(args)
+    imported = jm.accounting(
+        job_ids=get_ids(args.job_ids),
+        refresh=args.refresh,
+        accounting_file=args.file,
+    )
+    logger.info("Imported the resources used by %d jobs", imported)
 
 
 def report(args):
@@ -276,6 +415,12 @@ def report(args):
         error=not args.output_only,
         status=args.status,
         name=args.name,
+        head=args.head,
+        tail=args.tail,
+        failed_only=args.failed_only,
+        grep=args.grep is not False,
+        pattern=args.grep or None,
+        index=args.log_index,
     )
 
 
@@ -310,17 +455,102 @@ def delete(args):
     )
 
 
+def serve(args):
+    """Serves the commands of other jman calls on this database, until
+    interrupted."""
+    from .. import server
+
+    global _served_manager
+    jm = setup(args)
+    path = server.socket_path(args.database)
+
+    def execute(request):
+        if (request["local"], request["backend"]) != (args.local, args.backend):
+            # let the client handle the request itself
+            return {"unsupported": True}
+        stdout, stderr = io.StringIO(), io.StringIO()
+        handlers = logger.handlers[:]
+        cwd = os.getcwd()
+        try:
+            os.chdir(request["cwd"])
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(
+                stderr
+            ):
+                status = main([jm.wrapper_script] + request["argv"]) or 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            stderr.write(f"{type(e).__name__}: {e}\n")
+            status = 1
+        finally:
+            os.chdir(cwd)
+            logger.handlers[:] = handlers
+        # as 'jman delete' would do, when the job manager is deleted
+        jm.remove_empty_database()
+        return dict(
+            stdout=stdout.getvalue(), stderr=stderr.getvalue(), status=status
+        )
+
+    _served_manager = jm
+    logger.info("Serving the jobs of '%s' on '%s'" % (args.database, path))
+    with server.Server(path, execute) as s:
+        try:
+            s.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Stopped serving the jobs of '%s'" % args.database)
+        finally:
+            _served_manager = None
+
+
 def run_job(args):
     """Starts the wrapper script to execute a job, interpreting the JOB_ID and
     SGE_TASK_ID keywords that are set by the grid or by us."""
-    jm = setup(args)
+    if "JOB_ID" not in os.environ and "SLURM_JOB_ID" in os.environ:
+        # we are running on a Slurm cluster
+        from ..slurm import sge_environment
+
+        os.environ.update(sge_environment())
+        args.backend = "slurm"
     job_id = int(os.environ["JOB_ID"])
     array_id = (
         int(os.environ["SGE_TASK_ID"])
         if os.environ["SGE_TASK_ID"] != "undefined"
         else None
     )
-    jm.run_job(job_id, array_id)
+    if not args.lean:
+        setup(args).run_job(job_id, array_id)
+        return
+
+    # runs the job without loading the ORM, unless it has dependent jobs
+    from ..runner import run_job as run_lean
+
+    _setup_logging(args.verbose)
+    finished = run_lean(
+        os.path.realpath(args.database), job_id, array_id, grid=not args.local
+    )
+    if not finished["recorded"]:
+        logger.info(
+            "Recording the result of job %d with the job manager, since it "
+            "has dependent jobs",
+            finished["job"],
+        )
+        setup(args).finish_job(
+            finished["job"],
+            finished["array"],
+            finished["result"],
+            finished["resources"],
+        )
+
+
+def env(args):
+    """Prints the environment variables set by a SETSHELL context, which are
+    cached for later use."""
+    from ..setshell import environ
+
+    new_environ = environ(args.context, refresh=args.refresh)
+    for key in sorted(new_environ):
+        if os.environ.get(key) != new_environ[key]:
+            print(f"{key}={new_environ[key]}")
 
 
 class AliasedSubParsersAction(argparse._SubParsersAction):
@@ -357,14 +587,67 @@ class AliasedSubParsersAction(argparse._SubParsersAction):
         return parser
 
 
-def main(command_line_options=None):
-    from importlib.metadata import version
+class VersionAction(argparse.Action):
+    """Prints the version of gridtk, which is only looked up when asked
+    for."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, help=None):
+        super().__init__(
+            option_strings,
+            dest,
+            default=argparse.SUPPRESS,
+            nargs=0,
+            help=help,
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from importlib.metadata import version
+
+        print("gridtk version %s" % version(__name__.split(".", 1)[0]))
+        parser.exit()
+
 
-    from clapper.rc import UserDefaults
+class UserDefault:
+    """The default value of an option from the user configuration (see
+    :py:func:`gridtk.tools.user_defaults`), which is only read when the value
+    is used (see :py:class:`Namespace`), so that commands that do not use it
+    do not load the configuration."""
 
-    from ..tools import USER_CONFIGURATION
+    def __init__(self, key, default):
+        self.key = key
+        self.default = default
 
-    defaults = UserDefaults(USER_CONFIGURATION)
+    def resolve(self):
+        from ..tools import user_defaults
+
+        return user_defaults().get(self.key, self.default)
+
+    def __str__(self):
+        # as shown by the help of the option
+        return str(self.resolve())
+
+
+class UserDefaults:
+    """Hands out the :py:class:`UserDefault` values of the options."""
+
+    def get(self, key, default=None):
+        return UserDefault(key, default)
+
+
+class Namespace(argparse.Namespace):
+    """The parsed options, whose :py:class:`UserDefault` values are resolved
+    when they are accessed."""
+
+    def __getattribute__(self, name):
+        value = super().__getattribute__(name)
+        if isinstance(value, UserDefault):
+            value = value.resolve()
+            setattr(self, name, value)
+        return value
+
+
+def main(command_line_options=None):
+    defaults = UserDefaults()
 
     formatter = argparse.ArgumentDefaultsHelpFormatter
     parser = argparse.ArgumentParser(
@@ -384,8 +667,8 @@ def main(command_line_options=None):
     parser.add_argument(
         "-V",
         "--version",
-        action="version",
-        version="gridtk version %s" % version(__name__.split(".", 1)[0]),
+        action=VersionAction,
+        help="show program's version number and exit",
     )
     parser.add_argument(
         "-d",
@@ -402,6 +685,13 @@ def main(command_line_options=None):
         action="store_true",
         help="Uses the local job manager instead of the SGE one.",
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=("sge", "slurm"),
+        default=defaults.get("backend", "sge"),
+        help="The grid scheduler to submit jobs to (and to query them from).",
+    )
     cmdparser = parser.add_subparsers(
         title="commands", help="commands accepted by %(prog)s"
     )
@@ -419,8 +709,8 @@ def main(command_line_options=None):
         metavar="QNAME",
         dest="qname",
         default="all.q",
-        choices=QUEUES,
-        help="the name of the SGE queue to submit the job to",
+        choices=QUEUES + ["auto"],
+        help="the name of the SGE queue to submit the job to; 'auto' chooses the shortest queue that fits earlier runs of the same job",
     )
     submit_parser.add_argument(
         "-e",
@@ -511,6 +801,41 @@ def main(command_line_options=None):
         default=1,
         help="Submits the job N times. Each job will depend on the job before.",
     )
+    submit_parser.add_argument(
+        "-f",
+        "--from-file",
+        metavar="FILE",
+        help="Submits one job for each (non-empty) line of FILE. The contents of each line are appended to the given command, if any.",
+    )
+    submit_parser.add_argument(
+        "-F",
+        "--array-from-file",
+        metavar="FILE",
+        help="Submits an array job with one task for each (non-empty) line of FILE. The contents of the line of each task are appended to the given command, if any; each task reads only its own line, using an index of FILE in the cache directory of gridtk.",
+    )
+    submit_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=8,
+        help="The maximum number of parallel calls to qsub when submitting several jobs at once.",
+    )
+    submit_parser.add_argument(
+        "--spool",
+        action="store_true",
+        help="Running jobs of this database write their status into a spool directory next to the database, which is merged into the database in batches (e.g. by 'jman list'), instead of writing to the database themselves. This avoids many concurrent writes to the database, e.g., for large array jobs.",
+    )
+    submit_parser.add_argument(
+        "--lean",
+        action="store_true",
+        default=defaults.get("lean-runner", False),
+        help="Runs the jobs with a lean wrapper, which records their status through the sqlite3 module of Python instead of loading SQLAlchemy, and so starts much faster, e.g., for large array jobs of short tasks. The results of jobs that other jobs depend on, or that were submitted with --stop-on-failure, are still recorded by the job manager.",
+    )
+    submit_parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="Packs the jobs submitted at once (e.g. with --from-file) that do not depend on each other into array jobs, which are handled by the grid much faster than single jobs.",
+    )
     submit_parser.add_argument(
         "-o",
         "--print-id",
@@ -544,8 +869,8 @@ def main(command_line_options=None):
         "--queue",
         metavar="QNAME",
         dest="qname",
-        choices=QUEUES,
-        help="Reset the SGE queue to submit the job to",
+        choices=QUEUES + ["auto"],
+        help="Reset the SGE queue to submit the job to ('auto' chooses the shortest queue that fits earlier runs of the job)",
     )
     resubmit_parser.add_argument(
         "-m",
@@ -592,6 +917,34 @@ def main(command_line_options=None):
         action="store_true",
         help="Re-submit even jobs that are running or waiting (use this flag with care).",
     )
+    resubmit_parser.add_argument(
+        "-A",
+        "--array-ids",
+        metavar="ID",
+        nargs="+",
+        help="Re-submit only the array jobs with the given array ids, keeping the results and logs of the other array jobs.",
+    )
+    resubmit_parser.add_argument(
+        "-F",
+        "--failed-only",
+        action="store_true",
+        help="Re-submit only the array jobs that failed, keeping the results and logs of the other array jobs.",
+    )
+    resubmit_parser.add_argument(
+        "-M",
+        "--auto-memory",
+        metavar="HEADROOM",
+        type=float,
+        nargs="?",
+        const=defaults.get("memory-headroom", 1.5),
+        help="Request the peak memory used by the last run of each job (as recorded locally or by the accounting of the grid), multiplied by the given headroom.",
+    )
+    resubmit_parser.add_argument(
+        "--lean",
+        action="store_true",
+        default=defaults.get("lean-runner", False),
+        help="Runs the jobs with a lean wrapper, which records their status through the sqlite3 module of Python instead of loading SQLAlchemy, and so starts much faster. The results of jobs that other jobs depend on, or that were submitted with --stop-on-failure, are still recorded by the job manager.",
+    )
     resubmit_parser.add_argument(
         "-o",
         "--overwrite-command",
@@ -674,6 +1027,25 @@ def main(command_line_options=None):
         default=Status,
         help="Delete only jobs that have the given statuses; by default all jobs are deleted.",
     )
+    list_parser.add_argument(
+        "-f",
+        "--format",
+        choices=LIST_FORMATS,
+        help="Prints one record for each job (and for each array job with --print-array-jobs) in the given format instead of a table, while the jobs are read from the database. The --long, --print-times and --print-dependencies options add fields to the records.",
+    )
+    list_parser.add_argument(
+        "--limit",
+        metavar="N",
+        type=int,
+        help="List at most N jobs.",
+    )
+    list_parser.add_argument(
+        "--offset",
+        metavar="N",
+        type=int,
+        default=0,
+        help="Skip the first N jobs (in the order of their ids) before listing.",
+    )
     list_parser.set_defaults(func=list)
 
     # subcommand 'communicate'
@@ -692,6 +1064,88 @@ def main(command_line_options=None):
     )
     stop_parser.set_defaults(func=communicate)
 
+    # subcommand 'watch'
+    watch_parser = cmdparser.add_parser(
+        "watch",
+        formatter_class=formatter,
+        help="Keeps checking the status of the jobs in the grid, so that other jman commands do not need to.",
+    )
+    watch_parser.add_argument(
+        "-i",
+        "--interval",
+        type=float,
+        default=30.0,
+        help="The time between two checks of the grid, in seconds.",
+    )
+    watch_parser.add_argument(
+        "-u",
+        "--until-done",
+        action="store_true",
+        help="Stops watching when all jobs in the grid have finished.",
+    )
+    watch_parser.set_defaults(func=watch)
+
+    # subcommand 'accounting'
+    accounting_parser = cmdparser.add_parser(
+        "accounting",
+        aliases=["acct"],
+        formatter_class=formatter,
+        help="Imports the resources (wall time, CPU time, memory and host) used by finished jobs from the accounting of the grid.",
+    )
+    accounting_parser.add_argument(
+        "-j",
+        "--job-ids",
+        metavar="ID",
+        nargs="+",
+        help="Import only the jobs with the given ids (by default, all finished jobs are imported)",
+    )
+    accounting_parser.add_argument(
+        "-r",
+        "--refresh",
+        action="store_true",
+        help="Also import the jobs that were imported before.",
+    )
+    accounting_parser.add_argument(
+        "-f",
+        "--file",
+        metavar="FILE",
+        help="The accounting file of the grid to parse; by default, $SGE_ROOT/$SGE_CELL/common/accounting is parsed if readable, otherwise qacct is used.",
+    )
+    accounting_parser.set_defaults(func=accounting)
+
+    # subcommand 'stats'
+    stats_parser = cmdparser.add_parser(
+        "stats",
+        formatter_class=formatter,
+        help="Prints statistics of the tasks (jobs, and array jobs of array jobs) in the database: their failure rate, throughput, and the percentiles and histograms of the times they waited in the queue and ran, which are computed by the database.",
+    )
+    stats_parser.add_argument(
+        "-b",
+        "--by",
+        choices=STATS_GROUPS,
+        default="name",
+        help="Group the tasks by the name, the queue or the machine of their jobs.",
+    )
+    stats_parser.add_argument(
+        "-S",
+        "--since",
+        type=get_since,
+        help="Consider only the tasks submitted since the given date (e.g., 2024-01-31 or '2024-01-31 12:00'), or since the given time before now (e.g., 12h, 3d or 2w).",
+    )
+    stats_parser.add_argument(
+        "-j",
+        "--job-ids",
+        metavar="ID",
+        nargs="+",
+        help="Consider only the jobs with the given ids (by default, all jobs).",
+    )
+    stats_parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Prints the statistics as JSON.",
+    )
+    stats_parser.set_defaults(func=stats)
+
     # subcommand 'report'
     report_parser = cmdparser.add_parser(
         "report",
@@ -738,6 +1192,40 @@ def main(command_line_options=None):
         default=Status,
         help="Report only jobs that have the given statuses; by default all jobs are reported.",
     )
+    report_parser.add_argument(
+        "-F",
+        "--failed-only",
+        action="store_true",
+        help="Report only the failed jobs, and only the failed array jobs of them (a shortcut for --status failure, which also skips the successful array jobs).",
+    )
+    lines_group = report_parser.add_mutually_exclusive_group()
+    lines_group.add_argument(
+        "--head",
+        metavar="N",
+        type=int,
+        help="Report only the first N lines of each log file.",
+    )
+    lines_group.add_argument(
+        "--tail",
+        metavar="N",
+        type=int,
+        help="Report only the last N lines of each log file, which are read from the end of the file.",
+    )
+    lines_group.add_argument(
+        "-g",
+        "--grep",
+        metavar="PATTERN",
+        nargs="?",
+        default=False,
+        help="Report only the lines of the log files that match the given regular expression, as 'path:line:text', searching the log files in parallel; without a PATTERN, the lines that hint at errors (e.g., 'Traceback', 'Error' or 'out of memory'). The matches in the logs of finished jobs are remembered in the database, so that unchanged log files are not searched again.",
+    )
+    report_parser.add_argument(
+        "--no-log-index",
+        dest="log_index",
+        action="store_false",
+        default=defaults.get("log-index", True),
+        help="Neither use nor remember the matches of --grep in the database, and always search the log files.",
+    )
     report_parser.set_defaults(func=report)
 
     # subcommand 'delete'
@@ -829,22 +1317,77 @@ def main(command_line_options=None):
         type=int,
         help="Jobs will be run with the given priority (can only be positive, i.e., to have lower priority",
     )
+    scheduler_parser.add_argument(
+        "--lean",
+        action="store_true",
+        default=defaults.get("lean-runner", False),
+        help="Runs the jobs with a lean wrapper, which records their status through the sqlite3 module of Python instead of loading SQLAlchemy, and so starts much faster. The results of jobs that other jobs depend on, or that were submitted with --stop-on-failure, are still recorded by the job manager.",
+    )
     scheduler_parser.set_defaults(func=run_scheduler)
 
+    # subcommand 'env'
+    env_parser = cmdparser.add_parser(
+        "env",
+        formatter_class=formatter,
+        help="Prints the (cached) environment of the SETSHELL context used to call the SGE utilities.",
+    )
+    env_parser.add_argument(
+        "-c",
+        "--context",
+        default="grid",
+        help="The SETSHELL context to print.",
+    )
+    env_parser.add_argument(
+        "-r",
+        "--refresh",
+        action="store_true",
+        help="Ignore the cached environment and probe the SETSHELL context again.",
+    )
+    env_parser.set_defaults(func=env)
+
+    # subcommand 'server'
+    server_parser = cmdparser.add_parser(
+        "server",
+        formatter_class=formatter,
+        help="Owns the database, and handles the list, report and delete commands of other jman calls on the same database through a Unix socket, until interrupted.",
+    )
+    server_parser.set_defaults(func=serve)
+
     # subcommand 'run-job'; this should not be seen on the command line since it is actually a wrapper script
     run_parser = cmdparser.add_parser("run-job", help=argparse.SUPPRESS)
+    run_parser.add_argument("--lean", action="store_true")
     run_parser.set_defaults(func=run_job)
 
     if command_line_options:
-        args = parser.parse_args(command_line_options[1:])
+        args = parser.parse_args(command_line_options[1:], Namespace())
         args.wrapper_script = command_line_options[0]
     else:
-        args = parser.parse_args()
+        args = parser.parse_args(namespace=Namespace())
         args.wrapper_script = sys.argv[0]
 
     if not hasattr(args, "func"):
         return parser.print_help(sys.stderr)
 
+    # jobs are not submitted by 'jman server', which would pass on its own
+    # environment to them, instead of the one of the calling jman
+    if _served_manager is None and args.func in (list, report, delete):
+        # let 'jman server' handle the command, if it is running
+        from .. import server
+
+        answer = server.request(
+            server.socket_path(args.database),
+            dict(
+                argv=(command_line_options or sys.argv)[1:],
+                cwd=os.getcwd(),
+                local=args.local,
+                backend=args.backend,
+            ),
+        )
+        if answer is not None and "status" in answer:
+            sys.stdout.write(answer["stdout"])
+            sys.stderr.write(answer["stderr"])
+            return answer["status"]
+
     args.func(args)
 
     return 0
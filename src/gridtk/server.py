@@ -0,0 +1,139 @@
+# Copyright © 2022 Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Serves the commands of ``jman`` through a Unix socket next to the
+database, so that a single process (``jman server``) owns the database.
+
+The protocol is as compact as it gets: the client sends one JSON object in a
+single line, and the server answers with one JSON object in a single line,
+after which the connection is closed.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import typing
+
+logger = logging.getLogger(__name__)
+
+# The longest path of a Unix socket that works on all platforms
+MAX_SOCKET_PATH = 100
+
+
+def socket_path(database: str) -> str:
+    """Returns the path of the socket of the server of the given database.
+
+    The socket is put next to the database, unless the path is too long for a
+    Unix socket, in which case it is put into the temporary directory.
+    """
+    database = os.path.realpath(database)
+    path = database + ".sock"
+    if len(path) <= MAX_SOCKET_PATH:
+        return path
+    digest = hashlib.sha1(path.encode()).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), "gridtk-%s.sock" % digest)
+
+
+def request(
+    path: str, message: dict, timeout: float = 1.0, read_timeout: float = 30.0
+) -> dict | None:
+    """Sends a request to the server listening on the given socket.
+
+    Parameters:
+
+        path: The path of the socket of the server
+
+        message: The request, which needs to be JSON-serializable
+
+        timeout: The time to wait for the connection to the server, in seconds
+
+        read_timeout: The time to wait for the answer of the server, e.g.,
+            while it handles the requests of other clients, in seconds
+
+
+    Returns:
+
+        The answer of the server, or ``None`` if no server is listening, or if
+        it did not answer in time
+    """
+    if not os.path.exists(path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(timeout)
+        try:
+            client.connect(path)
+        except OSError:
+            # a stale socket of a server that died
+            return None
+        client.settimeout(read_timeout)
+        try:
+            with client.makefile("rwb") as stream:
+                stream.write((json.dumps(message) + "\n").encode())
+                stream.flush()
+                answer = stream.readline()
+        except OSError as e:
+            logger.warning("The server on '%s' did not answer: %s", path, e)
+            return None
+    finally:
+        client.close()
+    return json.loads(answer) if answer else None
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        message = json.loads(self.rfile.readline())
+        try:
+            if message.get("ping"):
+                answer = {"status": 0}
+            else:
+                answer = self.server.execute(message)
+        except Exception as e:
+            logger.exception("Could not handle the request %s", message)
+            answer = {"stdout": "", "stderr": "%s\n" % e, "status": 1}
+        try:
+            self.wfile.write((json.dumps(answer) + "\n").encode())
+        except OSError as e:
+            # the client stopped waiting for the answer
+            logger.warning("Could not answer the request %s: %s", message, e)
+
+
+class Server(socketserver.UnixStreamServer):
+    """A server that handles one request after the other with the given
+    function.
+
+    Parameters:
+
+        path: The path of the socket to listen on
+
+        execute: The function that handles a request, and returns the answer
+    """
+
+    def __init__(self, path: str, execute: typing.Callable[[dict], dict]):
+        if request(path, {"ping": True}) is not None:
+            raise RuntimeError(
+                "Another server is already listening on '%s'" % path
+            )
+        if os.path.exists(path):
+            os.remove(path)
+        self.execute = execute
+        # only we may connect to the socket, from the moment it is created
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
@@ -6,23 +6,158 @@
 
 from __future__ import annotations
 
+import json
 import logging
 import os
 import signal
 import subprocess
 import sys
+import tempfile
+import time
 
 from .tools import str_
 
 logger = logging.getLogger(__name__)
 
+# The Idiap-wide shell initialization file
+IDIAP_SOURCE = "/idiap/resource/software/initfiles/shrc"
 
-def environ(context: str) -> dict[str, str]:
-    """Retrieves the environment for a particular SETSHELL context."""
+# Time (in seconds) for which a discovered environment is re-used
+CACHE_TTL = 24 * 60 * 60
+
+# Environment changes of each context discovered in this process
+_environ_cache: dict[str, dict[str, str]] = {}
+
+
+def _cache_path(context: str) -> str:
+    """Returns the path of the on-disk cache of a SETSHELL context."""
+    cache_home = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    return os.path.join(cache_home, "gridtk", "setshell-%s.json" % context)
+
+
+def _mtimes(changes: dict[str, str]) -> dict[str, float]:
+    """Returns the modification times of the files used by SETSHELL."""
+    files = [IDIAP_SOURCE]
+    basedir = changes.get("BASEDIRSETSHELL", os.environ.get("BASEDIRSETSHELL"))
+    if basedir is not None:
+        files.append("%s/setshell/bin/dosetshell" % basedir)
+    return {k: os.stat(k).st_mtime for k in files if os.path.exists(k)}
+
+
+def _load_cache(context: str, ttl: float) -> dict[str, str] | None:
+    """Loads the environment changes of a context from the on-disk cache, if
+    they are still valid."""
+    path = _cache_path(context)
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if time.time() - cached.get("time", 0) > ttl:
+        logger.debug("SETSHELL cache '%s' has expired", path)
+        return None
+
+    if cached.get("mtimes") != _mtimes(cached.get("environ", {})):
+        logger.debug("SETSHELL cache '%s' is outdated", path)
+        return None
+
+    logger.debug("Loaded environment for context '%s' from '%s'", context, path)
+    return cached["environ"]
+
+
+def _save_cache(context: str, changes: dict[str, str]) -> None:
+    """Stores the environment changes of a context in the on-disk cache."""
+    path = _cache_path(context)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write atomically, so that concurrent readers never see partial files
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                {
+                    "context": context,
+                    "time": time.time(),
+                    "mtimes": _mtimes(changes),
+                    "environ": changes,
+                },
+                f,
+            )
+        os.replace(tmp, path)
+        logger.debug(
+            "Saved environment for context '%s' to '%s'", context, path
+        )
+    except OSError as e:
+        logger.warning("Could not cache SETSHELL environment: %s", e)
+
+
+def clear_cache(context: str | None = None) -> None:
+    """Forgets the cached environment of a SETSHELL context.
+
+    Parameters:
+
+        context: The context to forget.  If not given, forgets the contexts
+            cached in memory by this process.
+    """
+    contexts = [context] if context is not None else list(_environ_cache)
+    for k in contexts:
+        _environ_cache.pop(k, None)
+        if os.path.exists(_cache_path(k)):
+            os.unlink(_cache_path(k))
+
+
+def environ(
+    context: str, refresh: bool = False, ttl: float = CACHE_TTL
+) -> dict[str, str]:
+    """Retrieves the environment for a particular SETSHELL context.
+
+    Discovering the environment of a context requires running ``dosetshell``
+    and a shell.  The changes it introduces are therefore cached, both in
+    memory and on disk (under ``$XDG_CACHE_HOME/gridtk``).  The on-disk cache
+    is invalidated after ``ttl`` seconds, or when any of the SETSHELL files
+    change.
+
+
+    Parameters:
+
+        context: The SETSHELL context, e.g. ``grid``
+
+        refresh: If set, ignores any cached environment and probes it again
+
+        ttl: The time, in seconds, for which the on-disk cache is valid
+
+
+    Returns:
+
+        The full environment, i.e. the current environment updated with the
+        variables set by the SETSHELL context.
+    """
+    if refresh:
+        _environ_cache.pop(context, None)
+
+    changes = _environ_cache.get(context)
+    if changes is None and not refresh:
+        changes = _load_cache(context, ttl)
+
+    if changes is None:
+        original = dict(os.environ)
+        new_environ = _discover(context)
+        changes = {k: v for k, v in new_environ.items() if original.get(k) != v}
+        if "BASEDIRSETSHELL" in new_environ:
+            _save_cache(context, changes)
+
+    _environ_cache[context] = changes
+    return {**os.environ, **changes}
+
+
+def _discover(context: str) -> dict[str, str]:
+    """Probes the environment for a particular SETSHELL context."""
     if "BASEDIRSETSHELL" not in os.environ:
         # It seems that we are in a hostile environment
         # try to source the Idiap-wide shell
-        idiap_source = "/idiap/resource/software/initfiles/shrc"
+        idiap_source = IDIAP_SOURCE
         if os.path.exists(idiap_source):
             logger.debug("Sourcing: '%s'" % idiap_source)
             try:
@@ -7,21 +7,57 @@
 from __future__ import annotations
 
 import logging
-import os
 import re
-import sys
+import shlex
 
-from .manager import JobManager
-from .models import Job, add_job
+from .backend import GPU_QUEUES, QUEUE_TIME_LIMITS, GridJobManager
 from .setshell import environ
-from .tools import make_shell, qdel, qstat, qsub
+from .tools import make_shell, qacct_all, qdel, qstat_all, qsub
 
 logger = logging.getLogger(__name__)
 
-
-class JobManagerSGE(JobManager):
+# The GPU queues whose GPUs have a limited memory, and this limit in GB
+LIMITED_GPU_QUEUES = ("gpu", "lgpu", "sgpu", "vsgpu")
+GPU_MEMORY_LIMIT = 24
+
+
+def _extra_args_queue(sge_extra_args):
+    """Returns the queue requested by the extra arguments to qsub, either with
+    ``-q`` or with ``-l`` and the name of a known queue; ``None`` if none."""
+    args = shlex.split(sge_extra_args or "")
+    for option, value in zip(args, args[1:]):
+        if option == "-q":
+            return value.split(",")[0].split("@")[0]
+        if option == "-l":
+            for resource in value.split(","):
+                name = resource.split("=")[0]
+                if name in QUEUE_TIME_LIMITS or name in GPU_QUEUES:
+                    return name
+    return None
+
+
+def _extra_args_run_time(sge_extra_args):
+    """Returns the run time, in seconds, requested by the extra arguments to
+    qsub with ``-l h_rt=[[hh:]mm:]ss``; ``None`` if none."""
+    args = shlex.split(sge_extra_args or "")
+    for option, value in zip(args, args[1:]):
+        if option != "-l":
+            continue
+        for resource in value.split(","):
+            name, _, limit = resource.partition("=")
+            if name == "h_rt" and limit:
+                seconds = 0.0
+                for part in limit.split(":"):
+                    seconds = seconds * 60 + float(part or 0)
+                return seconds
+    return None
+
+
+class JobManagerSGE(GridJobManager):
     """The JobManager will submit and control the status of submitted jobs."""
 
+    scheduler = "SGE grid"
+
     def __init__(self, context="grid", **kwargs):
         """Initializes this object with a state file and a method for
         qsub'bing.
@@ -41,76 +77,53 @@ class JobManagerSGE(JobManager):
         happens to be default)
         """
         self.context = environ(context)
-        JobManager.__init__(self, **kwargs)
+        GridJobManager.__init__(self, **kwargs)
 
-    def _queue(self, kwargs):
-        """The hard resource_list comes like this: '<qname>=TRUE,mem=128M'.
+    def _grid_submit(self, **kwargs):
+        return qsub(**kwargs)
 
-        To process it we have to split it twice (',' and then on '='),
-        create a dictionary and extract just the qname
-        """
-        if "hard resource_list" not in kwargs:
-            return "all.q"
-        d = dict(
-            [k.split("=") for k in kwargs["hard resource_list"].split(",")]
-        )
-        for k in d:
-            if k[0] == "q" and d[k] == "TRUE":
-                return k
-        return "all.q"
+    def _grid_status(self):
+        """Returns a snapshot of all our jobs currently known to the grid."""
+        return qstat_all(context=self.context)
 
-    def _submit_to_grid(
-        self, job, name, array, dependencies, log_dir, verbosity, **kwargs
-    ):
-        # ... what we will actually submit to the grid is a wrapper script that will call the desired command...
-        # get the name of the file that was called originally
-        jman = self.wrapper_script
-        python = sys.executable
+    def _grid_delete(self, ids):
+        return qdel(ids, context=self.context)
 
-        # get the grid id's for the dependencies and remove duplicates
-        dependent_jobs = self.get_jobs(dependencies)
-        deps = sorted(list({j.id for j in dependent_jobs}))
-
-        # make sure log directory is created and is a directory
-        os.makedirs(job.log_dir, exist_ok=True)
-        assert os.path.isdir(
-            job.log_dir
-        ), "Please make sure --log-dir `{}' either does not exist or is a directory.".format(
-            job.log_dir
-        )
-
-        # generate call to the wrapper script
-        command = make_shell(
-            python,
-            [jman, "-%sd" % ("v" * verbosity), self._database, "run-job"],
-        )
-        q_array = "%d-%d:%d" % array if array else None
-        grid_id = qsub(
-            command,
-            context=self.context,
-            name=name,
-            deps=deps,
-            array=q_array,
-            stdout=log_dir,
-            stderr=log_dir,
-            **kwargs,
+    def _grid_resources(self, ids, accounting_file=None):
+        return qacct_all(
+            ids, accounting_file=accounting_file, context=self.context
         )
 
-        # get the result of qstat
-        status = qstat(grid_id, context=self.context)
+    def _wrap_command(self, python, command):
+        return make_shell(python, command)
 
-        # set the grid id of the job
-        job.queue(
-            new_job_id=int(status["job_number"]),
-            new_job_name=status["job_name"],
-            queue_name=self._queue(status),
-        )
-
-        logger.info(
-            "Submitted job '%s' with dependencies '%s' to the SGE grid."
-            % (job, str(deps))
+    def _queue(self, kwargs):
+        queue = GridJobManager._queue(self, kwargs)
+        if queue == "all.q":
+            # the queue might be requested by the extra arguments to qsub
+            queue = _extra_args_queue(kwargs.get("sge_extra_args")) or queue
+        return queue
+
+    def _run_time_limit(self, job):
+        run_time = _extra_args_run_time(
+            job.get_arguments().get("sge_extra_args")
         )
+        if run_time is not None:
+            return run_time
+        return GridJobManager._run_time_limit(self, job)
+
+    def _auto_queue(self, command_line, name, kwargs):
+        queue = _extra_args_queue(kwargs.get("sge_extra_args"))
+        if queue is not None:
+            # the queue requested by the extra arguments to qsub is kept
+            logger.warn(
+                "Not choosing the queue of job '%s' automatically, since the extra arguments to qsub request the queue '%s'."
+                % (name, queue)
+            )
+            return None
+        return GridJobManager._auto_queue(self, command_line, name, kwargs)
 
+    def _check_submission(self, kwargs):
         if (
             "io_big" in kwargs
             and kwargs["io_big"]
@@ -133,199 +146,22 @@ class JobManagerSGE(JobManager):
         if (
             "gpumem" in kwargs
             and "queue" in kwargs
-            and kwargs["queue"] in ("gpu", "lgpu", "sgpu", "vsgpu")
-            and int(re.sub("\\D", "", kwargs["gpumem"])) > 24
+            and kwargs["queue"] in LIMITED_GPU_QUEUES
+            and int(re.sub("\\D", "", kwargs["gpumem"])) > GPU_MEMORY_LIMIT
         ):
             logger.warn(
-                "This job will never be executed since the GPU queue '%s' cannot have more than 24GB of memory."
-                % kwargs["queue"]
-            )
-
-        assert job.id == grid_id
-        return job.unique
-
-    def submit(
-        self,
-        command_line,
-        name=None,
-        array=None,
-        dependencies=[],
-        exec_dir=None,
-        log_dir="logs",
-        dry_run=False,
-        verbosity=0,
-        stop_on_failure=False,
-        **kwargs,
-    ):
-        """Submits a job that will be executed in the grid."""
-        # add job to database
-        self.lock()
-        job = add_job(
-            self.session,
-            command_line,
-            name,
-            dependencies,
-            array,
-            exec_dir=exec_dir,
-            log_dir=log_dir,
-            stop_on_failure=stop_on_failure,
-            context=self.context,
-            **kwargs,
-        )
-        logger.info("Added job '%s' to the database." % job)
-        if dry_run:
-            print("Would have added the Job")
-            print(job)
-            print(
-                "to the database to be executed in the grid with options:",
-                str(kwargs),
-            )
-            self.session.delete(job)
-            logger.info(
-                "Deleted job '%s' from the database due to dry-run option" % job
-            )
-            job_id = None
-
-        else:
-            job_id = self._submit_to_grid(
-                job, name, array, dependencies, log_dir, verbosity, **kwargs
+                "This job will never be executed since the GPU queue '%s' cannot have more than %dGB of memory."
+                % (kwargs["queue"], GPU_MEMORY_LIMIT)
             )
 
-        self.session.commit()
-        self.unlock()
-
-        return job_id
-
-    def communicate(self, job_ids=None):
-        """Communicates with the SGE grid (using qstat) to see if jobs are
-        still running."""
-        self.lock()
-        # iterate over all jobs
-        jobs = self.get_jobs(job_ids)
-        for job in jobs:
-            job.refresh()
-            if (
-                job.status in ("queued", "executing", "waiting")
-                and job.queue_name != "local"
-            ):
-                status = qstat(job.id, context=self.context)
-                if len(status) == 0:
-                    job.status = "failure"
-                    job.result = 70  # ASCII: 'F'
-                    logger.warn(
-                        "The job '%s' was not executed successfully (maybe a time-out happened). Please check the log files."
-                        % job
-                    )
-                    for array_job in job.array:
-                        if array_job.status in ("queued", "executing"):
-                            array_job.status = "failure"
-                            array_job.result = 70  # ASCII: 'F'
-
-        self.session.commit()
-        self.unlock()
-
-    def resubmit(
-        self,
-        job_ids=None,
-        also_success=False,
-        running_jobs=False,
-        new_command=None,
-        verbosity=0,
-        keep_logs=False,
-        **kwargs,
-    ):
-        """Re-submit jobs automatically."""
-        self.lock()
-        # iterate over all jobs
-        jobs = self.get_jobs(job_ids)
-        if new_command is not None:
-            if len(jobs) == 1:
-                jobs[0].set_command_line(new_command)
-            else:
-                logger.warn(
-                    "Ignoring new command since no single job id was specified"
-                )
-        accepted_old_status = (
-            ("submitted", "success", "failure")
-            if also_success
-            else (
-                "submitted",
-                "failure",
-            )
-        )
-        for job in jobs:
-            # check if this job needs re-submission
-            if running_jobs or job.status in accepted_old_status:
-                grid_status = qstat(job.id, context=self.context)
-                if len(grid_status) != 0:
-                    logger.warn(
-                        "Deleting job '%d' since it was still running in the grid."
-                        % job.unique
-                    )
-                    qdel(job.id, context=self.context)
-                # re-submit job to the grid
-                arguments = job.get_arguments()
-                arguments.update(**kwargs)
-                if "queue" not in arguments or arguments["queue"] == "all.q":
-                    for arg in ("hvmem", "pe_opt", "io_big"):
-                        if arg in arguments:
-                            del arguments[arg]
-                job.set_arguments(kwargs=arguments)
-                # delete old status and result of the job
-                if not keep_logs:
-                    self.delete_logs(job)
-                job.submit()
-                if job.queue_name == "local" and "queue" not in arguments:
-                    logger.warn(
-                        "Re-submitting job '%s' locally (since no queue name is specified)."
-                        % job
-                    )
-                else:
-                    deps = [dep.unique for dep in job.get_jobs_we_wait_for()]
-                    logger.debug(
-                        "Re-submitting job '%s' with dependencies '%s' to the grid."
-                        % (job, deps)
-                    )
-                    self._submit_to_grid(
-                        job,
-                        job.name,
-                        job.get_array(),
-                        deps,
-                        job.log_dir,
-                        verbosity,
-                        **arguments,
-                    )
-
-                # commit after each job to avoid failures of not finding the job during execution in the grid
-                self.session.commit()
-        self.unlock()
-
-    def run_job(self, job_id, array_id=None):
-        """Overwrites the run-job command from the manager to extract the
-        correct job id before calling base class implementation."""
-        # get the unique job id from the given grid id
-        self.lock()
-        jobs = list(self.session.query(Job).filter(Job.id == job_id))
-        if len(jobs) != 1:
-            self.unlock()
-            raise ValueError(
-                "Could not find job id '%d' in the database'" % job_id
-            )
-        job_id = jobs[0].unique
-        self.unlock()
-        # call base class implementation with the corrected job id
-        return JobManager.run_job(self, job_id, array_id)
-
-    def stop_jobs(self, job_ids):
-        """Stops the jobs in the grid."""
-        self.lock()
-
-        jobs = self.get_jobs(job_ids)
-        for job in jobs:
-            if job.status in ("executing", "queued", "waiting"):
-                qdel(job.id, context=self.context)
-                logger.info("Stopped job '%s' in the SGE grid." % job)
-            job.submit()
-
-            self.session.commit()
-        self.unlock()
+    def _memory_limit(self, kwargs):
+        if self._queue(kwargs) in LIMITED_GPU_QUEUES:
+            return GPU_MEMORY_LIMIT
+        return None
+
+    def _resubmission_arguments(self, arguments):
+        if "queue" not in arguments or arguments["queue"] == "all.q":
+            for arg in ("hvmem", "pe_opt", "io_big"):
+                if arg in arguments:
+                    del arguments[arg]
+        return arguments
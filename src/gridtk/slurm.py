@@ -0,0 +1,227 @@
+# Copyright © 2022 Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Defines the job manager which submits jobs to a Slurm cluster."""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+
+from .backend import GPU_QUEUES
+from .backend import QUEUE_TIME_LIMITS as _QUEUE_SECONDS
+from .backend import GridJobManager
+from .setshell import environ
+from .tools import (
+    sacct,
+    sacct_resources,
+    sbatch,
+    scancel,
+    squeue_all,
+    user_defaults,
+)
+
+logger = logging.getLogger(__name__)
+
+# Time limits of the SGE queues known to jman, in Slurm notation
+QUEUE_TIME_LIMITS = {
+    queue: "%d-%02d:%02d:%02d"
+    % (seconds // 86400, seconds // 3600 % 24, seconds // 60 % 60, seconds % 60)
+    for queue, seconds in _QUEUE_SECONDS.items()
+}
+
+# Host names that can be passed on to sbatch --nodelist
+NODE_LIST = re.compile("^[\\w.,\\[\\]-]+$")
+
+
+def sge_environment(slurm_environ=os.environ) -> dict[str, str]:
+    """Returns the SGE variables that correspond to the Slurm variables of a
+    running job.
+
+    This allows ``jman run-job``, and scripts relying on ``SGE_TASK_ID`` (e.g.
+    through :py:func:`gridtk.tools.get_array_job_slice`), to run unchanged on
+    a Slurm cluster.
+
+
+    Parameters:
+
+        slurm_environ: The environment of the job, as set by Slurm
+
+
+    Returns:
+
+        A dictionary with ``JOB_ID``, ``JOB_NAME``, ``NSLOTS`` and the
+        ``SGE_TASK_*`` variables, which is empty if not run by Slurm.
+    """
+    if "SLURM_JOB_ID" not in slurm_environ:
+        return {}
+
+    retval = {
+        "JOB_ID": slurm_environ.get(
+            "SLURM_ARRAY_JOB_ID", slurm_environ["SLURM_JOB_ID"]
+        ),
+        "JOB_NAME": slurm_environ.get("SLURM_JOB_NAME", ""),
+        "NSLOTS": slurm_environ.get("SLURM_CPUS_PER_TASK", "1"),
+        "SGE_TASK_ID": "undefined",
+    }
+    if "SLURM_ARRAY_TASK_ID" in slurm_environ:
+        retval["SGE_TASK_ID"] = slurm_environ["SLURM_ARRAY_TASK_ID"]
+        retval["SGE_TASK_FIRST"] = slurm_environ.get(
+            "SLURM_ARRAY_TASK_MIN", "1"
+        )
+        retval["SGE_TASK_LAST"] = slurm_environ.get(
+            "SLURM_ARRAY_TASK_MAX", retval["SGE_TASK_ID"]
+        )
+        retval["SGE_TASK_STEPSIZE"] = slurm_environ.get(
+            "SLURM_ARRAY_TASK_STEP", "1"
+        )
+    return retval
+
+
+class JobManagerSlurm(GridJobManager):
+    """The JobManager that submits jobs to a Slurm cluster, and controls their
+    status."""
+
+    scheduler = "Slurm cluster"
+
+    def __init__(self, context=None, **kwargs):
+        """Initializes this object with a state file.
+
+        Keyword parameters:
+
+        database
+        The file containing a valid status database for the manager. If
+        the file does not exist it is initialized. If it exists, it is
+        loaded.
+
+        context
+        The SETSHELL context to provide when setting up the environment to
+        call the Slurm utilities such as sbatch, squeue and scancel.  By
+        default, the current environment is used.
+        """
+        self.context = environ(context) if context else dict(os.environ)
+        GridJobManager.__init__(self, **kwargs)
+
+    def _prepare_submission(
+        self, job, name, array, dependencies, log_dir, verbosity, kwargs
+    ):
+        submit_kwargs = GridJobManager._prepare_submission(
+            self, job, name, array, dependencies, log_dir, verbosity, kwargs
+        )
+        # Slurm names the log files after the job, which would otherwise be
+        # named after the (non-existent) batch script
+        if not submit_kwargs["name"]:
+            submit_kwargs["name"] = os.path.basename(self.wrapper_script)
+        return submit_kwargs
+
+    def _sbatch_arguments(self, kwargs):
+        """Translates the (SGE-style) submission keyword arguments of jman into
+        arguments of :py:func:`gridtk.tools.sbatch`."""
+        kwargs = dict(kwargs)
+        retval = {
+            k: kwargs.pop(k)
+            for k in (
+                "command",
+                "context",
+                "name",
+                "deps",
+                "array",
+                "stdout",
+                "stderr",
+                "env",
+                "cwd",
+            )
+            if k in kwargs
+        }
+
+        queue = self._queue(kwargs)
+        kwargs.pop("queue", None)
+        partitions = user_defaults().get("slurm-partitions", {})
+        retval["partition"] = partitions.get(queue)
+        retval["time"] = QUEUE_TIME_LIMITS.get(queue)
+        if queue in GPU_QUEUES:
+            retval["gres"] = "gpu:1"
+
+        memfree = kwargs.pop("memfree", None)
+        hvmem = kwargs.pop("hvmem", None)
+        retval["memory"] = memfree or hvmem
+
+        pe_opt = kwargs.pop("pe_opt", None)
+        if pe_opt:
+            slots = pe_opt.split()[-1]
+            if slots.isdigit():
+                retval["cpus"] = int(slots)
+            else:
+                logger.warn(
+                    "Ignoring the parallel environment '%s', which cannot be translated to Slurm."
+                    % pe_opt
+                )
+
+        hostname = kwargs.pop("hostname", None)
+        if hostname:
+            if NODE_LIST.match(hostname):
+                retval["slurm_extra_args"] = "--nodelist=%s" % hostname
+            else:
+                logger.warn(
+                    "Ignoring the host name expression '%s', which cannot be translated to Slurm."
+                    % hostname
+                )
+
+        # options without a Slurm counterpart
+        kwargs.pop("gpumem", None)
+        kwargs.pop("io_big", None)
+        if kwargs.pop("sge_extra_args", None):
+            logger.warn(
+                "Ignoring the extra arguments to qsub when submitting to the %s."
+                % self.scheduler
+            )
+        for key in kwargs:
+            logger.warn(
+                "Ignoring the option '%s' when submitting to the %s."
+                % (key, self.scheduler)
+            )
+        return retval
+
+    def _task_id(self, job_id, task):
+        return "%d_%d" % (job_id, task)
+
+    def _grid_submit(self, **kwargs):
+        return sbatch(**self._sbatch_arguments(kwargs))
+
+    def _grid_status(self):
+        """Returns a snapshot of all our jobs currently known to the
+        cluster."""
+        return squeue_all(context=self.context)
+
+    def _grid_delete(self, ids):
+        return scancel(ids, context=self.context)
+
+    def _grid_accounting(self, ids):
+        """Returns the final states (e.g. ``TIMEOUT`` or ``OUT_OF_MEMORY``) of
+        the jobs with the given ids, as recorded by ``sacct``."""
+        try:
+            accounting = sacct(ids, context=self.context)
+        except (OSError, RuntimeError) as e:
+            # the accounting might not be enabled on this cluster
+            logger.debug("Could not query the Slurm accounting: %s", e)
+            return {}
+        retval = {}
+        for job_id, tasks in accounting.items():
+            states = {
+                t["state"] for t in tasks.values() if t["state"] != "COMPLETED"
+            }
+            if states:
+                retval[job_id] = ", ".join(sorted(states))
+        return retval
+
+    def _grid_resources(self, ids, accounting_file=None):
+        """Returns the resources used by the finished jobs with the given ids,
+        as recorded by ``sacct``."""
+        if accounting_file is not None:
+            raise ValueError(
+                "The %s has no accounting file; its accounting is queried "
+                "with sacct" % self.scheduler
+            )
+        return sacct_resources(ids, context=self.context)
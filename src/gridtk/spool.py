@@ -0,0 +1,127 @@
+# Copyright © 2022 Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Stores the status changes of running jobs in a spool directory next to the
+database, from which they are merged into the database in batches (see
+:py:meth:`gridtk.manager.JobManager.merge_spool`).
+
+Each status change is written to its own small file, which is first written
+into the ``tmp`` sub-directory and then atomically renamed into the ``new``
+sub-directory, so that a consumer never reads incomplete records.
+
+Running jobs only write their status changes into the spool directory if the
+database was set up to do so (see :py:func:`enable`).  Otherwise, the spool
+directory only holds the results that could not be written into the database,
+until they are merged.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import socket
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+def directory(database: str) -> str:
+    """Returns the spool directory of the given database."""
+    return database + ".spool"
+
+
+def enable(spool: str):
+    """Makes running jobs write their status changes into the spool
+    directory, instead of into the database."""
+    os.makedirs(spool, exist_ok=True)
+    with open(os.path.join(spool, "enabled"), "w"):
+        pass
+
+
+def enabled(spool: str) -> bool:
+    """Tells if running jobs write their status changes into the spool
+    directory (see :py:func:`enable`)."""
+    return os.path.exists(os.path.join(spool, "enabled"))
+
+
+def write(spool: str, record: dict) -> str:
+    """Writes a record to the spool directory.
+
+    Parameters:
+
+        spool: The spool directory, which is created if needed
+
+        record: The record to write, which needs to be JSON-serializable
+
+
+    Returns:
+
+        The name of the new record file
+    """
+    name = "%d.%s.%d.json" % (time.time_ns(), socket.gethostname(), os.getpid())
+    temp = os.path.join(spool, "tmp", name)
+    final = os.path.join(spool, "new", name)
+    os.makedirs(os.path.dirname(temp), exist_ok=True)
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    with open(temp, "w") as f:
+        json.dump(record, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temp, final)
+    return final
+
+
+def read(spool: str) -> list[tuple[str, dict]]:
+    """Returns the records of the spool directory, in the order in which they
+    were written.
+
+    Returns:
+
+        A list of tuples ``(filename, record)``; files that cannot be read are
+        skipped (and kept)
+    """
+    new = os.path.join(spool, "new")
+    try:
+        names = sorted(
+            os.listdir(new), key=lambda name: int(name.split(".", 1)[0])
+        )
+    except FileNotFoundError:
+        return []
+
+    records = []
+    for name in names:
+        path = os.path.join(new, name)
+        try:
+            with open(path) as f:
+                records.append((path, json.load(f)))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping the spooled record '{path}': {e}")
+    return records
+
+
+@contextlib.contextmanager
+def consumer(spool: str) -> typing.Iterator[bool]:
+    """Makes sure that a single process merges the records of the spool
+    directory at a time.
+
+    Yields:
+
+        ``True`` if the caller is the only consumer, ``False`` if another
+        process is already merging the records
+    """
+    os.makedirs(spool, exist_ok=True)
+    with open(os.path.join(spool, "lock"), "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -7,16 +7,49 @@ probing."""
 
 from __future__ import annotations
 
+import contextlib
+import functools
+import io
+import itertools
 import logging
 import math
 import os
 import re
 import shlex
+import sys
+import typing
 
 logger = logging.getLogger(__name__)
 
 # Constant regular expressions
 QSTAT_FIELD_SEPARATOR = re.compile(":\\s+")
+QDEL_FAILURE = re.compile("denied|does not exist|error|fail", re.IGNORECASE)
+QDEL_TOKEN = re.compile("[\\w.:-]+")
+
+# Fields of the SGE accounting file that are used (see ``man 5 accounting``)
+ACCOUNTING_FIELDS = {
+    "hostname": 1,
+    "job_number": 5,
+    "ru_wallclock": 13,
+    "task_number": 35,
+    "cpu": 36,
+    "maxvmem": 42,
+}
+
+# Units of memory sizes reported by SGE
+MEMORY_UNITS = {
+    "B": 1,
+    "K": 1024,
+    "M": 1024**2,
+    "G": 1024**3,
+    "T": 1024**4,
+}
+
+# The header of the line index of a parameter file: a magic string, the size
+# and modification time (in ns) of the indexed file, and its number of lines
+# (as a format of :py:mod:`struct`)
+LINE_INDEX_MAGIC = b"GTKLINES"
+LINE_INDEX_HEADER = "<8sQQQ"
 
 # Name of the user configuration file at $XDG_CONFIG_HOME
 USER_CONFIGURATION = "gridtk.toml"
@@ -42,6 +75,15 @@ def str_(v: str | bytes) -> str:
     return v if not isinstance(v, bytes) else v.decode()
 
 
+@functools.lru_cache(maxsize=None)
+def user_defaults():
+    """Returns the user configuration (``gridtk.toml``), which is only read
+    once per process."""
+    from clapper.rc import UserDefaults
+
+    return UserDefaults(USER_CONFIGURATION)
+
+
 def qsub(
     command,
     queue=None,
@@ -153,11 +195,9 @@ def qsub(
 
     Returns the job id assigned to this job (integer)
     """
-    from clapper.rc import UserDefaults
-
     scmd = ["qsub"]
 
-    defaults = UserDefaults(USER_CONFIGURATION)
+    defaults = user_defaults()
 
     prepend = defaults.get("sge-extra-args-prepend", "")
     sge_extra_args = f"{prepend} {sge_extra_args or ''}"
@@ -224,27 +264,7 @@ def qsub(
         scmd += ["-v", k]
 
     if array is not None:
-        scmd.append("-t")
-        if isinstance(array, (str, bytes)):
-            try:
-                i = int(array)
-                scmd.append("1-%d:1" % i)
-            except ValueError:
-                # must be complete...
-                scmd.append("%s" % array)
-        if isinstance(array, int):
-            scmd.append("1-%d:1" % array)
-        if isinstance(array, (tuple, list)):
-            if len(array) < 1 or len(array) > 3:
-                raise RuntimeError(
-                    "Array tuple should have length between 1 and 3"
-                )
-            elif len(array) == 1:
-                scmd.append("%s" % array[0])
-            elif len(array) == 2:
-                scmd.append(f"{array[0]}-{array[1]}")
-            elif len(array) == 3:
-                scmd.append(f"{array[0]}-{array[1]}:{array[2]}")
+        scmd += ["-t", _array_range(array)]
 
     if not isinstance(command, (list, tuple)):
         command = [command]
@@ -258,6 +278,29 @@ def qsub(
     return int(jobid.split("\n")[-1].split(".", 1)[0])
 
 
+def _array_range(array):
+    """Returns the range ``m[-n[:s]]`` of tasks of an array job, given in any
+    of the forms accepted by :py:func:`qsub`."""
+    if isinstance(array, (str, bytes)):
+        try:
+            i = int(array)
+            return "1-%d:1" % i
+        except ValueError:
+            # must be complete...
+            return "%s" % str_(array)
+    if isinstance(array, int):
+        return "1-%d:1" % array
+    if isinstance(array, (tuple, list)):
+        if len(array) < 1 or len(array) > 3:
+            raise RuntimeError("Array tuple should have length between 1 and 3")
+        elif len(array) == 1:
+            return "%s" % array[0]
+        elif len(array) == 2:
+            return f"{array[0]}-{array[1]}"
+        return f"{array[0]}-{array[1]}:{array[2]}"
+    raise RuntimeError("Cannot interpret array specification %r" % (array,))
+
+
 def make_shell(shell, command):
     """Returns a single command given a shell and a command to be qsub'ed.
 
@@ -315,38 +358,780 @@ def qstat(jobid, context="grid"):
     return retval
 
 
-def qdel(jobid: int, context: str = "grid") -> None:
-    """Halts a given job.
+def _expand_task_ids(tasks: str) -> list[int]:
+    """Expands an SGE task specification such as ``1,4-10:2`` into ids."""
+    retval = []
+    for part in tasks.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, rest = part.partition("-")
+        if not rest:
+            retval.append(int(first))
+            continue
+        last, _, step = rest.partition(":")
+        retval.extend(range(int(first), int(last) + 1, int(step or 1)))
+    return retval
+
+
+def parse_qstat_xml(stream) -> dict[int, dict[int | None, dict[str, str]]]:
+    """Parses the output of ``qstat -xml`` incrementally.
+
+    Parameters:
+
+        stream: A binary file-like object with the XML output of ``qstat``
+
+
+    Returns:
+
+        A dictionary mapping each grid job id to another dictionary, which maps
+        task ids (or ``None``, for non-array jobs) to the properties reported
+        by ``qstat`` for that task (e.g. ``state``, ``JB_name`` or
+        ``queue_name``).
+    """
+    from xml.etree.ElementTree import iterparse
+
+    retval: dict[int, dict[int | None, dict[str, str]]] = {}
+    for _, element in iterparse(stream):
+        if element.tag != "job_list":
+            continue
+        properties = {
+            child.tag: (child.text or "").strip() for child in element
+        }
+        properties["state"] = properties.get("state", element.get("state", ""))
+        job_id = int(properties["JB_job_number"])
+        tasks = properties.get("tasks")
+        task_ids = _expand_task_ids(tasks) if tasks else [None]
+        job = retval.setdefault(job_id, {})
+        for task_id in task_ids:
+            job[task_id] = properties
+        # we do not need the parsed element anymore
+        element.clear()
+
+    return retval
+
+
+def qstat_all(
+    user: str | None = None, context: str = "grid"
+) -> dict[int, dict[int | None, dict[str, str]]]:
+    """Queries the status of all jobs of a user with a single call to qstat.
+
+    Parameters:
+
+        user: The user whose jobs should be listed.  If not given, uses the
+            current user (``$USER``).
+
+        context: The setshell context in which we should try a 'qstat'.
+            Normally you do not need to change the default. This variable can
+            also be set to a context dictionary in which case we just setup
+            using that context instead of probing for a new one, what can be
+            fast.
+
+
+    Returns:
+
+        A snapshot of the grid, as returned by :py:func:`parse_qstat_xml`.
+        Jobs that are not known to the grid any longer are not part of it.
+    """
+    if user is None:
+        user = os.environ.get("USER", "*")
+
+    scmd = ["qstat", "-u", user, "-xml", "-g", "d"]
+
+    logger.debug("Qstat command '%s'", " ".join(scmd))
+
+    from .setshell import sexec
+
+    data = sexec(context, scmd)
+
+    return parse_qstat_xml(io.BytesIO(data))
+
+
+def _parse_memory(value: str) -> int:
+    """Parses a memory size as reported by SGE (e.g. ``1.5G``) into bytes."""
+    value = value.strip()
+    factor = MEMORY_UNITS.get(value[-1:].upper())
+    if factor is not None:
+        value = value[:-1]
+    return int(float(value) * (factor or 1))
+
+
+def _resources(wall_time, cpu_time, max_memory, hostname):
+    """Returns the resources of a job, as stored by gridtk."""
+    return {
+        "wall_time": float(wall_time),
+        "cpu_time": float(cpu_time),
+        "max_memory": _parse_memory(max_memory),
+        "hostname": hostname.split(".", 1)[0],
+    }
+
+
+def parse_accounting(
+    stream: typing.Iterable[str], job_ids: typing.Container[int] | None = None
+) -> dict[int, dict[int | None, dict[str, typing.Any]]]:
+    """Parses the accounting file of SGE, line by line.
+
+    The accounting file (see ``man 5 accounting``) contains one line per
+    finished job (or task of an array job), with colon-separated fields.  It
+    can be very large, so it is streamed, and only the entries of the given
+    jobs are kept.
+
+
+    Parameters:
+
+        stream: A (text) file-like object with the contents of the accounting
+            file, or any other iterable over its lines
+
+        job_ids: The ids of the jobs to collect.  If not given, all jobs are
+            collected.
+
+
+    Returns:
+
+        A dictionary mapping each job id to another dictionary, which maps
+        task ids (or ``None``, for non-array jobs) to the ``wall_time`` and
+        ``cpu_time`` (in seconds), the ``max_memory`` (in bytes) and the
+        ``hostname`` of that task.  If a job id was re-used by the grid, the
+        latest entry is kept.
+    """
+    retval: dict[int, dict[int | None, dict[str, typing.Any]]] = {}
+    for line in stream:
+        if line.startswith("#"):
+            continue
+        fields = line.rstrip("\n").split(":")
+        if len(fields) <= ACCOUNTING_FIELDS["maxvmem"]:
+            continue
+        try:
+            job_id = int(fields[ACCOUNTING_FIELDS["job_number"]])
+        except ValueError:
+            continue
+        if job_ids is not None and job_id not in job_ids:
+            continue
+        task_id = int(fields[ACCOUNTING_FIELDS["task_number"]]) or None
+        retval.setdefault(job_id, {})[task_id] = _resources(
+            fields[ACCOUNTING_FIELDS["ru_wallclock"]],
+            fields[ACCOUNTING_FIELDS["cpu"]],
+            fields[ACCOUNTING_FIELDS["maxvmem"]],
+            fields[ACCOUNTING_FIELDS["hostname"]],
+        )
+    return retval
+
+
+def parse_qacct(
+    stream: typing.Iterable[str], job_ids: typing.Container[int] | None = None
+) -> dict[int, dict[int | None, dict[str, typing.Any]]]:
+    """Parses the output of ``qacct -j``, line by line.
+
+    Parameters:
+
+        stream: A (text) file-like object with the output of ``qacct``, or
+            any other iterable over its lines
+
+        job_ids: The ids of the jobs to collect.  If not given, all jobs are
+            collected.
+
+
+    Returns:
+
+        The resources of the jobs, in the format of
+        :py:func:`parse_accounting`.
+    """
+    retval: dict[int, dict[int | None, dict[str, typing.Any]]] = {}
+
+    def _store(record):
+        if "jobnumber" not in record:
+            return
+        job_id = int(record["jobnumber"])
+        if job_ids is not None and job_id not in job_ids:
+            return
+        task = record.get("taskid", "undefined")
+        task_id = int(task) if task.isdigit() and int(task) else None
+        retval.setdefault(job_id, {})[task_id] = _resources(
+            record.get("ru_wallclock", "0").rstrip("s"),
+            record.get("cpu", "0").rstrip("s"),
+            record.get("maxvmem", "0"),
+            record.get("hostname", ""),
+        )
+
+    record: dict[str, str] = {}
+    for line in stream:
+        if line.startswith("====="):
+            _store(record)
+            record = {}
+            continue
+        key, _, value = line.strip().partition(" ")
+        if key:
+            record[key] = value.strip()
+    _store(record)
+
+    return retval
+
+
+def qacct_all(
+    job_ids: typing.Collection[int],
+    user: str | None = None,
+    accounting_file: str | None = None,
+    context: str | dict[str, str] = "grid",
+) -> dict[int, dict[int | None, dict[str, typing.Any]]]:
+    """Queries the resources used by the given finished jobs, in a single
+    pass over the SGE accounting.
+
+    If readable, the accounting file of the grid is parsed directly (see
+    :py:func:`parse_accounting`).  Otherwise, ``qacct`` is called once for
+    all jobs of the user.
+
+
+    Parameters:
+
+        job_ids: The ids of the jobs to query
+
+        user: The user whose jobs should be listed by ``qacct``.  If not given,
+            uses the current user (``$USER``).
+
+        accounting_file: The accounting file to parse.  If not given, uses
+            ``$SGE_ROOT/$SGE_CELL/common/accounting``, if it exists.
+
+        context: The setshell context in which we should try a 'qacct'.
+            Normally you do not need to change the default. This variable can
+            also be set to a context dictionary in which case we just setup
+            using that context instead of probing for a new one, what can be
+            fast.
+
+
+    Returns:
+
+        The resources of the jobs, in the format of
+        :py:func:`parse_accounting`.  Jobs that are not part of the accounting
+        (yet) are missing.
+    """
+    from .setshell import environ, sexec
+
+    job_ids = set(job_ids)
+    E = environ(context) if isinstance(context, (str, bytes)) else context
+    if accounting_file is None and "SGE_ROOT" in E:
+        accounting_file = os.path.join(
+            E["SGE_ROOT"], E.get("SGE_CELL", "default"), "common", "accounting"
+        )
+
+    if accounting_file is not None and os.access(accounting_file, os.R_OK):
+        logger.debug("Parsing accounting file '%s'", accounting_file)
+        with open(accounting_file, errors="replace") as f:
+            return parse_accounting(f, job_ids)
+
+    if user is None:
+        user = os.environ.get("USER", "*")
+
+    scmd = ["qacct", "-o", user, "-j"]
+
+    logger.debug("Qacct command '%s'", " ".join(scmd))
+
+    data = str_(sexec(E, scmd, error_on_nonzero=False))
+    return parse_qacct(data.split("\n"), job_ids)
+
+
+def _command_line_limit() -> int:
+    """Returns the maximum length of the arguments of a new process, taking
+    into account the space used by the current environment."""
+    try:
+        limit = os.sysconf("SC_ARG_MAX")
+    except (ValueError, OSError):
+        limit = 131072
+    environment = sum(len(k) + len(v) + 2 for k, v in os.environ.items())
+    # leave some room for the environment of setshell contexts
+    return max(4096, min(limit - environment, limit // 2) - 4096)
+
+
+def _split_job_ids(
+    jobids: int | str | typing.Iterable[int | str], command: str
+) -> list[list[int | str]]:
+    """Splits the given job ids in chunks that fit on the command line."""
+    if isinstance(jobids, (int, str)):
+        jobids = [jobids]
+
+    limit = _command_line_limit()
+    chunks: list[list[int | str]] = []
+    length = limit
+    for jobid in jobids:
+        if length + len(str(jobid)) + 1 > limit:
+            chunks.append([])
+            length = len(command)
+        chunks[-1].append(jobid)
+        length += len(str(jobid)) + 1
+    return chunks
+
+
+def qdel(
+    jobids: int | str | typing.Iterable[int | str], context: str = "grid"
+) -> dict[int | str, str]:
+    """Halts the given jobs.
+
+    As many jobs as the command-line length limit allows are halted with a
+    single call to ``qdel``.
+
 
     Parameters:
 
-        jobid: The job identifier as returned by :py:func:`qsub`
+        jobids: The job identifier(s) as returned by :py:func:`qsub`.  Single
+            tasks of array jobs may be given as ``<jobid>.<task>``.
 
         context: The setshell context in which we should try a 'qsub'. Normally
             you do not need to change the default. This variable can also be
             set to a context dictionary in which case we just setup using that
             context instead of probing for a new one, what can be fast.
+
+
+    Returns:
+
+        A dictionary mapping the identifiers of the jobs that could not be
+        halted to the message reported by ``qdel``.
+    """
+    from .setshell import sexec
+
+    failures = {}
+    for chunk in _split_job_ids(jobids, "qdel"):
+        scmd = ["qdel"] + [f"{k}" for k in chunk]
+
+        logger.debug(f"qdel command for {len(chunk)} jobs")
+
+        output = str_(sexec(context, scmd, error_on_nonzero=False))
+
+        failures.update(_halt_failures(output, chunk))
+
+    return failures
+
+
+def _halt_failures(
+    output: str, jobids: list[int | str]
+) -> dict[int | str, str]:
+    """Returns the messages of the given jobs that could not be halted, as
+    reported on separate lines by ``qdel`` or ``scancel``."""
+    failures = {}
+    wanted = {str(k): k for k in jobids}
+    for line in output.split("\n"):
+        if not QDEL_FAILURE.search(line):
+            continue
+        for token in QDEL_TOKEN.findall(line):
+            jobid = wanted.get(token.rstrip(".:"))
+            if jobid is not None:
+                failures[jobid] = line.strip()
+                logger.warning(f"Could not halt job {jobid}: {line.strip()}")
+    return failures
+
+
+def sbatch(
+    command: list[str],
+    name: str | None = None,
+    deps: list[int] = [],
+    stdout: str = "",
+    stderr: str = "",
+    env: list[str] = [],
+    array=None,
+    partition: str | None = None,
+    time: str | None = None,
+    memory: str | None = None,
+    cpus: int | None = None,
+    gres: str | None = None,
+    cwd: bool = True,
+    context: str | dict[str, str] | None = None,
+    slurm_extra_args: str = "",
+) -> int:
+    """Submits a job to a Slurm cluster.
+
+    The command is run through ``sbatch --wrap``, so that no batch script
+    needs to be written.
+
+
+    Parameters:
+
+        command: The command (and its arguments) to be submitted
+
+        name: An optional name to set for the job
+
+        deps: Job ids which need to finish (successfully or not) before this
+            job can start
+
+        stdout: The directory to write the standard output to.  The log files
+            are named like the ones of SGE, i.e. ``<name>.o<id>`` and
+            ``<name>.o<id>.<task>`` for array jobs.
+
+        stderr: The directory to write the standard error to (if not given,
+            defaults to the stdout directory)
+
+        env: A list of extra variables (``KEY=VALUE``) to be set on the
+            environment running the command
+
+        array: The tasks of an array job, in any of the forms accepted by
+            :py:func:`qsub`.  The task id is set in ``SLURM_ARRAY_TASK_ID``.
+
+        partition: The partition to submit the job to
+
+        time: The time limit of the job (e.g. ``1-00:00:00`` for one day)
+
+        memory: The memory required by the job (e.g. ``8G``)
+
+        cpus: The number of CPUs required by the job
+
+        gres: Generic resources required by the job (e.g. ``gpu:1``)
+
+        cwd: If the job should run in the current working directory, rather
+            than in the home directory
+
+        context: The environment to run ``sbatch`` in (a setshell context or
+            a dictionary).  If not given, uses the current environment.
+
+        slurm_extra_args: Extra arguments directly passed on to ``sbatch``,
+            after the ones set in ``slurm-extra-args-prepend`` of the user
+            configuration
+
+
+    Returns:
+
+        The job id assigned to this job
+    """
+    scmd = ["sbatch", "--parsable"]
+
+    prepend = user_defaults().get("slurm-extra-args-prepend", "")
+    slurm_extra_args = f"{prepend} {slurm_extra_args or ''}"
+    scmd += shlex.split(slurm_extra_args)
+
+    if partition:
+        scmd += ["--partition", partition]
+    if time:
+        scmd += ["--time", time]
+    if memory:
+        scmd += ["--mem", memory]
+    if cpus:
+        scmd += ["--cpus-per-task", "%d" % cpus]
+    if gres:
+        scmd += ["--gres", gres]
+    if not cwd:
+        scmd += ["--chdir", os.environ["HOME"]]
+    if name:
+        scmd += ["--job-name", name]
+    if deps:
+        scmd += ["--dependency", "afterany:" + ":".join("%d" % k for k in deps)]
+
+    pattern = "%x.o%A.%a" if array is not None else "%x.o%j"
+    if stdout:
+        os.makedirs(stdout, exist_ok=True)
+        scmd += ["--output", os.path.join(stdout, pattern)]
+    stderr = stderr or stdout
+    if stderr:
+        os.makedirs(stderr, exist_ok=True)
+        scmd += ["--error", os.path.join(stderr, pattern.replace(".o", ".e"))]
+
+    if env:
+        scmd += ["--export", ",".join(["ALL"] + list(env))]
+
+    if array is not None:
+        scmd += ["--array", _array_range(array)]
+
+    if not isinstance(command, (list, tuple)):
+        command = [command]
+    scmd += ["--wrap", shlex.join(command)]
+
+    logger.debug("Sbatch command '%s'", " ".join(scmd))
+
+    from .setshell import sexec
+
+    jobid = str_(sexec(os.environ if context is None else context, scmd))
+    # the cluster name may follow the job id
+    return int(jobid.split("\n")[-1].split(";", 1)[0])
+
+
+def _expand_slurm_task_ids(tasks: str) -> list[int | None]:
+    """Expands the task ids reported by Slurm, e.g. ``5`` or ``[1-7:2%4]``,
+    which are ``N/A`` for non-array jobs."""
+    if tasks in ("", "N/A"):
+        return [None]
+    return _expand_task_ids(tasks.strip("[]").split("%", 1)[0])
+
+
+def squeue_all(
+    user: str | None = None, context: str | dict[str, str] | None = None
+) -> dict[int, dict[int | None, dict[str, str]]]:
+    """Queries the status of all jobs of a user with a single call to
+    squeue.
+
+    Parameters:
+
+        user: The user whose jobs should be listed.  If not given, uses the
+            current user (``$USER``).
+
+        context: The environment to run ``squeue`` in (a setshell context or
+            a dictionary).  If not given, uses the current environment.
+
+
+    Returns:
+
+        A dictionary mapping each job id to another dictionary, which maps
+        task ids (or ``None``, for non-array jobs) to the properties reported
+        by ``squeue`` for that task (``state``, ``partition``, ``nodes`` and
+        ``name``).  Jobs that are not known to the cluster any longer are not
+        part of it.
+    """
+    if user is None:
+        user = os.environ.get("USER", "")
+
+    scmd = ["squeue", "--noheader", "--array", "--format", "%F|%K|%T|%P|%N|%j"]
+    if user:
+        scmd += ["--user", user]
+
+    logger.debug("Squeue command '%s'", " ".join(scmd))
+
+    from .setshell import sexec
+
+    data = str_(sexec(os.environ if context is None else context, scmd))
+
+    retval: dict[int, dict[int | None, dict[str, str]]] = {}
+    for line in data.split("\n"):
+        fields = line.strip().split("|", 5)
+        if len(fields) != 6:
+            continue
+        job_id, tasks, state, partition, nodes, name = fields
+        properties = dict(
+            state=state, partition=partition, nodes=nodes, name=name
+        )
+        job = retval.setdefault(int(job_id), {})
+        for task_id in _expand_slurm_task_ids(tasks):
+            job[task_id] = properties
+
+    return retval
+
+
+def sacct(
+    jobids: typing.Iterable[int], context: str | dict[str, str] | None = None
+) -> dict[int, dict[int | None, dict[str, str]]]:
+    """Queries the accounting information of finished jobs from Slurm.
+
+    As many jobs as the command-line length limit allows are queried with a
+    single call to ``sacct``.
+
+
+    Parameters:
+
+        jobids: The job identifiers as returned by :py:func:`sbatch`
+
+        context: The environment to run ``sacct`` in (a setshell context or
+            a dictionary).  If not given, uses the current environment.
+
+
+    Returns:
+
+        A dictionary mapping each job id to another dictionary, which maps
+        task ids (or ``None``, for non-array jobs) to the ``state`` and the
+        ``exit_code`` recorded for that task.  Jobs unknown to the accounting
+        are not part of it.
+    """
+    from .setshell import sexec
+
+    retval: dict[int, dict[int | None, dict[str, str]]] = {}
+    for chunk in _split_job_ids(list(jobids), "sacct"):
+        scmd = [
+            "sacct",
+            "--noheader",
+            "--parsable2",
+            "--allocations",
+            "--format",
+            "JobID,State,ExitCode",
+            "--jobs",
+            ",".join(f"{k}" for k in chunk),
+        ]
+
+        logger.debug(f"sacct command for {len(chunk)} jobs")
+
+        data = str_(sexec(os.environ if context is None else context, scmd))
+        for line in data.split("\n"):
+            fields = line.strip().split("|")
+            if len(fields) != 3:
+                continue
+            job_id, _, tasks = fields[0].partition("_")
+            properties = dict(state=fields[1], exit_code=fields[2])
+            job = retval.setdefault(int(job_id), {})
+            for task_id in _expand_slurm_task_ids(tasks):
+                job[task_id] = properties
+
+    return retval
+
+
+def _parse_slurm_duration(value: str) -> float:
+    """Parses a duration as reported by Slurm, e.g. ``1-02:03:04`` or
+    ``03:04.500``, into seconds."""
+    days, _, clock = value.strip().rpartition("-")
+    seconds = 0.0
+    for part in clock.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds + int(days or 0) * 86400
+
+
+def parse_sacct_resources(
+    stream: typing.Iterable[str],
+) -> dict[int, dict[int | None, dict[str, typing.Any]]]:
+    """Parses the resources reported by ``sacct`` (see
+    :py:func:`sacct_resources`), line by line.
+
+    Slurm reports the wall-clock time, the CPU time and the execution host of
+    a job on the line of its allocation (e.g. ``123_4``), and the peak memory
+    on the lines of its steps (e.g. ``123_4.batch``), whose maximum is taken.
+
+
+    Returns:
+
+        A dictionary in the format of :py:func:`parse_accounting`
     """
-    scmd = ["qdel", f"{jobid}"]
+    retval: dict[int, dict[int | None, dict[str, typing.Any]]] = {}
+    for line in stream:
+        fields = line.strip().split("|")
+        if len(fields) != 5:
+            continue
+        job, _, step = fields[0].partition(".")
+        job_id, _, tasks = job.partition("_")
+        if not job_id.isdigit() or tasks.startswith("["):
+            # pending tasks have not used any resources, yet
+            continue
+        for task_id in _expand_slurm_task_ids(tasks):
+            resources = retval.setdefault(int(job_id), {}).setdefault(
+                task_id,
+                _resources(0, 0, "0", ""),
+            )
+            if fields[3]:
+                resources["max_memory"] = max(
+                    resources["max_memory"], _parse_memory(fields[3])
+                )
+            if not step:
+                resources["wall_time"] = _parse_slurm_duration(fields[1])
+                resources["cpu_time"] = _parse_slurm_duration(fields[2])
+                if fields[4] != "None assigned":
+                    resources["hostname"] = fields[4].split(".", 1)[0]
+    return retval
+
+
+def sacct_resources(
+    jobids: typing.Iterable[int], context: str | dict[str, str] | None = None
+) -> dict[int, dict[int | None, dict[str, typing.Any]]]:
+    """Queries the resources used by finished jobs from the Slurm accounting.
 
-    logger.debug(f"qdel command '{' '.join(scmd)}'")
+    As many jobs as the command-line length limit allows are queried with a
+    single call to ``sacct``.
+
+
+    Parameters:
+
+        jobids: The job identifiers as returned by :py:func:`sbatch`
+
+        context: The environment to run ``sacct`` in (a setshell context or
+            a dictionary).  If not given, uses the current environment.
+
+
+    Returns:
 
+        A dictionary in the format of :py:func:`parse_accounting`
+    """
     from .setshell import sexec
 
-    sexec(context, scmd, error_on_nonzero=False)
+    retval: dict[int, dict[int | None, dict[str, typing.Any]]] = {}
+    for chunk in _split_job_ids(list(jobids), "sacct"):
+        scmd = [
+            "sacct",
+            "--noheader",
+            "--parsable2",
+            "--format",
+            "JobID,Elapsed,TotalCPU,MaxRSS,NodeList",
+            "--jobs",
+            ",".join(f"{k}" for k in chunk),
+        ]
+
+        logger.debug(f"sacct command for the resources of {len(chunk)} jobs")
+
+        data = str_(sexec(os.environ if context is None else context, scmd))
+        retval.update(parse_sacct_resources(data.split("\n")))
+
+    return retval
+
+
+def scancel(
+    jobids: int | str | typing.Iterable[int | str],
+    context: str | dict[str, str] | None = None,
+) -> dict[int | str, str]:
+    """Cancels the given Slurm jobs.
+
+    As many jobs as the command-line length limit allows are cancelled with a
+    single call to ``scancel``.
+
+
+    Parameters:
+
+        jobids: The job identifier(s) as returned by :py:func:`sbatch`.
+            Single tasks of array jobs may be given as ``<jobid>_<task>``.
+
+        context: The environment to run ``scancel`` in (a setshell context or
+            a dictionary).  If not given, uses the current environment.
+
+
+    Returns:
+
+        A dictionary mapping the identifiers of the jobs that could not be
+        cancelled to the message reported by ``scancel``.
+    """
+    from .setshell import sexec
+
+    failures = {}
+    for chunk in _split_job_ids(jobids, "scancel"):
+        scmd = ["scancel"] + [f"{k}" for k in chunk]
+
+        logger.debug(f"scancel command for {len(chunk)} jobs")
+
+        output = str_(
+            sexec(
+                os.environ if context is None else context,
+                scmd,
+                error_on_nonzero=False,
+            )
+        )
+        failures.update(_halt_failures(output, chunk))
 
+    return failures
 
-def get_array_job_slice(total_length: int) -> slice:
+
+def _array_job_task() -> tuple[int, int] | None:
+    """Returns the position of the current task in its SGE array job, and the
+    number of tasks of the array job, or ``None`` outside of array jobs."""
+    try:
+        task_id = int(os.environ["SGE_TASK_ID"])
+        first = int(os.environ.get("SGE_TASK_FIRST", 1))
+        last = int(os.environ.get("SGE_TASK_LAST", task_id))
+        step = int(os.environ.get("SGE_TASK_STEPSIZE", 1))
+    except (KeyError, ValueError):
+        # SGE sets the variables to "undefined" for non-array jobs
+        return None
+
+    if step < 1 or not first <= task_id <= last or (task_id - first) % step:
+        raise ValueError(
+            "The task %d is not part of the array job %d-%d:%d"
+            % (task_id, first, last, step)
+        )
+    return (task_id - first) // step, (last - first) // step + 1
+
+
+def get_array_job_slice(
+    total_length: int, weights: typing.Sequence[float] | None = None
+) -> slice:
     """A helper function that let's you chunk a list in an SGE array job.
 
     Use this function like ``a = a[get_array_job_slice(len(a))]`` to only
-    process a chunk of ``a``.
+    process a chunk of ``a``.  The list is split into as many contiguous
+    chunks as the array job has tasks (for any first and last task and step
+    size), whose lengths differ by at most one.  If the items have different
+    costs, the chunks are balanced by the given ``weights`` instead.
 
 
     Parameters:
 
         total_length: The length of the list that you are trying to slice
 
+        weights: The cost of processing each item of the list, if not the same
+            for all items
+
 
     Returns:
 
@@ -355,35 +1140,447 @@ def get_array_job_slice(total_length: int) -> slice:
 
     Raises:
 
-        NotImplementedError: If "SGE_TASK_FIRST" and "SGE_TASK_STEPSIZE" are
-            not 1.
+        ValueError: If ``SGE_TASK_ID`` is not one of the tasks of the array
+            job, or if the weights do not match the length of the list
     """
-    sge_task_id = os.environ.get("SGE_TASK_ID")
-
-    if sge_task_id is None:
+    task = _array_job_task()
+    if task is None:
         return slice(None)
+    index, count = task
 
-    try:
-        sge_task_int = int(sge_task_id)
-    except Exception:
-        return slice(None)
+    if weights is None:
+        return slice(
+            index * total_length // count, (index + 1) * total_length // count
+        )
 
-    if (
-        os.environ["SGE_TASK_FIRST"] != "1"
-        or os.environ["SGE_TASK_STEPSIZE"] != "1"
-    ):
-        raise NotImplementedError(
-            "Values other than 1 for SGE_TASK_FIRST and SGE_TASK_STEPSIZE is not supported!"
+    if len(weights) != total_length:
+        raise ValueError(
+            "Got %d weights for a list of %d items"
+            % (len(weights), total_length)
         )
+    # each chunk gets an equal share of the weight left by the chunks before,
+    # and each item goes to the chunk that contains the middle of its weight
+    import bisect
+
+    cumulative = [0.0] + list(itertools.accumulate(weights))
+    middles = [(a + b) / 2 for a, b in zip(cumulative, cumulative[1:])]
+    end = 0
+    for k in range(index + 1):
+        start = end
+        if k == count - 1:
+            end = total_length
+        else:
+            share = (cumulative[-1] - cumulative[start]) / (count - k)
+            end = bisect.bisect_left(
+                middles, cumulative[start] + share, lo=start
+            )
+    return slice(start, end)
+
+
+def pe_slots(pe_opt: str | None) -> int:
+    """Returns the number of slots requested by the given parallel
+    environment (e.g. ``pe_mth 4``), which is 1 if none is given."""
+    slots = (pe_opt or "").split()[-1:]
+    return int(slots[0]) if slots and slots[0].isdigit() else 1
+
+
+def granted_slots() -> int:
+    """Returns the number of slots granted to the current job, as given by
+    ``NSLOTS``, which is 1 outside of a parallel environment."""
+    try:
+        return max(int(os.environ.get("NSLOTS", 1)), 1)
+    except ValueError:
+        return 1
+
+
+def parallel_map(
+    func: typing.Callable,
+    items: typing.Iterable,
+    slots: int | None = None,
+    chunksize: int | None = None,
+) -> list:
+    """Applies a function to each of the given items, in parallel on the
+    slots granted to the current job.
+
+    Use this function in jobs submitted with ``jman submit --parallel N`` to
+    process the share of a task, e.g.,
+    ``parallel_map(process, a[get_array_job_slice(len(a))])``.  The items are
+    dispatched to a pool of processes in chunks; with a single slot, they are
+    processed serially in the current process.
+
+
+    Parameters:
+
+        func: The function to apply, which needs to be picklable (e.g.,
+            defined at the top level of a module) when run in parallel
+
+        items: The items to process
+
+        slots: The number of processes; by default, the number of slots
+            granted to the job (see :py:func:`granted_slots`)
+
+        chunksize: The number of items sent to a process at once; by default,
+            each process gets about four chunks, which balances the load with
+            little overhead
+
+
+    Returns:
+
+        The results of the function, in the order of the items
+    """
+    items = list(items)
+    slots = min(granted_slots() if slots is None else slots, len(items))
+    if slots <= 1:
+        return [func(item) for item in items]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if chunksize is None:
+        chunksize = max(math.ceil(len(items) / (4 * slots)), 1)
+    with ProcessPoolExecutor(slots) as executor:
+        return list(executor.map(func, items, chunksize=chunksize))
+
+
+def iter_array_job_items(iterable: typing.Iterable) -> typing.Iterator:
+    """Yields the share of the current task of an SGE array job of the items
+    of the given iterable.
+
+    Unlike :py:func:`get_array_job_slice`, the items are streamed, so that the
+    input (e.g. the lines of a large file) is never loaded completely.  The
+    items are dealt to the tasks in turn, so that each task gets at most one
+    item more than the others.  Outside of array jobs, all items are yielded.
+
+
+    Parameters:
+
+        iterable: The items to share among the tasks of the array job
+
+
+    Yields:
+
+        The items of the current task, in their original order
+    """
+    task = _array_job_task()
+    if task is None:
+        yield from iterable
+        return
+    index, count = task
+    yield from itertools.islice(iterable, index, None, count)
 
-    job_id = sge_task_int - 1
 
-    number_of_parallel_jobs = int(os.environ["SGE_TASK_LAST"])
-    number_of_objects_per_job = int(
-        math.ceil(total_length / number_of_parallel_jobs)
+def line_index_file(path: str, mtime_ns: int | None = None) -> str:
+    """Returns the path of the line index of the given parameter file.
+
+    The index is kept in the cache directory of gridtk
+    (``$XDG_CACHE_HOME/gridtk``), not next to the file, and is named after the
+    absolute path of the file and its modification time (in ns; by default,
+    the current one).
+    """
+    import hashlib
+
+    path = os.path.realpath(path)
+    if mtime_ns is None:
+        mtime_ns = os.stat(path).st_mtime_ns
+    cache_home = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    digest = hashlib.sha1(path.encode()).hexdigest()[:16]
+    return os.path.join(
+        cache_home, "gridtk", "lines-%s-%d.index" % (digest, mtime_ns)
     )
 
-    start = min(job_id * number_of_objects_per_job, total_length)
-    end = min((job_id + 1) * number_of_objects_per_job, total_length)
 
-    return slice(start, end)
+def index_lines(path: str) -> int:
+    """Builds the line index of a parameter file, which contains one set of
+    parameters per line.
+
+    The index stores the offset of each line in the file, so that
+    :py:func:`get_array_file_line` finds the line of a task without reading
+    the file.  Empty lines and lines starting with ``#`` are skipped, like
+    ``jman submit --from-file`` does.
+
+
+    Parameters:
+
+        path: The parameter file, whose index is written into the cache
+            directory (see :py:func:`line_index_file`)
+
+
+    Returns:
+
+        The number of lines of parameters
+    """
+    import array
+    import glob
+    import struct
+
+    stat = os.stat(path)
+    offsets = array.array("Q")
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            stripped = line.strip()
+            if stripped and not stripped.startswith(b"#"):
+                offsets.append(offset)
+            offset += len(line)
+    if sys.byteorder != "little":
+        offsets.byteswap()
+
+    index = line_index_file(path, stat.st_mtime_ns)
+    os.makedirs(os.path.dirname(index), exist_ok=True)
+    # the indexes of earlier versions of the file are not needed any more
+    for old in glob.glob(index.rsplit("-", 1)[0] + "-*.index"):
+        if old != index:
+            with contextlib.suppress(OSError):
+                os.remove(old)
+    temp = "%s.%d" % (index, os.getpid())
+    with open(temp, "wb") as f:
+        f.write(
+            struct.pack(
+                LINE_INDEX_HEADER,
+                LINE_INDEX_MAGIC,
+                stat.st_size,
+                stat.st_mtime_ns,
+                len(offsets),
+            )
+        )
+        offsets.tofile(f)
+    os.replace(temp, index)
+    return len(offsets)
+
+
+def _scan_lines(path: str, task_id: int) -> str:
+    """Returns the line of parameters of a task, reading the parameter file
+    from its start."""
+    count = 0
+    with open(path, "rb") as f:
+        for line in f:
+            stripped = line.strip()
+            if stripped and not stripped.startswith(b"#"):
+                count += 1
+                if count == task_id:
+                    return stripped.decode()
+    raise IndexError("The parameter file '%s' has no line %d" % (path, task_id))
+
+
+def get_array_file_line(path: str, task_id: int | None = None) -> str:
+    """Returns the line of parameters of a task of an array job from a
+    parameter file indexed with :py:func:`index_lines`.
+
+    Both the index and the parameter file are memory-mapped, so that only the
+    requested line is read, whatever the size of the file.  If the index is
+    not in the cache directory, e.g., on a machine that does not share it, the
+    file is indexed again, or, if that fails, read from its start.
+
+
+    Parameters:
+
+        path: The parameter file
+
+        task_id: The task, starting at 1 for the first line; by default, the
+            ``SGE_TASK_ID`` of the current task
+
+
+    Returns:
+
+        The line of the task, without surrounding white space
+
+
+    Raises:
+
+        RuntimeError: If the parameter file has changed since it was indexed
+            (on this machine)
+
+        IndexError: If the file has no line for the given task
+    """
+    import mmap
+    import struct
+
+    if task_id is None:
+        task_id = int(os.environ["SGE_TASK_ID"])
+    import glob
+
+    stat = os.stat(path)
+    index = line_index_file(path, stat.st_mtime_ns)
+    try:
+        f = open(index, "rb")
+    except OSError:
+        if glob.glob(index.rsplit("-", 1)[0] + "-*.index"):
+            # only the index of an earlier version of the file is known
+            raise RuntimeError(
+                "The parameter file '%s' has changed since it was indexed"
+                % path
+            )
+        logger.info(
+            "Indexing the parameter file '%s', whose index is not in the "
+            "cache directory of this machine",
+            path,
+        )
+        try:
+            index_lines(path)
+            f = open(index, "rb")
+        except OSError as e:
+            logger.warning(
+                "Reading the parameter file '%s' from its start, since it "
+                "could not be indexed: %s",
+                path,
+                e,
+            )
+            return _scan_lines(path, task_id)
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+        magic, size, mtime, count = struct.unpack_from(LINE_INDEX_HEADER, index)
+        if (
+            magic != LINE_INDEX_MAGIC
+            or size != stat.st_size
+            or mtime != stat.st_mtime_ns
+        ):
+            raise RuntimeError(
+                "The parameter file '%s' has changed since it was indexed"
+                % path
+            )
+        if not 1 <= task_id <= count:
+            raise IndexError(
+                "The parameter file '%s' has no line %d" % (path, task_id)
+            )
+        (offset,) = struct.unpack_from(
+            "<Q",
+            index,
+            struct.calcsize(LINE_INDEX_HEADER) + 8 * (task_id - 1),
+        )
+
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        end = data.find(b"\n", offset)
+        return data[offset : end if end >= 0 else len(data)].decode().strip()
+
+
+def read_log(
+    path: str, head: int | None = None, tail: int | None = None
+) -> str:
+    """Reads a log file, or only its first or last lines.
+
+    The file is memory-mapped, so that only the requested lines are read,
+    whatever the size of the file.
+
+
+    Parameters:
+
+        path: The log file
+
+        head: If given, only the first ``head`` lines are read
+
+        tail: If given, only the last ``tail`` lines are read (ignoring
+            trailing white space)
+
+
+    Returns:
+
+        The contents of the file, without trailing white space
+    """
+    import mmap
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            end = len(data)
+            if head is not None:
+                end = -1
+                for _ in range(head):
+                    end = data.find(b"\n", end + 1)
+                    if end < 0:
+                        end = len(data)
+                        break
+                end = max(end, 0)
+            while end > 0 and data[end - 1 : end].isspace():
+                end -= 1
+            start = 0
+            if tail is not None:
+                start = end
+                for _ in range(tail):
+                    start = data.rfind(b"\n", 0, start)
+                    if start < 0:
+                        break
+                start = max(start + 1, 0) if tail else end
+            return data[start:end].decode(errors="replace")
+
+
+def copy_log(path: str, stream: typing.TextIO, chunk_size: int = 2**20):
+    """Writes a log file to the given stream in chunks, without trailing
+    white space (but with a final newline), so that large files are never
+    read into memory at once."""
+    pending = ""
+    with open(path, errors="replace") as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            chunk = pending + chunk
+            stripped = chunk.rstrip()
+            stream.write(stripped)
+            pending = chunk[len(stripped) :]
+    stream.write("\n")
+
+
+# The lines of log files that hint at errors (see grep_log)
+LOG_SIGNATURE = re.compile(
+    rb"Traceback|Error|Exception|Killed|[Oo]ut of memory|Segmentation fault"
+    rb"|[Cc]ore dumped|FAILED|[Ff]atal"
+)
+
+
+def grep_log(
+    path: str, pattern: str | None = None
+) -> list[tuple[int, int, str]]:
+    """Searches a log file for the lines matching a regular expression.
+
+    The file is memory-mapped and searched as a whole, so that even large
+    files are searched quickly.
+
+
+    Parameters:
+
+        path: The log file
+
+        pattern: The regular expression to search for; by default, the lines
+            that hint at errors (see :py:data:`LOG_SIGNATURE`) are returned
+
+
+    Returns:
+
+        A list of tuples ``(number, offset, line)`` of the matching lines,
+        with the number of the line (starting at 1), the offset of the line
+        in the file and the line without surrounding white space
+    """
+    import mmap
+
+    regex = (
+        LOG_SIGNATURE
+        if pattern is None
+        else re.compile(pattern.encode(), re.MULTILINE)
+    )
+    matches = []
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return matches
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            number, counted, position = 1, 0, 0
+            while True:
+                match = regex.search(data, position)
+                if match is None:
+                    break
+                start = data.rfind(b"\n", 0, match.start()) + 1
+                end = data.find(b"\n", match.start())
+                if end < 0:
+                    end = len(data)
+                # count the lines in between in chunks, not to copy them at once
+                for chunk in range(counted, start, 2**24):
+                    number += data[chunk : min(chunk + 2**24, start)].count(
+                        b"\n"
+                    )
+                counted = start
+                line = data[start:end].decode(errors="replace").strip()
+                matches.append((number, start, line))
+                # a line matches only once
+                position = end + 1
+                if position >= len(data):
+                    break
+    return matches
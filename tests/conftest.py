@@ -2,7 +2,13 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import json
+import os
 import pathlib
+import signal
+import subprocess
+import sys
+import typing
 
 import pytest
 
@@ -11,3 +17,60 @@ import pytest
 def datadir(request) -> pathlib.Path:
     """Returns the directory in which the test is sitting."""
     return pathlib.Path(request.fspath).parent / "data"
+
+
+@pytest.fixture
+def fake_grid(tmp_path, datadir, monkeypatch) -> typing.Iterator[pathlib.Path]:
+    """Puts stand-ins for the SGE and Slurm utilities on the ``PATH``, which
+    run the submitted jobs on the local machine (see ``data/fakegrid.py``).
+
+    Returns the directory in which the stand-ins keep their state.
+    """
+    root = tmp_path / "fakegrid"
+    bindir = root / "bin"
+    bindir.mkdir(parents=True)
+    for command in (
+        "qsub",
+        "qstat",
+        "qdel",
+        "qacct",
+        "sbatch",
+        "squeue",
+        "sacct",
+        "scancel",
+    ):
+        script = bindir / command
+        script.write_text(
+            f'#!/bin/sh\nexec "{sys.executable}" '
+            f'"{datadir / "fakegrid.py"}" {command} "$@"\n'
+        )
+        script.chmod(0o755)
+    monkeypatch.setenv("FAKEGRID_ROOT", str(root))
+    monkeypatch.setenv("FAKEGRID_IDLE", "2")
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+
+    yield root
+
+    # stop the scheduler of the fake grid, and everything it runs
+    pid_file = root / "daemon.pid"
+    if pid_file.exists():
+        try:
+            os.kill(int(pid_file.read_text()), signal.SIGKILL)
+        except (OSError, ValueError):
+            pass
+    subprocess.run(
+        [bindir / "qdel"] + _fake_grid_jobs(root), capture_output=True
+    )
+
+
+def _fake_grid_jobs(root: pathlib.Path) -> list[str]:
+    """Returns the ids of all jobs submitted to the fake grid."""
+    retval = []
+    for command in ("qsub", "sbatch"):
+        log = root / f"{command}.log"
+        if log.exists():
+            retval += [
+                str(json.loads(line)["id"])
+                for line in log.read_text().splitlines()
+            ]
+    return retval
@@ -0,0 +1,755 @@
+# SPDX-FileCopyrightText: Copyright © 2022 Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""A local stand-in for an SGE grid (or a Slurm cluster), to test and
+benchmark gridtk offline.
+
+The utility to emulate (``qsub``, ``qstat``, ``qdel`` and ``qacct``, or
+``sbatch``, ``squeue``, ``sacct`` and ``scancel``) is given as first argument.
+Jobs are kept in a SQLite database in the directory pointed to by
+``$FAKEGRID_ROOT``, and are really executed on the local machine by a
+scheduler daemon, which is started by ``qsub`` when required, and stops after
+some time without jobs.
+
+The simulation can be tuned with the following environment variables:
+
+``FAKEGRID_LATENCY``
+  Seconds each call to a grid utility waits before answering, like a busy
+  qmaster would (default: 0).
+
+``FAKEGRID_QUEUE_LATENCY``
+  Seconds a job waits in the queue before it can be started (default: 0).
+
+``FAKEGRID_SLOTS``
+  The maximum number of tasks executed in parallel (default: 4).
+
+``FAKEGRID_IDLE``
+  Seconds without jobs after which the scheduler daemon stops (default: 10).
+"""
+
+import fcntl
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+from xml.sax.saxutils import escape
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    command TEXT,
+    cwd TEXT,
+    stdout TEXT,
+    stderr TEXT,
+    queue TEXT,
+    slots INTEGER,
+    env TEXT,
+    hold TEXT,
+    array TEXT,
+    submit_time REAL,
+    scheduler TEXT DEFAULT 'sge'
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    job_id INTEGER,
+    task_id INTEGER,
+    state TEXT,
+    pid INTEGER,
+    start_time REAL,
+    exit_status INTEGER,
+    end_time REAL,
+    cpu_time REAL,
+    max_rss INTEGER,
+    PRIMARY KEY (job_id, task_id)
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state);
+"""
+
+# Options of qsub that take one argument (or two, for -pe)
+QSUB_OPTIONS = {
+    "-S",
+    "-N",
+    "-o",
+    "-e",
+    "-t",
+    "-hold_jid",
+    "-v",
+    "-l",
+    "-P",
+    "-q",
+    "-p",
+    "-A",
+}
+
+
+# Options of sbatch (and sacct) that do not take an argument
+SBATCH_FLAGS = {
+    "--parsable",
+    "--hold",
+    "--exclusive",
+    "--noheader",
+    "--parsable2",
+    "--allocations",
+}
+
+# Slurm names of the states of tasks
+SLURM_STATES = {"qw": "PENDING", "r": "RUNNING", "deleted": "CANCELLED"}
+
+
+def _connect(root):
+    connection = sqlite3.connect(
+        os.path.join(root, "state.db"), timeout=600, isolation_level=None
+    )
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _latency():
+    time.sleep(float(os.environ.get("FAKEGRID_LATENCY", "0")))
+
+
+def _log(root, command, argv):
+    with open(os.path.join(root, "%s.log" % command), "a") as f:
+        f.write(json.dumps({"argv": argv}) + "\n")
+
+
+def _tasks(spec):
+    """Expands a ``-t`` specification into task ids."""
+    first, _, rest = spec.partition("-")
+    if not rest:
+        return [int(first)]
+    last, _, step = rest.partition(":")
+    return list(range(int(first), int(last) + 1, int(step or 1)))
+
+
+def _daemon_running(root):
+    try:
+        with open(os.path.join(root, "daemon.pid")) as f:
+            os.kill(int(f.read()), 0)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def _submit(root, command_name, argv, scheduler="sge", **job):
+    """Adds a job to the queue, making sure the daemon runs it."""
+    connection = _connect(root)
+    connection.execute("BEGIN IMMEDIATE")
+    # make grid ids different from the ids in the gridtk database
+    job_id = connection.execute(
+        "SELECT COALESCE(MAX(id), 1000) + 1 FROM jobs"
+    ).fetchone()[0]
+    connection.execute(
+        "INSERT INTO jobs (id, name, command, cwd, stdout, stderr, queue, "
+        "slots, env, hold, array, submit_time, scheduler) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            job_id,
+            job["name"],
+            json.dumps(job["command"]),
+            job["cwd"],
+            job["stdout"],
+            job["stderr"],
+            job["queue"],
+            job["slots"],
+            json.dumps(job["env"]),
+            json.dumps(job["hold"]),
+            job["array"],
+            time.time(),
+            scheduler,
+        ),
+    )
+    tasks = _tasks(job["array"]) if job["array"] else [0]
+    connection.executemany(
+        "INSERT INTO tasks (job_id, task_id, state) VALUES (?, ?, 'qw')",
+        [(job_id, t) for t in tasks],
+    )
+    connection.execute("COMMIT")
+
+    with open(os.path.join(root, "%s.log" % command_name), "a") as f:
+        f.write(json.dumps({"id": job_id, "argv": argv}) + "\n")
+
+    if not _daemon_running(root):
+        subprocess.Popen(
+            [sys.executable, __file__, "daemon"],
+            start_new_session=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=open(os.path.join(root, "daemon.log"), "a"),
+        )
+
+    return job_id
+
+
+def qsub(root, argv):
+    _latency()
+
+    options = {"-l": [], "-v": [], "-hold_jid": []}
+    flags = set()
+    k = 0
+    while k < len(argv) and argv[k].startswith("-"):
+        option = argv[k]
+        if option == "-pe":
+            options["-pe"] = argv[k + 1 : k + 3]
+            k += 3
+        elif option in QSUB_OPTIONS:
+            if isinstance(options.get(option), list):
+                options[option].append(argv[k + 1])
+            else:
+                options[option] = argv[k + 1]
+            k += 2
+        else:
+            flags.add(option)
+            k += 1
+    command = argv[k:]
+    if "-S" in options:
+        command = [options["-S"]] + command
+
+    # without a name, SGE names jobs after their script
+    name = options.get("-N", os.path.basename(argv[k]))
+    queues = [q for q in options["-l"] if q.startswith("q") and "=" not in q]
+    hold = [int(j) for h in options["-hold_jid"] for j in h.split(",")]
+    env = dict(v.partition("=")[::2] for v in options["-v"])
+    slots = int(options["-pe"][1].rstrip("-")) if "-pe" in options else 1
+
+    job_id = _submit(
+        root,
+        "qsub",
+        argv,
+        name=name,
+        command=command,
+        cwd=os.getcwd() if "-cwd" in flags else os.path.expanduser("~"),
+        stdout=options.get("-o"),
+        stderr=options.get("-e", options.get("-o")),
+        queue=queues[0] if queues else "all.q",
+        slots=slots,
+        env=env,
+        hold=hold,
+        array=options.get("-t"),
+    )
+
+    if "-terse" in flags:
+        print(job_id if "-t" not in options else f"{job_id}.{options['-t']}")
+    else:
+        print(f'Your job {job_id} ("{name}") has been submitted')
+
+
+def _active_jobs(connection):
+    """Returns the jobs with tasks that did not finish yet."""
+    return {
+        row[0]
+        for row in connection.execute(
+            "SELECT DISTINCT job_id FROM tasks WHERE state IN ('qw', 'r')"
+        )
+    }
+
+
+def qstat(root, argv):
+    _latency()
+    _log(root, "qstat", argv)
+    connection = _connect(root)
+
+    if "-j" in argv:
+        job_id = int(argv[argv.index("-j") + 1])
+        row = connection.execute(
+            "SELECT name, queue FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None or job_id not in _active_jobs(connection):
+            print("Following jobs do not exist: ")
+            print(job_id)
+            sys.exit(1)
+        print("=" * 62)
+        print(f"job_number:                 {job_id}")
+        print(f"job_name:                   {row[0]}")
+        if row[1] != "all.q":
+            print(f"hard resource_list:         {row[1]}=TRUE")
+        return
+
+    rows = connection.execute(
+        "SELECT t.job_id, t.task_id, t.state, j.name, j.queue, j.slots, "
+        "j.array FROM tasks t JOIN jobs j ON t.job_id = j.id "
+        "WHERE t.state IN ('qw', 'r') ORDER BY t.job_id, t.task_id"
+    ).fetchall()
+    user = os.environ.get("USER", "user")
+
+    if "-xml" not in argv:
+        for job_id, task_id, state, name, queue, _, array in rows:
+            print(job_id, name, user, state, queue, task_id if array else "")
+        return
+
+    running = []
+    pending = []
+    for job_id, task_id, state, name, queue, slots, array in rows:
+        entry = [
+            f'    <job_list state="{"running" if state == "r" else "pending"}">',
+            f"      <JB_job_number>{job_id}</JB_job_number>",
+            f"      <JB_name>{escape(name)}</JB_name>",
+            f"      <JB_owner>{escape(user)}</JB_owner>",
+            f"      <state>{state}</state>",
+            "      <queue_name>%s</queue_name>"
+            % (f"{queue}@{socket.gethostname()}" if state == "r" else ""),
+            f"      <slots>{slots}</slots>",
+        ]
+        if array:
+            entry.append(f"      <tasks>{task_id}</tasks>")
+        entry.append("    </job_list>")
+        (running if state == "r" else pending).extend(entry)
+
+    print("<?xml version='1.0'?>")
+    print("<job_info>")
+    print("  <queue_info>")
+    print("\n".join(running))
+    print("  </queue_info>")
+    print("  <job_info>")
+    print("\n".join(pending))
+    print("  </job_info>")
+    print("</job_info>")
+
+
+def qdel(root, argv):
+    _latency()
+    _log(root, "qdel", argv)
+    connection = _connect(root)
+    active = _active_jobs(connection)
+    for spec in argv:
+        if spec.startswith("-"):
+            continue
+        job_id, _, task = spec.partition(".")
+        job_id = int(job_id)
+        if job_id not in active:
+            print(f'denied: job "{spec}" does not exist')
+            continue
+        query = "SELECT job_id, task_id, pid FROM tasks WHERE job_id = ? AND state IN ('qw', 'r')"
+        parameters = [job_id]
+        if task:
+            query += " AND task_id IN (%s)" % ",".join(
+                str(t) for t in _tasks(task)
+            )
+        _kill(connection, query, parameters)
+        print(f"{os.environ.get('USER', 'user')} has deleted job {spec}")
+
+
+def _kill(connection, query, parameters):
+    """Kills the tasks selected by the given query."""
+    for job_id, task_id, pid in connection.execute(
+        query, parameters
+    ).fetchall():
+        if pid is not None:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        connection.execute(
+            "UPDATE tasks SET state = 'deleted' WHERE job_id = ? AND task_id = ?",
+            (job_id, task_id),
+        )
+
+
+def _sbatch_options(argv):
+    """Parses the options of sbatch, which may be given as ``--key value`` or
+    ``--key=value``."""
+    options = {}
+    k = 0
+    while k < len(argv):
+        option = argv[k]
+        if "=" in option:
+            option, _, value = option.partition("=")
+            k += 1
+        elif option in SBATCH_FLAGS:
+            value = True
+            k += 1
+        else:
+            value = argv[k + 1]
+            k += 2
+        options[option] = value
+    return options
+
+
+def sbatch(root, argv):
+    _latency()
+
+    options = _sbatch_options(argv)
+    hold = []
+    dependency = options.get("--dependency")
+    if dependency:
+        hold = [int(j) for j in dependency.partition(":")[2].split(":")]
+    env = {}
+    for variable in options.get("--export", "ALL").split(",")[1:]:
+        key, _, value = variable.partition("=")
+        env[key] = value
+
+    job_id = _submit(
+        root,
+        "sbatch",
+        argv,
+        scheduler="slurm",
+        name=options.get("--job-name", "wrap"),
+        command=["/bin/sh", "-c", options["--wrap"]],
+        cwd=options.get("--chdir", os.getcwd()),
+        stdout=options.get("--output"),
+        stderr=options.get("--error", options.get("--output")),
+        queue=options.get("--partition", "normal"),
+        slots=int(options.get("--cpus-per-task", "1")),
+        env=env,
+        hold=hold,
+        array=options.get("--array"),
+    )
+
+    if "--parsable" in options:
+        print(job_id)
+    else:
+        print(f"Submitted batch job {job_id}")
+
+
+def squeue(root, argv):
+    _latency()
+    _log(root, "squeue", argv)
+    connection = _connect(root)
+
+    rows = connection.execute(
+        "SELECT t.job_id, t.task_id, t.state, j.name, j.queue, j.array "
+        "FROM tasks t JOIN jobs j ON t.job_id = j.id "
+        "WHERE t.state IN ('qw', 'r') ORDER BY t.job_id, t.task_id"
+    ).fetchall()
+    # only the format used by gridtk is supported
+    for job_id, task_id, state, name, queue, array in rows:
+        node = socket.gethostname() if state == "r" else ""
+        task = task_id if array else "N/A"
+        print(f"{job_id}|{task}|{SLURM_STATES[state]}|{queue}|{node}|{name}")
+
+
+def sacct(root, argv):
+    _latency()
+    _log(root, "sacct", argv)
+    connection = _connect(root)
+
+    options = _sbatch_options(argv)
+    job_ids = [int(j) for j in options["--jobs"].split(",")]
+    if options["--format"] == "JobID,Elapsed,TotalCPU,MaxRSS,NodeList":
+        _sacct_resources(connection, job_ids)
+        return
+    rows = connection.execute(
+        "SELECT t.job_id, t.task_id, t.state, t.exit_status, j.array "
+        "FROM tasks t JOIN jobs j ON t.job_id = j.id WHERE t.job_id IN (%s) "
+        "ORDER BY t.job_id, t.task_id" % ",".join("?" * len(job_ids)),
+        job_ids,
+    ).fetchall()
+    for job_id, task_id, state, exit_status, array in rows:
+        if state == "done":
+            state = "COMPLETED" if exit_status == 0 else "FAILED"
+        else:
+            state = SLURM_STATES[state]
+        job = f"{job_id}_{task_id}" if array else f"{job_id}"
+        print(f"{job}|{state}|{exit_status or 0}:0")
+
+
+def _sacct_resources(connection, job_ids):
+    """Prints the resources used by finished tasks, with the peak memory on
+    the line of the batch step, as Slurm does."""
+
+    def _duration(seconds):
+        return "%02d:%02d:%06.3f" % (
+            seconds // 3600,
+            seconds // 60 % 60,
+            seconds % 60,
+        )
+
+    rows = connection.execute(
+        "SELECT t.job_id, t.task_id, t.start_time, t.end_time, t.cpu_time, "
+        "t.max_rss, j.array FROM tasks t JOIN jobs j ON t.job_id = j.id "
+        "WHERE t.state = 'done' AND t.job_id IN (%s) "
+        "ORDER BY t.job_id, t.task_id" % ",".join("?" * len(job_ids)),
+        job_ids,
+    ).fetchall()
+    node = socket.gethostname()
+    for job_id, task_id, start, end, cpu, rss, array in rows:
+        job = f"{job_id}_{task_id}" if array else f"{job_id}"
+        elapsed, cpu = _duration(end - start), _duration(cpu)
+        print(f"{job}|{elapsed}|{cpu}||{node}")
+        print(f"{job}.batch|{elapsed}|{cpu}|{rss}K|{node}")
+        print(f"{job}.extern|{elapsed}|00:00:00|0|{node}")
+
+
+def scancel(root, argv):
+    _latency()
+    _log(root, "scancel", argv)
+    connection = _connect(root)
+    active = _active_jobs(connection)
+    failed = False
+    for spec in argv:
+        if spec.startswith("-"):
+            continue
+        job_id, _, task = spec.partition("_")
+        if int(job_id) not in active:
+            print(
+                f"scancel: error: Kill job error on job id {spec}: "
+                "Invalid job id specified"
+            )
+            failed = True
+            continue
+        query = (
+            "SELECT job_id, task_id, pid FROM tasks WHERE job_id = ? "
+            "AND state IN ('qw', 'r')"
+        )
+        if task:
+            query += " AND task_id = %d" % int(task)
+        _kill(connection, query, [int(job_id)])
+    if failed:
+        sys.exit(1)
+
+
+def _start(root, connection, job_id, task_id):
+    """Starts one task of a job in the background."""
+    row = connection.execute(
+        "SELECT name, command, cwd, stdout, stderr, slots, env, array, "
+        "scheduler FROM jobs WHERE id = ?",
+        (job_id,),
+    ).fetchone()
+    name, command, cwd, stdout, stderr, slots, env, array, scheduler = row
+
+    environ = dict(os.environ)
+    environ.update(json.loads(env))
+    if scheduler == "slurm":
+        return _start_slurm(connection, job_id, task_id, row[:-1], environ)
+    environ["JOB_ID"] = str(job_id)
+    environ["JOB_NAME"] = name
+    environ["NSLOTS"] = str(slots)
+    suffix = ""
+    if array:
+        tasks = _tasks(array)
+        environ["SGE_TASK_ID"] = str(task_id)
+        environ["SGE_TASK_FIRST"] = str(tasks[0])
+        environ["SGE_TASK_LAST"] = str(tasks[-1])
+        first, _, rest = array.partition("-")
+        environ["SGE_TASK_STEPSIZE"] = rest.partition(":")[2] or "1"
+        suffix = f".{task_id}"
+    else:
+        for k in ("ID", "FIRST", "LAST", "STEPSIZE"):
+            environ[f"SGE_TASK_{k}"] = "undefined"
+
+    def _output(directory, kind):
+        if directory is None:
+            directory = cwd
+        if os.path.isdir(directory):
+            return os.path.join(directory, f"{name}.{kind}{job_id}{suffix}")
+        return directory
+
+    with open(_output(stdout, "o"), "a") as out, open(
+        _output(stderr, "e"), "a"
+    ) as err:
+        return subprocess.Popen(
+            json.loads(command),
+            cwd=cwd,
+            env=environ,
+            stdin=subprocess.DEVNULL,
+            stdout=out,
+            stderr=err,
+            start_new_session=True,
+        )
+
+
+def _start_slurm(connection, job_id, task_id, row, environ):
+    """Starts one task of a Slurm job in the background."""
+    name, command, cwd, stdout, stderr, slots, _, array = row
+
+    environ["SLURM_JOB_NAME"] = name
+    environ["SLURM_CPUS_PER_TASK"] = str(slots)
+    environ["SLURM_JOB_ID"] = str(job_id)
+    if array:
+        tasks = _tasks(array)
+        # each task of an array job has its own id
+        environ["SLURM_JOB_ID"] = str(job_id * 1000 + task_id)
+        environ["SLURM_ARRAY_JOB_ID"] = str(job_id)
+        environ["SLURM_ARRAY_TASK_ID"] = str(task_id)
+        environ["SLURM_ARRAY_TASK_MIN"] = str(tasks[0])
+        environ["SLURM_ARRAY_TASK_MAX"] = str(tasks[-1])
+        environ["SLURM_ARRAY_TASK_STEP"] = array.partition(":")[2] or "1"
+
+    def _output(pattern):
+        path = (
+            (pattern or "slurm-%j.out")
+            .replace("%x", name)
+            .replace("%A", str(job_id))
+            .replace("%a", str(task_id))
+            .replace("%j", environ["SLURM_JOB_ID"])
+        )
+        return os.path.join(cwd, path)
+
+    with open(_output(stdout), "a") as out, open(_output(stderr), "a") as err:
+        return subprocess.Popen(
+            json.loads(command),
+            cwd=cwd,
+            env=environ,
+            stdin=subprocess.DEVNULL,
+            stdout=out,
+            stderr=err,
+            start_new_session=True,
+        )
+
+
+def _account(root, connection, job_id, task_id, exit_status, rusage):
+    """Writes the accounting record of a finished task of an SGE job."""
+    name, queue, slots, submit_time, start_time, scheduler = connection.execute(
+        "SELECT j.name, j.queue, j.slots, j.submit_time, t.start_time, "
+        "j.scheduler FROM jobs j JOIN tasks t ON t.job_id = j.id "
+        "WHERE t.job_id = ? AND t.task_id = ?",
+        (job_id, task_id),
+    ).fetchone()
+    if scheduler != "sge":
+        return
+    end_time = time.time()
+    cpu = rusage.ru_utime + rusage.ru_stime
+    fields = [""] * 45
+    fields[0] = queue
+    fields[1] = socket.gethostname()
+    fields[3] = os.environ.get("USER", "user")
+    fields[4] = name
+    fields[5] = str(job_id)
+    fields[8] = str(int(submit_time))
+    fields[9] = str(int(start_time))
+    fields[10] = str(int(end_time))
+    fields[11] = "0"
+    fields[12] = str(exit_status)
+    fields[13] = "%.3f" % (end_time - start_time)
+    fields[14] = "%.3f" % rusage.ru_utime
+    fields[15] = "%.3f" % rusage.ru_stime
+    fields[16] = str(rusage.ru_maxrss)
+    fields[34] = str(slots)
+    fields[35] = str(task_id)
+    fields[36] = "%.3f" % cpu
+    fields[42] = "%d" % (rusage.ru_maxrss * 1024)
+    with open(os.path.join(root, "accounting"), "a") as f:
+        f.write(":".join(fields) + "\n")
+
+
+def qacct(root, argv):
+    _latency()
+    _log(root, "qacct", argv)
+    path = os.path.join(root, "accounting")
+    if not os.path.exists(path):
+        print("error: no jobs running since startup")
+        sys.exit(1)
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split(":")
+            print("=" * 62)
+            print(f"qname        {fields[0]}")
+            print(f"hostname     {fields[1]}")
+            print(f"owner        {fields[3]}")
+            print(f"jobname      {fields[4]}")
+            print(f"jobnumber    {fields[5]}")
+            task = fields[35] if fields[35] != "0" else "undefined"
+            print(f"taskid       {task}")
+            print(f"exit_status  {fields[12]}")
+            print(f"ru_wallclock {fields[13]}s")
+            print(f"cpu          {fields[36]}s")
+            print("maxvmem      %.3fM" % (int(fields[42]) / 1024**2))
+
+
+def _write_pid(pid_file):
+    with open(pid_file + ".tmp", "w") as f:
+        f.write(str(os.getpid()))
+    os.rename(pid_file + ".tmp", pid_file)
+
+
+def daemon(root, argv):
+    """Runs the queued tasks, as soon as they are ready."""
+    # make sure that a single daemon runs
+    lock = open(os.path.join(root, "daemon.lock"), "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return
+    pid_file = os.path.join(root, "daemon.pid")
+    _write_pid(pid_file)
+
+    connection = _connect(root)
+    slots = int(os.environ.get("FAKEGRID_SLOTS", "4"))
+    queue_latency = float(os.environ.get("FAKEGRID_QUEUE_LATENCY", "0"))
+    idle = float(os.environ.get("FAKEGRID_IDLE", "10"))
+    running = {}
+    last_activity = time.time()
+
+    while True:
+        # collect finished tasks
+        for key, process in list(running.items()):
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid == 0:
+                continue
+            del running[key]
+            process.returncode = os.waitstatus_to_exitcode(status)
+            updated = connection.execute(
+                "UPDATE tasks SET state = 'done', exit_status = ?, "
+                "end_time = ?, cpu_time = ?, max_rss = ? "
+                "WHERE job_id = ? AND task_id = ? AND state = 'r'",
+                (
+                    process.returncode,
+                    time.time(),
+                    rusage.ru_utime + rusage.ru_stime,
+                    rusage.ru_maxrss,
+                    *key,
+                ),
+            ).rowcount
+            if updated:
+                _account(root, connection, *key, process.returncode, rusage)
+
+        # start new tasks
+        if len(running) < slots:
+            active = _active_jobs(connection)
+            candidates = connection.execute(
+                "SELECT t.job_id, t.task_id, j.hold FROM tasks t "
+                "JOIN jobs j ON t.job_id = j.id "
+                "WHERE t.state = 'qw' AND j.submit_time <= ? "
+                "ORDER BY t.job_id, t.task_id",
+                (time.time() - queue_latency,),
+            ).fetchall()
+            for job_id, task_id, hold in candidates:
+                if len(running) >= slots:
+                    break
+                if any(h in active for h in json.loads(hold)):
+                    continue
+                process = _start(root, connection, job_id, task_id)
+                connection.execute(
+                    "UPDATE tasks SET state = 'r', pid = ?, start_time = ? "
+                    "WHERE job_id = ? AND task_id = ?",
+                    (process.pid, time.time(), job_id, task_id),
+                )
+                running[(job_id, task_id)] = process
+
+        if running or _active_jobs(connection):
+            last_activity = time.time()
+        elif time.time() - last_activity > idle:
+            # jobs submitted after this check will start a new daemon
+            os.unlink(pid_file)
+            if not _active_jobs(connection):
+                break
+            _write_pid(pid_file)
+        time.sleep(0.05)
+
+
+def main():
+    root = os.environ["FAKEGRID_ROOT"]
+    command, argv = sys.argv[1], sys.argv[2:]
+    commands = {
+        "qsub": qsub,
+        "qstat": qstat,
+        "qdel": qdel,
+        "qacct": qacct,
+        "sbatch": sbatch,
+        "squeue": squeue,
+        "sacct": sacct,
+        "scancel": scancel,
+        "daemon": daemon,
+    }
+    commands[command](root, argv)
+
+
+if __name__ == "__main__":
+    main()
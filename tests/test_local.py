@@ -2,13 +2,26 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import json
 import os
 import pathlib
 import shutil
+import signal
+import socket
+import sqlite3
 import subprocess
+import sys
 import time
 
+import pytest
+import sqlalchemy
+import sqlalchemy.orm
+
 import gridtk.local
+import gridtk.models
+import gridtk.runner
+import gridtk.server
+import gridtk.spool
 
 from gridtk.models import Job
 from gridtk.script import jman
@@ -555,3 +568,725 @@ def test_local(tmp_path: pathlib.Path, datadir: pathlib.Path):
     finally:
         if scheduler_job is not None:
             scheduler_job.kill()
+
+
+def test_resubmit_array_ids(tmp_path: pathlib.Path):
+    # only the selected array jobs are re-submitted and run again
+    database = str(tmp_path / "database.sql3")
+    marker = tmp_path / "marker"
+
+    def _jman(*args):
+        return jman.main(
+            [shutil.which("jman"), "--local", "--database", database]
+            + list(args)
+        )
+
+    def _run_scheduler():
+        subprocess.check_call(
+            [
+                shutil.which("jman"),
+                "--local",
+                "--database",
+                database,
+                "run-scheduler",
+                "--sleep-time",
+                "0.1",
+                "--parallel",
+                "2",
+                "--die-when-finished",
+            ]
+        )
+
+    def _array_jobs():
+        session = job_manager.lock()
+        array = [
+            (a.status, a.finish_time) for a in session.query(Job).one().array
+        ]
+        job_manager.unlock()
+        return array
+
+    _jman(
+        "submit",
+        "--log-dir",
+        str(tmp_path / "logs"),
+        "--parametric",
+        "4",
+        "/bin/sh",
+        "-c",
+        'test -e "$0" || test "$SGE_TASK_ID" = 1 || test "$SGE_TASK_ID" = 3',
+        str(marker),
+    )
+    job_manager = gridtk.local.JobManagerLocal(database=database)
+    _run_scheduler()
+    first = _array_jobs()
+    assert [a[0] for a in first] == ["success", "failure"] * 2
+
+    marker.touch()
+    _jman("resubmit", "--failed-only")
+    assert [a[0] for a in _array_jobs()] == ["success", "submitted"] * 2
+    _jman("resubmit", "--array-ids", "1")
+    assert [a[0] for a in _array_jobs()] == ["success", "submitted"] * 2
+
+    _run_scheduler()
+    second = _array_jobs()
+    assert [a[0] for a in second] == ["success"] * 4
+    assert [a[1] == b[1] for a, b in zip(first, second)] == [
+        True,
+        False,
+    ] * 2
+
+
+def test_resources(tmp_path: pathlib.Path):
+    # the resources used by local jobs are measured while they run
+    database = str(tmp_path / "database.sql3")
+    jman.main(
+        [
+            shutil.which("jman"),
+            "--local",
+            "--database",
+            database,
+            "submit",
+            "--log-dir",
+            str(tmp_path / "logs"),
+            sys.executable,
+            "-c",
+            "b = bytearray(100 * 2**20)",
+        ]
+    )
+    subprocess.check_call(
+        [
+            shutil.which("jman"),
+            "--local",
+            "--database",
+            database,
+            "run-scheduler",
+            "--sleep-time",
+            "0.1",
+            "--die-when-finished",
+        ]
+    )
+    job_manager = gridtk.local.JobManagerLocal(database=database)
+    session = job_manager.lock()
+    job = session.query(Job).one()
+    assert job.status == "success"
+    assert job.wall_time > 0
+    assert job.max_memory >= 100 * 2**20
+    job_manager.unlock()
+
+
+def test_spool_recovery(tmp_path: pathlib.Path, capsys):
+    # results that cannot be written into the database are spooled, without
+    # making other jobs use the spool directory
+    database = str(tmp_path / "database.sql3")
+    job_manager = gridtk.local.JobManagerLocal(database=database)
+    for name in ("first", "second"):
+        job_manager.submit(["/bin/true"], name=name)
+    job_manager.lock()
+    job_manager.unlock()
+
+    # the database is locked by another process for longer than we wait
+    engine = sqlalchemy.create_engine(
+        "sqlite:///" + database, connect_args={"timeout": 0.1}
+    )
+    job_manager._session_maker = sqlalchemy.orm.sessionmaker(bind=engine)
+    connection = sqlite3.connect(database, isolation_level=None)
+    connection.execute("BEGIN EXCLUSIVE")
+    job_manager.finish_job(1, None, 0)
+    connection.execute("ROLLBACK")
+    connection.close()
+    directory = gridtk.spool.directory(database)
+    assert len(gridtk.spool.read(directory)) == 1
+    assert not gridtk.spool.enabled(directory)
+    del job_manager
+
+    # later jobs still write their status into the database
+    gridtk.local.JobManagerLocal(database=database).run_job(2)
+    connection = sqlite3.connect(database)
+    assert connection.execute(
+        'SELECT name, status FROM Job ORDER BY "unique"'
+    ).fetchall() == [("first", "submitted"), ("second", "success")]
+    connection.close()
+    assert len(gridtk.spool.read(directory)) == 1
+
+    # the spooled result is merged by the commands that read the database
+    capsys.readouterr()
+    jman.main([shutil.which("jman"), "--local", "--database", database, "list"])
+    lines = capsys.readouterr().out.splitlines()[2:]
+    assert [line.split()[3] for line in lines] == ["success", "success"]
+    assert gridtk.spool.read(directory) == []
+
+
+def test_array_from_file(tmp_path: pathlib.Path, monkeypatch):
+    # each array job reads its own line of the parameter file
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    database = str(tmp_path / "database.sql3")
+    parameters = tmp_path / "parameters.txt"
+    parameters.write_text("# header\n'first line'\n\nsecond\nthird 3\n")
+    jman.main(
+        [
+            shutil.which("jman"),
+            "--local",
+            "--database",
+            database,
+            "submit",
+            "--log-dir",
+            str(tmp_path / "logs"),
+            "--array-from-file",
+            str(parameters),
+            "/bin/echo",
+            "-n",
+        ]
+    )
+    subprocess.check_call(
+        [
+            shutil.which("jman"),
+            "--local",
+            "--database",
+            database,
+            "run-scheduler",
+            "--sleep-time",
+            "0.1",
+            "--die-when-finished",
+        ]
+    )
+    job_manager = gridtk.local.JobManagerLocal(database=database)
+    session = job_manager.lock()
+    job = session.query(Job).one()
+    assert job.get_array() == (1, 3, 1)
+    outputs = [open(a.std_out_file()).read() for a in job.array]
+    job_manager.unlock()
+    assert outputs == ["first line", "second", "third 3"]
+    # the index is not written next to the parameter file
+    assert not (tmp_path / "parameters.txt.index").exists()
+
+
+def test_startup(tmp_path: pathlib.Path):
+    # the commands only import the modules they need, to start up fast
+    database = str(tmp_path / "database.sql3")
+    jman.main(
+        [shutil.which("jman"), "--local", "--database", database, "submit"]
+        + ["/bin/true"]
+    )
+
+    def _import_times(*args, **environ):
+        process = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                "import sys; from gridtk.script.jman import main; "
+                "sys.exit(main([%r] + sys.argv[1:]))" % shutil.which("jman"),
+                "--local",
+                "--database",
+                database,
+            ]
+            + list(args),
+            env=dict(os.environ, **environ),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times = {}
+        for line in process.stderr.splitlines():
+            if line.startswith("import time:"):
+                _, cumulative, name = line.split("|")
+                if cumulative.strip().isdigit():
+                    times[name.strip()] = int(cumulative)
+        return times
+
+    unused = {"gridtk.backend", "gridtk.sge", "gridtk.slurm"}
+    times = _import_times("env", "--context", "non-existing")
+    assert "sqlalchemy" not in times
+    for command in (["run-job"], ["list"]):
+        times = _import_times(*command, JOB_ID="1", SGE_TASK_ID="undefined")
+        assert not unused & set(times)
+        # only commands that 'jman server' can handle ask it to
+        assert ("gridtk.server" in times) == (command == ["list"])
+        # the database is only opened by the command, not by importing jman
+        assert times["gridtk.script.jman"] < times["sqlalchemy"]
+    # the lean runner does not need SQLAlchemy at all
+    times = _import_times("run-job", "--lean", JOB_ID="1", SGE_TASK_ID="1")
+    assert "sqlalchemy" not in times
+    # ... nor the user configuration, nor what only other tools need
+    assert not {"clapper", "hashlib", "glob"} & set(times)
+
+
+def test_lean_runner(tmp_path: pathlib.Path):
+    # the lean runner records the same results as the job manager
+    database = str(tmp_path / "database.sql3")
+    job_manager = gridtk.local.JobManagerLocal(database=database)
+    array = job_manager.submit(
+        ["/bin/sh", "-c", 'test "$SGE_TASK_ID" != 3'],
+        array=(1, 4, 1),
+        log_dir=str(tmp_path / "logs"),
+    )
+    # the results of jobs with dependent jobs are recorded by the ORM
+    first = job_manager.submit(["/bin/true"], log_dir=str(tmp_path / "logs"))
+    second = job_manager.submit(
+        ["/bin/false"], dependencies=[first], log_dir=str(tmp_path / "logs")
+    )
+    subprocess.check_call(
+        [
+            shutil.which("jman"),
+            "--local",
+            "--database",
+            database,
+            "run-scheduler",
+            "--sleep-time",
+            "0.1",
+            "--die-when-finished",
+            "--lean",
+        ]
+    )
+    session = job_manager.lock()
+    jobs = {job.unique: job for job in session.query(Job)}
+    assert jobs[array].status == "failure"
+    assert [a.status for a in jobs[array].array] == ["success"] * 2 + [
+        "failure",
+        "success",
+    ]
+    assert all(a.max_memory > 0 for a in jobs[array].array)
+    assert (
+        abs(jobs[array].wall_time - sum(a.wall_time for a in jobs[array].array))
+        < 1e-6
+    )
+    assert jobs[first].status == "success" and jobs[first].result == 0
+    assert jobs[second].status == "failure" and jobs[second].result == 1
+    assert jobs[second].start_time is not None
+    assert jobs[second].machine_name is not None
+    job_manager.unlock()
+
+    # the hidden run-job command runs jobs with and without the lean runner
+    def _run_job(*args):
+        job_id = job_manager.submit(["/bin/true"])
+        subprocess.check_call(
+            [
+                shutil.which("jman"),
+                "--local",
+                "--database",
+                database,
+                "run-job",
+            ]
+            + list(args),
+            env=dict(os.environ, JOB_ID=str(job_id), SGE_TASK_ID="undefined"),
+        )
+
+    _run_job()
+    _run_job("--lean")
+    session = job_manager.lock()
+    assert [
+        job.status for job in session.query(Job).filter(Job.unique > second)
+    ] == ["success"] * 2
+    job_manager.unlock()
+
+
+def test_lean_runner_spool(tmp_path: pathlib.Path, monkeypatch):
+    # the lean runner spools results that cannot be written into the database
+    database = str(tmp_path / "database.sql3")
+    job_manager = gridtk.local.JobManagerLocal(database=database)
+    job_id = job_manager.submit(["/bin/false"])
+    job_manager.lock()
+    job_manager.unlock()
+
+    # the database is locked by another process once the job has run
+    locker = sqlite3.connect(database, isolation_level=None)
+    run_command = gridtk.runner.run_command
+
+    def _run_command(*args):
+        retval = run_command(*args)
+        locker.execute("BEGIN EXCLUSIVE")
+        return retval
+
+    monkeypatch.setattr(gridtk.runner, "run_command", _run_command)
+    monkeypatch.setattr(
+        gridtk.runner,
+        "_connect",
+        lambda database: sqlite3.connect(
+            database, timeout=0.1, isolation_level=None
+        ),
+    )
+    try:
+        finished = gridtk.runner.run_job(database, job_id, grid=False)
+    finally:
+        locker.execute("ROLLBACK")
+        locker.close()
+    assert finished["recorded"] and finished["result"] == 1
+    directory = gridtk.spool.directory(database)
+    assert len(gridtk.spool.read(directory)) == 1
+    assert not gridtk.spool.enabled(directory)
+
+    # the spooled result is merged later on
+    assert job_manager.merge_spool() == 1
+    session = job_manager.lock()
+    job = session.query(Job).one()
+    assert (job.status, job.result) == ("failure", 1)
+    assert job.max_memory > 0
+    job_manager.unlock()
+
+
+def test_list_formats(tmp_path: pathlib.Path, capsys):
+    # the jobs are listed as records in machine-readable formats
+    database = str(tmp_path / "database.sql3")
+    job_manager = gridtk.local.JobManagerLocal(database=database)
+    first = job_manager.submit(["/bin/echo", "a b"], name="first")
+    job_manager.submit(["/bin/true"], array=(1, 5, 2), dependencies=[first])
+    for _ in range(3):
+        job_manager.submit(["/bin/true"], name="other")
+    del job_manager
+
+    def _list(*args):
+        capsys.readouterr()
+        jman.main(
+            [shutil.which("jman"), "--local", "--database", database, "list"]
+            + list(args)
+        )
+        return capsys.readouterr().out
+
+    records = [json.loads(line) for line in _list("-f", "jsonl").splitlines()]
+    assert [r["job_id"] for r in records] == [1, 2, 3, 4, 5]
+    assert records[0]["name"] == "first"
+    assert records[1]["array"] == "1-5:2"
+    assert records[1]["status"] == "submitted"
+
+    records = json.loads(_list("-f", "json", "-l", "-x", "-t", "-j", "1-2"))
+    assert records[0]["command"] == "/bin/echo 'a b'"
+    assert records[1]["dependencies"] == [1]
+    assert records[1]["submit_time"] is not None
+    assert json.loads(_list("-f", "json", "-n", "missing")) == []
+
+    # the page is selected on the jobs, which are followed by their array jobs
+    rows = _list("-f", "csv", "-a", "--limit", "2").splitlines()
+    assert rows[0].startswith("job_id,grid_id,array,")
+    assert [row.split(",")[0] for row in rows[1:]] == ["1", "2", "2", "2", "2"]
+    assert [row.split(",")[9] for row in rows[1:]] == ["", "", "1", "3", "5"]
+    rows = _list("-f", "tsv", "-n", "other", "--offset", "1").splitlines()
+    assert [row.split("\t")[0] for row in rows[1:]] == ["4", "5"]
+    assert _list("-o", "--offset", "3").split() == ["4", "5"]
+    # the table is paginated as well
+    assert len(_list("--limit", "1").splitlines()) == 3
+
+    # the jobs are filtered by the refreshed status, whose stored status is
+    # outdated for array jobs whose array jobs all finished
+    def _outdate():
+        connection = sqlite3.connect(database)
+        with connection:
+            connection.execute(
+                "UPDATE Job SET status = 'executing', result = NULL WHERE id = 2"
+            )
+            connection.execute(
+                "UPDATE ArrayJob SET status = 'success', result = 0"
+            )
+            connection.execute("UPDATE Job SET status = 'success' WHERE id = 4")
+        connection.close()
+
+    _outdate()
+    table = _list("-s", "success").splitlines()[2:]
+    assert [line.split()[0] for line in table] == ["2", "4"]
+    _outdate()
+    records = _list("-s", "success", "-f", "jsonl").splitlines()
+    assert [json.loads(r)["job_id"] for r in records] == [2, 4]
+    assert [json.loads(r)["result"] for r in records] == [0, None]
+    _outdate()
+    connection = sqlite3.connect(database)
+    with connection:
+        connection.execute(
+            "UPDATE ArrayJob SET status = 'failure', result = 7 WHERE id = 3"
+        )
+    connection.close()
+    (record,) = _list("-s", "failure", "-f", "jsonl").splitlines()
+    assert (json.loads(record)["job_id"], json.loads(record)["result"]) == (
+        2,
+        7,
+    )
+    _outdate()
+    assert _list("-o", "-s", "success").split() == ["2", "4"]
+    _outdate()
+    assert _list("-o", "-s", "success", "--offset", "1").split() == ["4"]
+    _outdate()
+    (job,) = _list("-s", "success", "--limit", "1").splitlines()[2:]
+    assert job.split()[0] == "2" and "success" in job.split()
+
+
+def test_report(tmp_path: pathlib.Path, monkeypatch, capsys):
+    # the log files are reported in order, or only their first or last lines
+    database = str(tmp_path / "database.sql3")
+    jman.main(
+        [
+            shutil.which("jman"),
+            "--local",
+            "--database",
+            database,
+            "submit",
+            "--log-dir",
+            str(tmp_path / "logs"),
+            "--array",
+            "4",
+            "/bin/sh",
+            "-c",
+            'for i in 1 2 3; do echo "$SGE_TASK_ID.$i"; done; '
+            'test "$SGE_TASK_ID" != 2',
+        ]
+    )
+    subprocess.check_call(
+        [
+            shutil.which("jman"),
+            "--local",
+            "--database",
+            database,
+            "run-scheduler",
+            "--sleep-time",
+            "0.1",
+            "--die-when-finished",
+        ]
+    )
+
+    def _report(*args):
+        capsys.readouterr()
+        jman.main(
+            [shutil.which("jman"), "--local", "--database", database, "report"]
+            + list(args)
+        )
+        return [
+            line
+            for line in capsys.readouterr().out.splitlines()
+            if line[:1].isdigit()
+        ]
+
+    full = ["%d.%d" % (task, i) for task in range(1, 5) for i in (1, 2, 3)]
+    assert _report() == full
+    assert _report("--head", "1") == ["1.1", "2.1", "3.1", "4.1"]
+    assert _report("--tail", "2") == [
+        line for line in full if not line.endswith(".1")
+    ]
+    assert _report("--failed-only", "--tail", "1") == ["2.3"]
+
+    # only the matching lines are reported, as by grep
+    def _grep(*args):
+        capsys.readouterr()
+        jman.main(
+            [shutil.which("jman"), "--local", "--database", database, "report"]
+            + ["--output-only", "--grep"]
+            + list(args)
+        )
+        return capsys.readouterr().out.splitlines()
+
+    lines = _grep("^[13][.]2$")
+    assert [line.split(":", 1)[1] for line in lines] == ["2:1.2", "2:3.2"]
+    assert [os.path.splitext(line.split(":")[0])[1] for line in lines] == [
+        ".1",
+        ".3",
+    ]
+    assert _grep() == []
+
+    # ... and the log files of finished jobs are not searched again
+    def _grep_log(path, pattern):
+        raise RuntimeError("The log file should not be searched again")
+
+    monkeypatch.setattr(gridtk.manager, "grep_log", _grep_log)
+    assert _grep("^[13][.]2$") == lines
+    assert _grep() == []
+    # ... unless the matches in the database are not used
+    with pytest.raises(RuntimeError):
+        _grep("^[13][.]2$", "--no-log-index")
+    monkeypatch.undo()
+    assert len(_grep("[.]1", "--no-log-index")) == 4
+    connection = sqlite3.connect(database)
+    assert all(
+        "[.]1" not in json.loads(matches)
+        for (matches,) in connection.execute("SELECT matches FROM LogIndex")
+    )
+    connection.close()
+    assert len(_grep("[.]3")) == 4
+
+    # large log files are streamed, and not read in advance
+    monkeypatch.setattr(gridtk.local.JobManagerLocal, "report_workers", 1)
+    monkeypatch.setattr(gridtk.local.JobManagerLocal, "report_prefetch_size", 4)
+    assert _report() == full
+
+    # the matches of the log files are forgotten with their jobs
+    job_manager = gridtk.local.JobManagerLocal(database=database)
+    session = job_manager.lock()
+    assert session.query(gridtk.models.LogIndex).count() == 4
+    job_manager.unlock()
+    job_manager.delete(job_ids=None)
+    session = job_manager.lock()
+    assert session.query(gridtk.models.LogIndex).count() == 0
+    job_manager.unlock()
+
+
+def test_stats(tmp_path: pathlib.Path, capsys):
+    # the statistics of the tasks are aggregated per name, queue or machine
+    database = str(tmp_path / "database.sql3")
+    job_manager = gridtk.local.JobManagerLocal(database=database)
+    job_manager.submit(["/bin/true"], name="array", array=(1, 3, 1))
+    for _ in range(2):
+        job_manager.submit(["/bin/true"], name="single")
+    del job_manager
+
+    # tasks that waited 10, 20 and 30 seconds, and ran 60, 120 and 7200
+    connection = sqlite3.connect(database)
+    submit = "2022-01-01 00:00:00.000000"
+    with connection:
+        connection.execute("UPDATE Job SET submit_time = ?", (submit,))
+        connection.execute("UPDATE ArrayJob SET submit_time = NULL")
+        for task, wait, run, status in (
+            (1, 10, 60, "success"),
+            (2, 20, 120, "failure"),
+            (3, 30, 7200, "success"),
+        ):
+            connection.execute(
+                "UPDATE ArrayJob SET status = ?, machine_name = 'host', "
+                "start_time = datetime(?, ?), finish_time = datetime(?, ?) "
+                "WHERE id = ?",
+                (
+                    status,
+                    submit,
+                    f"+{wait} seconds",
+                    submit,
+                    f"+{wait + run} seconds",
+                    task,
+                ),
+            )
+        connection.execute(
+            "UPDATE Job SET status = 'executing', start_time = datetime(?, "
+            "'+5 seconds') WHERE name = 'single' AND id = 2",
+            (submit,),
+        )
+    connection.close()
+
+    def _stats(*args):
+        capsys.readouterr()
+        jman.main(
+            [shutil.which("jman"), "--local", "--database", database, "stats"]
+            + list(args)
+        )
+        return capsys.readouterr().out
+
+    records = json.loads(_stats("--json"))
+    assert [r["group"] for r in records] == ["array", "single"]
+    array, single = records
+    assert (array["tasks"], array["finished"], array["failed"]) == (3, 3, 1)
+    assert array["failure_rate"] == 1 / 3
+    # 3 tasks finished within the two hours between the first start and the
+    # last finish
+    assert abs(array["throughput"] - 3 * 3600 / 7220) < 1e-3
+    assert abs(array["wait"]["mean"] - 20) < 1e-3
+    assert [round(array["wait"][p]) for p in ("p50", "p90", "max")] == [
+        20,
+        30,
+        30,
+    ]
+    assert [round(array["run"][p]) for p in ("p50", "p99")] == [120, 7200]
+    assert array["histogram"] == {
+        "<1m": 0,
+        "<10m": 2,
+        "<1h": 0,
+        "<6h": 1,
+        "<1d": 0,
+        ">=1d": 0,
+    }
+    assert (single["tasks"], single["finished"], single["failed"]) == (2, 0, 0)
+    assert single["failure_rate"] is None and single["throughput"] is None
+    assert round(single["wait"]["p50"]) == 5 and single["run"]["p50"] is None
+
+    records = json.loads(_stats("--json", "--by", "machine", "-j", "1"))
+    assert [(r["group"], r["tasks"]) for r in records] == [("host", 3)]
+    assert json.loads(_stats("--json", "--since", "1d")) == []
+    assert "array" in _stats("--since", "2021-12-31")
+    with pytest.raises(SystemExit):
+        _stats("--since", "yesterday")
+
+
+def test_upgrade(tmp_path: pathlib.Path):
+    # databases of older versions are upgraded with the missing columns
+    database = tmp_path / "database.sql3"
+    job_manager = gridtk.local.JobManagerLocal(database=str(database))
+    job_manager.submit(["/bin/true"], name="old")
+
+    connection = sqlite3.connect(database)
+    for table in ("Job", "ArrayJob"):
+        for column in ("wall_time", "cpu_time", "max_memory"):
+            connection.execute(f'ALTER TABLE "{table}" DROP COLUMN {column}')
+    connection.execute('ALTER TABLE "Job" DROP COLUMN pack_index')
+    connection.execute('DROP TABLE "LogIndex"')
+    connection.commit()
+    connection.close()
+
+    job_manager = gridtk.local.JobManagerLocal(database=str(database))
+    session = job_manager.lock()
+    job = session.query(Job).one()
+    assert job.name == "old"
+    assert job.wall_time is None
+    assert job.pack_index is None
+    job.set_resources(12.0, 10.0, 1024)
+    session.commit()
+    job_manager.unlock()
+
+    session = job_manager.lock()
+    assert session.query(Job).one().max_memory == 1024
+    assert session.query(gridtk.models.LogIndex).count() == 0
+    job_manager.unlock()
+
+
+def test_server(tmp_path: pathlib.Path, monkeypatch, capsys):
+    # the commands are handled by 'jman server', if it is running
+    database = str(tmp_path / "database.sql3")
+    socket_path = gridtk.server.socket_path(database)
+    process = subprocess.Popen(
+        [shutil.which("jman"), "--local", "--database", database, "server"]
+    )
+    try:
+        start = time.time()
+        while gridtk.server.request(socket_path, {"ping": True}) is None:
+            assert time.time() - start < 30
+            time.sleep(0.1)
+
+        # nobody else may connect to the server
+        assert os.stat(socket_path).st_mode & 0o077 == 0
+
+        # jobs are submitted by the calling jman, with its environment
+        for name in ("first", "second"):
+            status = jman.main(
+                [
+                    shutil.which("jman"),
+                    "--local",
+                    "--database",
+                    database,
+                    "submit",
+                    "--name",
+                    name,
+                    "/bin/true",
+                ]
+            )
+            assert status == 0
+        capsys.readouterr()
+
+        def _setup(args):
+            raise AssertionError("The command should be handled by the server")
+
+        monkeypatch.setattr(jman, "setup", _setup)
+        jman.main(
+            [shutil.which("jman"), "--local", "--database", database, "list"]
+        )
+        output = capsys.readouterr().out
+        assert "first" in output and "second" in output
+
+        jman.main(
+            [shutil.which("jman"), "--local", "--database", database, "delete"]
+        )
+        assert not os.path.exists(database)
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=30)
+    assert not os.path.exists(socket_path)
+
+    # clients do not wait forever for a busy server
+    busy = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    busy.bind(socket_path)
+    busy.listen()
+    try:
+        assert gridtk.server.request(socket_path, {}, read_timeout=0.1) is None
+    finally:
+        busy.close()
+        os.remove(socket_path)
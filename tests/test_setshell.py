@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: Copyright © 2022 Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import pathlib
+import stat
+
+from gridtk import setshell
+
+
+def _fake_setshell(basedir: pathlib.Path) -> pathlib.Path:
+    """Creates a fake ``dosetshell`` that counts how often it is called."""
+    bindir = basedir / "setshell" / "bin"
+    bindir.mkdir(parents=True)
+    dosetshell = bindir / "dosetshell"
+    dosetshell.write_text(
+        f"""#!/bin/bash
+echo x >> {basedir}/calls
+source=$(mktemp)
+echo "export GRIDTK_TEST_CONTEXT=$3" > $source
+echo $source
+"""
+    )
+    dosetshell.chmod(dosetshell.stat().st_mode | stat.S_IEXEC)
+    return basedir / "calls"
+
+
+def test_environ_cache(tmp_path, monkeypatch):
+    calls = _fake_setshell(tmp_path)
+    monkeypatch.setenv("BASEDIRSETSHELL", str(tmp_path))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    setshell.clear_cache("grid")
+
+    env = setshell.environ("grid")
+    assert env["GRIDTK_TEST_CONTEXT"] == "grid"
+    assert "GRIDTK_TEST_CONTEXT" not in os.environ
+    assert len(calls.read_text().split()) == 1
+
+    # in-memory cache
+    assert setshell.environ("grid")["GRIDTK_TEST_CONTEXT"] == "grid"
+    assert len(calls.read_text().split()) == 1
+
+    # on-disk cache, as seen by a new process
+    setshell._environ_cache.clear()
+    assert setshell.environ("grid")["GRIDTK_TEST_CONTEXT"] == "grid"
+    assert len(calls.read_text().split()) == 1
+
+    # expired on-disk cache
+    setshell._environ_cache.clear()
+    assert setshell.environ("grid", ttl=-1)["GRIDTK_TEST_CONTEXT"] == "grid"
+    assert len(calls.read_text().split()) == 2
+
+    # forced refresh
+    assert (
+        setshell.environ("grid", refresh=True)["GRIDTK_TEST_CONTEXT"] == "grid"
+    )
+    assert len(calls.read_text().split()) == 3
+
+    setshell.clear_cache("grid")
+    assert not (tmp_path / "cache" / "gridtk" / "setshell-grid.json").exists()
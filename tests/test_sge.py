@@ -0,0 +1,670 @@
+# SPDX-FileCopyrightText: Copyright © 2022 Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+import gridtk.sge
+import gridtk.spool
+import gridtk.tools
+
+from gridtk.models import Job
+from gridtk.script import jman
+
+
+def _calls(fake_grid, command):
+    log = fake_grid / f"{command}.log"
+    if not log.exists():
+        return []
+    with log.open() as f:
+        return [json.loads(line) for line in f]
+
+
+def _jman(tmp_path, *args):
+    return jman.main(
+        [
+            shutil.which("jman"),
+            "--database",
+            str(tmp_path / "database.sql3"),
+        ]
+        + list(args)
+    )
+
+
+def _wait_for(job_manager, condition, timeout=60):
+    """Waits until the condition holds for all jobs in the database, polling
+    the grid like ``jman list`` does."""
+    start = time.time()
+    while time.time() - start < timeout:
+        job_manager.communicate()
+        session = job_manager.lock()
+        jobs = list(session.query(Job).order_by(Job.unique))
+        done = condition(jobs)
+        job_manager.unlock()
+        if done:
+            return
+        time.sleep(0.2)
+    raise RuntimeError("The jobs did not reach the expected state in time")
+
+
+def test_submit_many(tmp_path, fake_grid, monkeypatch):
+    monkeypatch.setenv("FAKEGRID_LATENCY", "1")
+    monkeypatch.setenv("FAKEGRID_QUEUE_LATENCY", "600")
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+
+    # 8 independent jobs, and a chain of 3 jobs
+    submissions = [
+        {"command_line": ["/bin/echo", str(k)], "name": "independent"}
+        for k in range(8)
+    ]
+    submissions += [
+        {"command_line": ["/bin/echo", "chain"], "name": "chain"},
+        {"command_line": ["/bin/echo", "chain"], "after": [8]},
+        {"command_line": ["/bin/echo", "chain"], "after": [8, 9]},
+    ]
+
+    # count the submissions that are running at the same time
+    lock = threading.Lock()
+    running = [0]
+    concurrent = set()
+    grid_submit = job_manager._grid_submit
+
+    def _grid_submit(**kwargs):
+        with lock:
+            running[0] += 1
+            concurrent.add(running[0])
+        try:
+            return grid_submit(**kwargs)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    monkeypatch.setattr(job_manager, "_grid_submit", _grid_submit)
+    job_ids = job_manager.submit_many(
+        submissions, log_dir=str(tmp_path / "logs"), workers=8
+    )
+    assert job_ids == list(range(1, 12))
+    # the independent jobs are submitted concurrently, by at most 8 workers
+    assert 1 < max(concurrent) <= 8
+
+    calls = {call["id"]: call["argv"] for call in _calls(fake_grid, "qsub")}
+    assert len(calls) == 11
+    # the grid ids are returned by qsub, without calling qstat
+    assert not _calls(fake_grid, "qstat")
+
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    assert all(job.status in ("queued", "waiting") for job in jobs)
+    assert len({job.id for job in jobs}) == 11
+    assert all(job.id in calls for job in jobs)
+    assert jobs[0].name == "independent"
+    assert jobs[9].name == "jman"
+    assert jobs[0].queue_name == "all.q"
+
+    # dependent jobs are submitted after, and hold on, the jobs they need
+    argv = calls[jobs[10].id]
+    hold = argv[argv.index("-hold_jid") + 1]
+    assert hold == f"{jobs[8].id},{jobs[9].id}"
+    assert jobs[8].id < jobs[9].id < jobs[10].id
+    assert [j.unique for j in jobs[10].get_jobs_we_wait_for()] == [9, 10]
+    job_manager.unlock()
+
+
+def test_qdel_many(tmp_path, fake_grid, monkeypatch):
+    monkeypatch.setenv("FAKEGRID_QUEUE_LATENCY", "600")
+    logs = str(tmp_path / "logs")
+    job_ids = [gridtk.tools.qsub(["/bin/true"], stdout=logs) for _ in range(4)]
+    array_id = gridtk.tools.qsub(["/bin/true"], array=5, stdout=logs)
+
+    # force several calls to qdel
+    monkeypatch.setattr(gridtk.tools, "_command_line_limit", lambda: 20)
+    failures = gridtk.tools.qdel(job_ids + [9999, f"{array_id}.3"])
+
+    assert failures == {9999: 'denied: job "9999" does not exist'}
+    calls = [call["argv"] for call in _calls(fake_grid, "qdel")]
+    assert len(calls) > 1
+    assert sum(calls, []) == [str(k) for k in job_ids] + [
+        "9999",
+        f"{array_id}.3",
+    ]
+
+    snapshot = gridtk.tools.qstat_all()
+    assert list(snapshot) == [array_id]
+    assert sorted(snapshot[array_id]) == [1, 2, 4, 5]
+
+
+def test_sge(tmp_path, datadir, fake_grid):
+    # This test runs jobs through the SGE job manager, on the fake grid
+    bash = "/bin/bash"
+    log_dir = str(tmp_path / "logs")
+
+    _jman(
+        tmp_path,
+        "submit",
+        "--log-dir",
+        log_dir,
+        "--name",
+        "test_1",
+        bash,
+        str(datadir / "test_script.sh"),
+    )
+    _jman(
+        tmp_path,
+        "submit",
+        "--log-dir",
+        log_dir,
+        "--name",
+        "test_2",
+        "--dependencies",
+        "1",
+        "--parametric",
+        "1-7:2",
+        bash,
+        str(datadir / "test_array.sh"),
+    )
+
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+    _wait_for(
+        job_manager,
+        lambda jobs: all(j.status in ("success", "failure") for j in jobs),
+    )
+
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    assert jobs[0].status == "failure"
+    assert jobs[0].result == 255
+    assert jobs[1].status == "failure"
+    assert [a.result for a in jobs[1].array] == [1, 0, 0, 0]
+    assert all(a.machine_name is not None for a in jobs[1].array)
+    assert os.path.isfile(jobs[0].std_out_file())
+    assert (
+        open(jobs[0].std_out_file()).read().rstrip()
+        == "This is a text message to std-out"
+    )
+    for array_job in jobs[1].array:
+        assert os.path.isfile(array_job.std_out_file())
+    job_manager.unlock()
+
+    # the resources are imported from the accounting in a single call, once
+    # the grid has written it
+    start = time.time()
+    while gridtk.tools.qstat_all() and time.time() - start < 60:
+        time.sleep(0.2)
+    _jman(tmp_path, "accounting")
+    assert len(_calls(fake_grid, "qacct")) == 1
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    assert jobs[0].wall_time is not None
+    assert jobs[0].max_memory > 0
+    assert all(a.wall_time is not None for a in jobs[1].array)
+    assert jobs[1].wall_time == sum(a.wall_time for a in jobs[1].array)
+    job_manager.unlock()
+    assert job_manager.accounting() == 0
+    assert (
+        job_manager.accounting(
+            refresh=True, accounting_file=str(fake_grid / "accounting")
+        )
+        == 2
+    )
+    assert len(_calls(fake_grid, "qacct")) == 1
+
+    _jman(tmp_path, "list", "--print-array-jobs", "--print-times")
+    _jman(tmp_path, "report")
+
+    # a single qstat call per list
+    qstat_calls = len(_calls(fake_grid, "qstat"))
+    _jman(tmp_path, "list")
+    assert len(_calls(fake_grid, "qstat")) == qstat_calls
+
+    _jman(tmp_path, "delete")
+    assert not os.path.exists(tmp_path / "database.sql3")
+
+
+def test_communicate(tmp_path, fake_grid, monkeypatch):
+    # jobs disappearing from the grid are marked as failed
+    monkeypatch.setenv("FAKEGRID_QUEUE_LATENCY", "600")
+    count = 100
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+    job_manager.submit_many(
+        [{"command_line": ["/bin/true"]} for _ in range(count)],
+        log_dir=str(tmp_path / "logs"),
+        workers=16,
+    )
+
+    job_manager.communicate()
+    assert len(_calls(fake_grid, "qstat")) == 1
+
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    assert all(job.status == "queued" for job in jobs)
+    grid_ids = [job.id for job in jobs]
+    job_manager.unlock()
+
+    # delete half of the jobs behind the back of gridtk
+    gridtk.tools.qdel(grid_ids[::2])
+    # ... which is not noticed before the jobs are due to be checked again
+    job_manager.communicate()
+    assert len(_calls(fake_grid, "qstat")) == 1
+    job_manager.communicate(force=True)
+    assert len(_calls(fake_grid, "qstat")) == 2
+
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    assert all(job.status == "failure" for job in jobs[::2])
+    assert all(job.status == "queued" for job in jobs[1::2])
+    job_manager.unlock()
+
+    job_manager.stop_jobs(None)
+    assert len(_calls(fake_grid, "qdel")) == 2
+    assert gridtk.tools.qstat_all() == {}
+
+
+def test_watch(tmp_path, fake_grid):
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+    job_manager.submit_many(
+        [{"command_line": ["/bin/true"]} for _ in range(3)],
+        log_dir=str(tmp_path / "logs"),
+    )
+
+    # while the database is watched, listing does not query the grid
+    job_manager._heartbeat(60)
+    assert job_manager.watcher()["pid"] == os.getpid()
+    _jman(tmp_path, "list")
+    assert not _calls(fake_grid, "qstat")
+
+    _jman(tmp_path, "watch", "--interval", "0.2", "--until-done")
+    assert _calls(fake_grid, "qstat")
+    assert job_manager.watcher() is None
+    session = job_manager.lock()
+    assert all(job.status == "success" for job in session.query(Job))
+    job_manager.unlock()
+
+
+def test_spool(tmp_path, fake_grid):
+    # running jobs write their status into the spool directory
+    database = str(tmp_path / "database.sql3")
+    job_manager = gridtk.sge.JobManagerSGE(database=database, spool=True)
+    job_manager.submit_many(
+        [
+            {"command_line": ["/bin/true"]},
+            {"command_line": ["/bin/false"], "array": (1, 3, 1)},
+        ],
+        log_dir=str(tmp_path / "logs"),
+    )
+    start = time.time()
+    while gridtk.tools.qstat_all() and time.time() - start < 60:
+        time.sleep(0.2)
+
+    # ... which is merged into the database in a single batch
+    session = job_manager.lock()
+    assert all(job.status == "queued" for job in session.query(Job))
+    job_manager.unlock()
+    assert len(gridtk.spool.read(gridtk.spool.directory(database))) == 8
+    assert job_manager.merge_spool() == 8
+    assert gridtk.spool.read(gridtk.spool.directory(database)) == []
+
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    assert jobs[0].status == "success"
+    assert jobs[0].machine_name is not None
+    assert jobs[0].start_time <= jobs[0].finish_time
+    assert [a.result for a in jobs[1].array] == [1, 1, 1]
+    job_manager.unlock()
+
+
+def test_resubmit_array_ids(tmp_path, fake_grid):
+    # only the failed (or selected) array jobs are re-submitted
+    log_dir = str(tmp_path / "logs")
+    marker = tmp_path / "marker"
+    _jman(
+        tmp_path,
+        "submit",
+        "--log-dir",
+        log_dir,
+        "--name",
+        "array",
+        "--parametric",
+        "6",
+        "/bin/sh",
+        "-c",
+        'echo "$SGE_TASK_ID $SGE_TASK_LAST"; test -e "$0" && exit 0; '
+        'case "$SGE_TASK_ID" in 2|3|5) exit 1;; esac',
+        str(marker),
+    )
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+
+    def _finished(jobs):
+        return all(j.status in ("success", "failure") for j in jobs)
+
+    def _array_jobs():
+        session = job_manager.lock()
+        job = session.query(Job).one()
+        array = [(a.id, a.result, a.std_out_file()) for a in job.array]
+        job_manager.unlock()
+        return array
+
+    _wait_for(job_manager, _finished)
+    first = _array_jobs()
+    assert [a[1] for a in first] == [0, 1, 1, 0, 1, 0]
+
+    # the failed array jobs are mapped to a new array job
+    marker.touch()
+    _jman(tmp_path, "resubmit", "--failed-only")
+    calls = [call["argv"] for call in _calls(fake_grid, "qsub")]
+    assert calls[-1][calls[-1].index("-t") + 1] == "1-3:1"
+    _wait_for(job_manager, _finished)
+    second = _array_jobs()
+    assert [a[1] for a in second] == [0] * 6
+    for old, new in zip(first, second):
+        # the log files of the successful array jobs are kept
+        assert (old[2] == new[2]) == (old[1] == 0)
+        assert open(new[2]).read().rstrip() == "%d 6" % new[0]
+
+    # selected array jobs forming a range are re-submitted as such
+    _jman(tmp_path, "resubmit", "--also-success", "--array-ids", "4", "6")
+    calls = [call["argv"] for call in _calls(fake_grid, "qsub")]
+    assert calls[-1][calls[-1].index("-t") + 1] == "4-6:2"
+    _wait_for(job_manager, _finished)
+    third = _array_jobs()
+    assert [a[1] for a in third] == [0] * 6
+    assert [a[2] == b[2] for a, b in zip(second, third)] == [
+        True,
+        True,
+        True,
+        False,
+        True,
+        False,
+    ]
+
+
+def test_lean_runner(tmp_path, fake_grid):
+    # the lean runner records the results of array jobs and of remapped tasks
+    log_dir = str(tmp_path / "logs")
+    marker = tmp_path / "marker"
+    _jman(
+        tmp_path,
+        "submit",
+        "--lean",
+        "--log-dir",
+        log_dir,
+        "--array",
+        "1-5",
+        "/bin/sh",
+        "-c",
+        'test -e "$0" || case "$SGE_TASK_ID" in 2|3|5) exit 1;; esac',
+        str(marker),
+    )
+    _jman(
+        tmp_path,
+        "submit",
+        "--lean",
+        "--log-dir",
+        log_dir,
+        "--dependencies",
+        "1",
+        "--",
+        "/bin/true",
+    )
+    calls = [call["argv"] for call in _calls(fake_grid, "qsub")]
+    assert all(argv[-1] == "--lean" for argv in calls)
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+
+    def _finished(jobs):
+        return all(j.status in ("success", "failure") for j in jobs)
+
+    def _results():
+        session = job_manager.lock()
+        jobs = list(session.query(Job).order_by(Job.unique))
+        results = [(j.status, [a.result for a in j.array]) for j in jobs]
+        job_manager.unlock()
+        return results
+
+    _wait_for(job_manager, _finished)
+    assert _results() == [("failure", [0, 1, 1, 0, 1]), ("success", [])]
+
+    marker.touch()
+    _jman(tmp_path, "resubmit", "--lean", "--failed-only", "--job-ids", "1")
+    calls = [call["argv"] for call in _calls(fake_grid, "qsub")]
+    assert calls[-1][calls[-1].index("-t") + 1] == "1-3:1"
+    _wait_for(job_manager, _finished)
+    assert _results() == [("success", [0] * 5), ("success", [])]
+
+
+def test_auto_memory(tmp_path, fake_grid):
+    # the memory of re-submitted jobs is set from their peak memory
+    _jman(
+        tmp_path,
+        "submit",
+        "--log-dir",
+        str(tmp_path / "logs"),
+        sys.executable,
+        "-c",
+        "b = bytearray(300 * 2**20)",
+    )
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+    _wait_for(job_manager, lambda jobs: jobs[0].status == "success")
+    start = time.time()
+    while gridtk.tools.qstat_all() and time.time() - start < 60:
+        time.sleep(0.2)
+
+    def _memory(call):
+        return [call[i + 1] for i, arg in enumerate(call[:-1]) if arg == "-l"]
+
+    # the peak memory is imported from the accounting of the grid, and
+    # requested per slot
+    _jman(
+        tmp_path,
+        "resubmit",
+        "--also-success",
+        "--queue",
+        "q1dm",
+        "--parallel",
+        "2",
+        "--auto-memory",
+        "10",
+    )
+    assert len(_calls(fake_grid, "qacct")) == 1
+    with open(fake_grid / "accounting") as f:
+        peak = int(f.readlines()[-1].split(":")[42])
+    assert peak >= 300 * 2**20
+    memory = math.ceil(peak * 10 / 2 / 2**30)
+    call = _calls(fake_grid, "qsub")[-1]["argv"]
+    assert "mem_free=%dG" % (2 * memory) in _memory(call)
+    assert "h_vmem=%dG" % memory in _memory(call)
+
+    # the memory is limited to what the queue provides
+    job_manager.lock()
+    job = job_manager.session.query(Job).one()
+    job.status, job.max_memory = "failure", peak
+    job_manager.session.commit()
+    job_manager.unlock()
+    _jman(tmp_path, "resubmit", "--queue", "gpu", "--auto-memory", "200")
+    call = _calls(fake_grid, "qsub")[-1]["argv"]
+    assert "gpumem=24" in _memory(call)
+    assert not any(m.startswith("mem_free") for m in _memory(call))
+
+
+def test_auto_queue(tmp_path, fake_grid):
+    # the queue is chosen from the run times of earlier runs of a job
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+
+    def _submit(name):
+        _jman(
+            tmp_path,
+            "submit",
+            "--log-dir",
+            str(tmp_path / "logs"),
+            "-q",
+            "auto",
+            "-n",
+            name,
+            "/bin/true",
+        )
+        _wait_for(
+            job_manager, lambda jobs: all(j.status == "success" for j in jobs)
+        )
+        call = _calls(fake_grid, "qsub")[-1]["argv"]
+        return call[call.index("-l") + 1]
+
+    def _set_run_times(*hours):
+        session = job_manager.lock()
+        jobs = session.query(Job).filter(Job.name == "job").order_by(Job.id)
+        for job, h in zip(jobs, hours):
+            job.finish_time = job.start_time + timedelta(hours=h)
+        session.commit()
+        job_manager.unlock()
+
+    # without earlier runs, the queue of a week is chosen
+    assert _submit("job") == "q1w"
+    _set_run_times(2)
+    assert _submit("job") == "q1d"
+    _set_run_times(2, 72)
+    assert _submit("job") == "q1w"
+    assert _submit("other") == "q1w"
+
+
+def test_extra_args_queue(tmp_path, fake_grid):
+    # the queue requested by the extra arguments to qsub is recorded
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+    log_dir = str(tmp_path / "logs")
+    for extra_args in ("-l q1wm -P project", "-q q1d@host"):
+        job_manager.submit(
+            ["/bin/true"], log_dir=log_dir, sge_extra_args=extra_args
+        )
+    job_manager.submit(
+        ["/bin/true"], log_dir=log_dir, sge_extra_args="-l h_vmem=4G"
+    )
+    session = job_manager.lock()
+    queues = [job.queue_name for job in session.query(Job).order_by(Job.id)]
+    job_manager.unlock()
+    assert queues == ["q1wm", "q1d", "all.q"]
+
+    # ... and is not replaced by the one chosen for the queue ``auto``
+    job_manager.submit(
+        ["/bin/true"], log_dir=log_dir, queue="auto", sge_extra_args="-q q1m"
+    )
+    call = _calls(fake_grid, "qsub")[-1]["argv"]
+    assert "-l" not in call and call[call.index("-q") + 1] == "q1m"
+    session = job_manager.lock()
+    assert (
+        session.query(Job).order_by(Job.id.desc()).first().queue_name == "q1m"
+    )
+    job_manager.unlock()
+
+
+def test_next_check(tmp_path, fake_grid):
+    # jobs are checked less often the longer they wait or run
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+    now = datetime.now()
+    job = Job(["/bin/true"], queue_name="q1d", kwargs={})
+    job.status = "queued"
+
+    def _interval():
+        return (job_manager._next_check(job, now) - now).total_seconds()
+
+    job.submit_time = now
+    assert _interval() == 10
+    job.submit_time = now - timedelta(seconds=100)
+    assert _interval() == 50
+    job.submit_time = now - timedelta(days=2)
+    assert _interval() == 600
+
+    # running jobs are checked right after the time limit of their queue
+    job.status = "executing"
+    job.start_time = now - timedelta(seconds=86400 - 30)
+    assert _interval() == 90
+    job.start_time = now - timedelta(seconds=200)
+    assert _interval() == 100
+
+    # ... or right after the run time they requested
+    job = Job(
+        ["/bin/true"],
+        queue_name="q1d",
+        kwargs={"sge_extra_args": "-l h_rt=0:5:00,h_vmem=4G"},
+    )
+    job.status = "executing"
+    job.submit_time = job.start_time = now - timedelta(seconds=280)
+    assert _interval() == 80
+
+
+def test_pack(tmp_path, fake_grid, monkeypatch):
+    # independent jobs are packed into a single array job
+    log_dir = str(tmp_path / "logs")
+    parameters = tmp_path / "parameters.txt"
+    parameters.write_text("0\n1\n0\n2\n")
+    _jman(
+        tmp_path,
+        "submit",
+        "--log-dir",
+        log_dir,
+        "--pack",
+        "--from-file",
+        str(parameters),
+        "/bin/sh",
+        "-c",
+        'echo "$0 $SGE_TASK_ID"; exit $0',
+    )
+    calls = [call["argv"] for call in _calls(fake_grid, "qsub")]
+    assert len(calls) == 1
+    assert calls[0][calls[0].index("-t") + 1] == "1-4:1"
+
+    job_manager = gridtk.sge.JobManagerSGE(
+        database=str(tmp_path / "database.sql3")
+    )
+    _wait_for(
+        job_manager,
+        lambda jobs: all(j.status in ("success", "failure") for j in jobs),
+    )
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    assert len({job.id for job in jobs}) == 1
+    assert [job.pack_index for job in jobs] == [1, 2, 3, 4]
+    assert [job.result for job in jobs] == [0, 1, 0, 2]
+    for job, parameter in zip(jobs, "0102"):
+        # the packed job does not see the task of the array job
+        assert (
+            open(job.std_out_file()).read().rstrip() == f"{parameter} undefined"
+        )
+    job_manager.unlock()
+
+    # packed jobs are stopped one by one
+    monkeypatch.setenv("FAKEGRID_QUEUE_LATENCY", "600")
+    job_ids = job_manager.submit_many(
+        [{"command_line": ["/bin/true"]} for _ in range(3)],
+        log_dir=log_dir,
+        pack=True,
+    )
+    session = job_manager.lock()
+    grid_id = session.query(Job).filter(Job.unique == job_ids[1]).one().id
+    job_manager.unlock()
+    job_manager.stop_jobs([job_ids[1]])
+    assert _calls(fake_grid, "qdel")[-1]["argv"] == [f"{grid_id}.2"]
+    assert sorted(gridtk.tools.qstat_all()[grid_id]) == [1, 3]
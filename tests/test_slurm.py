@@ -0,0 +1,204 @@
+# SPDX-FileCopyrightText: Copyright © 2022 Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import os
+import shutil
+import time
+
+import pytest
+
+import gridtk.slurm
+import gridtk.tools
+
+from gridtk.models import Job
+from gridtk.script import jman
+
+
+def _calls(fake_grid, command):
+    log = fake_grid / f"{command}.log"
+    if not log.exists():
+        return []
+    with log.open() as f:
+        return [json.loads(line) for line in f]
+
+
+def _jman(tmp_path, *args):
+    return jman.main(
+        [
+            shutil.which("jman"),
+            "--database",
+            str(tmp_path / "database.sql3"),
+            "--backend",
+            "slurm",
+        ]
+        + list(args)
+    )
+
+
+def test_sge_environment():
+    assert gridtk.slurm.sge_environment({}) == {}
+    assert gridtk.slurm.sge_environment({"SLURM_JOB_ID": "12"}) == {
+        "JOB_ID": "12",
+        "JOB_NAME": "",
+        "NSLOTS": "1",
+        "SGE_TASK_ID": "undefined",
+    }
+    environ = gridtk.slurm.sge_environment(
+        {
+            "SLURM_JOB_ID": "15",
+            "SLURM_JOB_NAME": "test",
+            "SLURM_CPUS_PER_TASK": "4",
+            "SLURM_ARRAY_JOB_ID": "12",
+            "SLURM_ARRAY_TASK_ID": "3",
+            "SLURM_ARRAY_TASK_MIN": "1",
+            "SLURM_ARRAY_TASK_MAX": "7",
+            "SLURM_ARRAY_TASK_STEP": "2",
+        }
+    )
+    assert environ == {
+        "JOB_ID": "12",
+        "JOB_NAME": "test",
+        "NSLOTS": "4",
+        "SGE_TASK_ID": "3",
+        "SGE_TASK_FIRST": "1",
+        "SGE_TASK_LAST": "7",
+        "SGE_TASK_STEPSIZE": "2",
+    }
+
+
+def test_slurm(tmp_path, datadir, fake_grid):
+    # This test runs jobs through the Slurm job manager, on the fake cluster
+    bash = "/bin/bash"
+    log_dir = str(tmp_path / "logs")
+
+    _jman(
+        tmp_path,
+        "submit",
+        "--log-dir",
+        log_dir,
+        "--name",
+        "test_1",
+        "--queue",
+        "q1d",
+        "--memory",
+        "4G",
+        bash,
+        str(datadir / "test_script.sh"),
+    )
+    _jman(
+        tmp_path,
+        "submit",
+        "--log-dir",
+        log_dir,
+        "--name",
+        "test_2",
+        "--dependencies",
+        "1",
+        "--parametric",
+        "1-7:2",
+        bash,
+        str(datadir / "test_array.sh"),
+    )
+
+    calls = [call["argv"] for call in _calls(fake_grid, "sbatch")]
+    assert len(calls) == 2
+    assert calls[0][calls[0].index("--time") + 1] == "1-00:00:00"
+    assert calls[0][calls[0].index("--mem") + 1] == "4G"
+    assert calls[1][calls[1].index("--array") + 1] == "1-7:2"
+    assert calls[1][calls[1].index("--dependency") + 1] == "afterany:1001"
+
+    job_manager = gridtk.slurm.JobManagerSlurm(
+        database=str(tmp_path / "database.sql3")
+    )
+    start = time.time()
+    while time.time() - start < 60:
+        job_manager.communicate()
+        session = job_manager.lock()
+        jobs = list(session.query(Job).order_by(Job.unique))
+        finished = all(j.status in ("success", "failure") for j in jobs)
+        job_manager.unlock()
+        if finished:
+            break
+        time.sleep(0.2)
+
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    assert [job.id for job in jobs] == [1001, 1002]
+    assert jobs[0].status == "failure"
+    assert jobs[0].result == 255
+    assert jobs[0].queue_name == "q1d"
+    assert jobs[1].status == "failure"
+    assert [a.result for a in jobs[1].array] == [1, 0, 0, 0]
+    assert (
+        open(jobs[0].std_out_file()).read().rstrip()
+        == "This is a text message to std-out"
+    )
+    for array_job in jobs[1].array:
+        assert (
+            open(array_job.std_out_file()).read().rstrip()
+            == "The job id is '1002' and the task id is '%d'" % array_job.id
+        )
+    job_manager.unlock()
+
+    # the resources are imported from the accounting of the cluster
+    start = time.time()
+    while gridtk.tools.squeue_all() and time.time() - start < 60:
+        time.sleep(0.2)
+    _jman(tmp_path, "accounting")
+    assert len(_calls(fake_grid, "sacct")) == 1
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    for job in [jobs[0]] + list(jobs[1].array):
+        assert job.wall_time is not None and job.max_memory > 0
+        assert job.machine_name is not None
+    assert jobs[1].wall_time == sum(a.wall_time for a in jobs[1].array)
+    job_manager.unlock()
+    with pytest.raises(ValueError):
+        job_manager.accounting(refresh=True, accounting_file="accounting")
+
+    _jman(tmp_path, "list", "--print-array-jobs")
+    _jman(tmp_path, "delete")
+    assert not os.path.exists(tmp_path / "database.sql3")
+
+
+def test_communicate(tmp_path, fake_grid, monkeypatch):
+    # jobs disappearing from the cluster are marked as failed
+    monkeypatch.setenv("FAKEGRID_QUEUE_LATENCY", "600")
+    job_manager = gridtk.slurm.JobManagerSlurm(
+        database=str(tmp_path / "database.sql3")
+    )
+    job_manager.submit_many(
+        [{"command_line": ["/bin/true"]} for _ in range(10)],
+        log_dir=str(tmp_path / "logs"),
+    )
+
+    job_manager.communicate()
+    assert len(_calls(fake_grid, "squeue")) == 1
+    assert not _calls(fake_grid, "sacct")
+
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    assert all(job.status == "queued" for job in jobs)
+    assert all(job.name == "jman" for job in jobs)
+    grid_ids = [job.id for job in jobs]
+    job_manager.unlock()
+
+    # cancel half of the jobs behind the back of gridtk
+    assert gridtk.tools.scancel(grid_ids[::2] + [9999]) == {
+        9999: "scancel: error: Kill job error on job id 9999: Invalid job id specified"
+    }
+    job_manager.communicate(force=True)
+    assert len(_calls(fake_grid, "squeue")) == 2
+    assert len(_calls(fake_grid, "sacct")) == 1
+
+    session = job_manager.lock()
+    jobs = list(session.query(Job).order_by(Job.unique))
+    assert all(job.status == "failure" for job in jobs[::2])
+    assert all(job.status == "queued" for job in jobs[1::2])
+    job_manager.unlock()
+
+    job_manager.stop_jobs(None)
+    assert len(_calls(fake_grid, "scancel")) == 2
+    assert gridtk.tools.squeue_all() == {}
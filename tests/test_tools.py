@@ -2,9 +2,27 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import io
 import os
 
-from gridtk.tools import get_array_job_slice
+import pytest
+
+from gridtk.tools import (
+    copy_log,
+    get_array_file_line,
+    get_array_job_slice,
+    granted_slots,
+    grep_log,
+    index_lines,
+    iter_array_job_items,
+    parallel_map,
+    parse_accounting,
+    parse_qacct,
+    parse_qstat_xml,
+    parse_sacct_resources,
+    pe_slots,
+    read_log,
+)
 
 
 class SGE_EnvWrapper:
@@ -67,3 +85,204 @@ def test_get_array_job_slice():
         wrapper.set("SGE_TASK_ID", 5)
         s = get_array_job_slice(10)
         assert s == slice(8, 10)
+
+        # the chunks are balanced
+        wrapper.set("SGE_TASK_LAST", 4)
+        chunks = []
+        for task in range(1, 5):
+            wrapper.set("SGE_TASK_ID", task)
+            chunks.append(get_array_job_slice(10))
+        assert chunks == [slice(0, 2), slice(2, 5), slice(5, 7), slice(7, 10)]
+
+        # any array job with a step size is supported
+        wrapper.set("SGE_TASK_FIRST", 10)
+        wrapper.set("SGE_TASK_LAST", 20)
+        wrapper.set("SGE_TASK_STEPSIZE", 5)
+        wrapper.set("SGE_TASK_ID", 15)
+        assert get_array_job_slice(9) == slice(3, 6)
+        wrapper.set("SGE_TASK_ID", 16)
+        with pytest.raises(ValueError):
+            get_array_job_slice(9)
+
+        # the chunks can be balanced by the cost of each item
+        weights = [10, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
+        chunks = []
+        for task in (10, 15, 20):
+            wrapper.set("SGE_TASK_ID", task)
+            chunks.append(get_array_job_slice(len(weights), weights))
+        assert chunks == [slice(0, 1), slice(1, 6), slice(6, 11)]
+
+
+def test_iter_array_job_items():
+    assert list(iter_array_job_items(range(5))) == list(range(5))
+    with SGE_EnvWrapper(SGE_TASK_ID=3, SGE_TASK_LAST=3):
+        assert list(iter_array_job_items(iter(range(10)))) == [2, 5, 8]
+
+
+def test_get_array_file_line(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    path = tmp_path / "parameters.txt"
+    path.write_text("a 1\n\n# comment\nb 2\nc 3")
+    assert index_lines(str(path)) == 3
+    # the index is kept in the cache, not next to the file
+    assert sorted(os.listdir(tmp_path)) == ["cache", "parameters.txt"]
+    assert get_array_file_line(str(path), 1) == "a 1"
+    assert get_array_file_line(str(path), 3) == "c 3"
+    with SGE_EnvWrapper(SGE_TASK_ID=2, SGE_TASK_LAST=3):
+        assert get_array_file_line(str(path)) == "b 2"
+    with pytest.raises(IndexError):
+        get_array_file_line(str(path), 4)
+
+    # the index needs to be rebuilt when the file changes
+    path.write_text("a 1\nb 2\nc 3\nd 4")
+    with pytest.raises(RuntimeError):
+        get_array_file_line(str(path), 4)
+    assert index_lines(str(path)) == 4
+    assert get_array_file_line(str(path), 4) == "d 4"
+    # the index of the earlier version of the file is removed
+    assert len(os.listdir(tmp_path / "cache" / "gridtk")) == 1
+
+    # machines that do not share the cache directory index the file again
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "other"))
+    assert get_array_file_line(str(path), 2) == "b 2"
+    assert len(os.listdir(tmp_path / "other" / "gridtk")) == 1
+    # ... or read it from its start, if they cannot
+    (tmp_path / "readonly").write_text("")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "readonly"))
+    assert get_array_file_line(str(path), 3) == "c 3"
+    with pytest.raises(IndexError):
+        get_array_file_line(str(path), 5)
+
+
+def test_read_log(tmp_path):
+    path = tmp_path / "job.o1"
+    path.write_text("1\n2\n3\n\n")
+    assert read_log(str(path)) == "1\n2\n3"
+    assert read_log(str(path), head=2) == "1\n2"
+    assert read_log(str(path), tail=2) == "2\n3"
+    assert read_log(str(path), tail=5) == read_log(str(path), head=5)
+    assert read_log(str(path), head=0) == read_log(str(path), tail=0) == ""
+    path.write_text("")
+    assert read_log(str(path), tail=1) == ""
+
+    path.write_text("a \nb\t\n\n")
+    stream = io.StringIO()
+    copy_log(str(path), stream, chunk_size=2)
+    assert stream.getvalue() == "a \nb\n"
+
+
+def test_grep_log(tmp_path):
+    path = tmp_path / "job.e1"
+    path.write_text("start\nTraceback (most recent call last):\n  x = 1\n\n")
+    path.write_text(path.read_text() + "ValueError: x\nend")
+    assert grep_log(str(path)) == [
+        (2, 6, "Traceback (most recent call last):"),
+        (5, 50, "ValueError: x"),
+    ]
+    assert grep_log(str(path), "x") == [
+        (3, 41, "x = 1"),
+        (5, 50, "ValueError: x"),
+    ]
+    assert grep_log(str(path), "^$") == [(4, 49, "")]
+    assert grep_log(str(path), "^end") == [(6, 64, "end")]
+    path.write_text("")
+    assert grep_log(str(path)) == []
+
+
+def test_parallel_map(monkeypatch):
+    monkeypatch.delenv("NSLOTS", raising=False)
+    assert granted_slots() == 1
+    # a single slot runs serially, even functions that cannot be pickled
+    assert parallel_map(lambda x: x * 2, range(5)) == [0, 2, 4, 6, 8]
+
+    monkeypatch.setenv("NSLOTS", "3")
+    assert granted_slots() == 3
+    assert parallel_map(abs, range(-10, 10)) == [abs(i) for i in range(-10, 10)]
+    assert parallel_map(abs, [], chunksize=2) == []
+    assert pe_slots("pe_mth 4") == 4
+    assert pe_slots(None) == 1
+
+
+def test_parse_qstat_xml(datadir):
+    with (datadir / "qstat.xml").open("rb") as f:
+        snapshot = parse_qstat_xml(f)
+
+    assert sorted(snapshot) == [4711, 4712, 4713]
+    assert list(snapshot[4711]) == [None]
+    assert snapshot[4711][None]["state"] == "r"
+    assert snapshot[4711][None]["queue_name"] == "q1d@node01"
+    assert sorted(snapshot[4712]) == [1, 3, 5, 7]
+    assert snapshot[4712][1]["state"] == "r"
+    assert snapshot[4712][5]["state"] == "qw"
+    assert snapshot[4713][None]["JB_name"] == "evaluate"
+
+
+def test_parse_accounting(datadir):
+    with (datadir / "accounting.txt").open() as f:
+        resources = parse_accounting(f, {4711, 4712})
+
+    assert sorted(resources) == [4711, 4712]
+    # the latest entry of a re-used job id is kept
+    assert resources[4711] == {
+        None: {
+            "wall_time": 3600.0,
+            "cpu_time": 3500.25,
+            "max_memory": 2 * 1024**3,
+            "hostname": "node01",
+        }
+    }
+    assert sorted(resources[4712]) == [1, 3]
+    assert resources[4712][3]["max_memory"] == 700 * 1024**2
+
+    output = """==============================================================
+qname        q1d
+hostname     node02.idiap.ch
+jobnumber    4712
+taskid       1
+ru_wallclock 60.000s
+cpu          55.000s
+maxvmem      500.000M
+==============================================================
+qname        all.q
+hostname     node04
+jobnumber    99
+taskid       undefined
+ru_wallclock 1s
+cpu          1.000s
+maxvmem      1.000K
+"""
+    resources = parse_qacct(output.split("\n"))
+    assert resources[4712][1] == {
+        "wall_time": 60.0,
+        "cpu_time": 55.0,
+        "max_memory": 500 * 1024**2,
+        "hostname": "node02",
+    }
+    assert resources[99][None]["max_memory"] == 1024
+
+    output = """4711|1-01:00:00|2-00:30:00||node01.idiap.ch
+4711.batch|1-01:00:00|2-00:30:00|2048K|node01.idiap.ch
+4711.extern|1-01:00:00|00:00.100|1024K|node01.idiap.ch
+4712_3|01:00|00:55.500||node02
+4712_3.batch|01:00|00:55.500|1.5G|node02
+4712_[4-7]|00:00:00|00:00:00||None assigned
+"""
+    resources = parse_sacct_resources(output.split("\n"))
+    assert resources == {
+        4711: {
+            None: {
+                "wall_time": 90000.0,
+                "cpu_time": 174600.0,
+                "max_memory": 2 * 1024**2,
+                "hostname": "node01",
+            }
+        },
+        4712: {
+            3: {
+                "wall_time": 60.0,
+                "cpu_time": 55.5,
+                "max_memory": 3 * 1024**3 // 2,
+                "hostname": "node02",
+            }
+        },
+    }